@@ -1,10 +1,10 @@
+from collections import defaultdict
 import copy
-import functools
-import heapq
-import itertools
 
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.models.functions import Cast, Lower
 import six
 
 
@@ -76,7 +76,12 @@ class GenericKeyMixin(object):
 
 
 class SummaryQuerySet(object):
-    """ Fake queryset that emulates union of different models querysets """
+    """ Fake queryset that emulates union of different models querysets.
+
+        Querysets are combined with one UNION ALL query of (model, id, ordering key) projections,
+        so ordering, limit and offset are applied by database. Only objects of selected slice
+        are fetched, with one query per model.
+    """
 
     def __init__(self, summary_models):
         self.querysets = [model.objects.all() for model in summary_models]
@@ -100,7 +105,12 @@ class SummaryQuerySet(object):
         return self
 
     def count(self):
-        return sum([qs.count() for qs in self.querysets])
+        sql, params = self._get_union_sql()
+        if not sql:
+            return 0
+        with self._get_connection().cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM (%s) AS summary' % sql, params)
+            return cursor.fetchone()[0]
 
     def all(self):
         return self
@@ -112,82 +122,164 @@ class SummaryQuerySet(object):
             return
 
     def __getitem__(self, val):
-        chained_querysets = self._get_chained_querysets()
         if isinstance(val, slice):
-            return list(itertools.islice(chained_querysets, val.start, val.stop))
+            start = val.start or 0
+            limit = None if val.stop is None else val.stop - start
+            if limit is not None and limit <= 0:
+                return []
+            return self._get_objects(self._get_rows(start, limit))
         else:
-            try:
-                return next(itertools.islice(chained_querysets, val, val + 1))
-            except StopIteration:
+            objects = self._get_objects(self._get_rows(val, 1))
+            if not objects:
                 raise IndexError
+            return objects[0]
+
+    def __iter__(self):
+        return iter(self[:])
 
     def __len__(self):
-        return sum([q.count() for q in self.querysets])
+        return self.count()
 
-    def _get_chained_querysets(self):
+    def _get_connection(self):
+        try:
+            return connections[self.querysets[0].db]
+        except IndexError:
+            return connections[DEFAULT_DB_ALIAS]
+
+    def _get_ordering(self):
+        """ Return explicit ordering or ordering that is common for all querysets.
+            Querysets without explicit ordering are ordered by Meta.ordering of their models.
+        """
         if self._order_by:
-            return self._merge([qs.iterator() for qs in self.querysets], compared_attr=self._order_by)
+            return self._order_by
+        orderings = set()
+        for qs in self.querysets:
+            ordering = qs.query.order_by
+            if not ordering and qs.query.default_ordering:
+                ordering = qs.model._meta.ordering
+            orderings.add(tuple(ordering))
+        if len(orderings) == 1:
+            ordering = orderings.pop()
+            if ordering and isinstance(ordering[0], six.string_types) and ordering[0] != '?':
+                return ordering[0]
+
+    def _get_ordering_field(self, model, path):
+        """ Return single-valued field of model by ordering path or None if there is no such field """
+        field = None
+        for name in path.split('__'):
+            if field is not None:
+                if not field.is_relation:
+                    return None
+                model = field.related_model
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if field.many_to_many or field.one_to_many:
+                return None
+        if field.is_relation:
+            field = field.target_field
+        return field
+
+    def _get_ordering_type(self, field):
+        """ Return family of field type, values of one family could be compared with each other """
+        if isinstance(field, (models.CharField, models.TextField)):
+            return 'text'
+        if isinstance(field, (models.AutoField, models.IntegerField)):
+            return 'integer'
+        return field.get_internal_type()
+
+    def _get_ordering_expressions(self, path):
+        """ Return expression of ordering key for each queryset.
+
+            Strings are compared case-insensitively. Models that do not have such single-valued
+            field are ordered as if its value is NULL. All keys have the same type, because
+            UNION requires it: if fields of models have different types, keys are compared as text.
+        """
+        fields = [self._get_ordering_field(qs.model, path) for qs in self.querysets]
+        types = set(self._get_ordering_type(field) for field in fields if field is not None)
+        if not types:
+            return [models.Value(None) for _ in fields]
+
+        if len(types) > 1 or types == {'text'}:
+            output_field = models.TextField()
+        elif types == {'integer'}:
+            output_field = models.BigIntegerField()
         else:
-            return itertools.chain(*[qs.iterator() for qs in self.querysets])
-
-    def _merge(self, subsequences, compared_attr='pk'):
-
-        @functools.total_ordering
-        class Compared(object):
-            """ Order objects by their attributes, reverse ordering if <reverse> is True """
-
-            def __init__(self, obj, attr, reverse=False):
-                self.attr = functools.reduce(Compared.get_obj_attr, attr.split("__"), obj)
-                if isinstance(self.attr, six.string_types):
-                    self.attr = self.attr.lower()
-                self.reverse = reverse
-
-            @staticmethod
-            def get_obj_attr(obj, attr):
-                # for m2m relationship support - get first instance of manager.
-                # for example: get first project group if resource has to be ordered by project groups.
-                if isinstance(obj, models.Manager):
-                    obj = obj.first()
-                return getattr(obj, attr) if obj else None
-
-            def __eq__(self, other):
-                return self.attr == other.attr
-
-            def __le__(self, other):
-                # In MySQL NULL values come *first* with ascending sort order.
-                # We use the same behaviour.
-                if self.attr is None:
-                    return not self.reverse
-                elif other.attr is None:
-                    return self.reverse
-                else:
-                    return self.attr < other.attr if not self.reverse else self.attr >= other.attr
-
-        reverse = compared_attr.startswith('-')
-        if reverse:
-            compared_attr = compared_attr[1:]
-
-        # prepare a heap whose items are
-        # (compared, current-value, iterator), one each per (non-empty) subsequence
-        # <compared> is used for model instances comparison based on given attribute
-        heap = []
-        for subseq in subsequences:
-            iterator = iter(subseq)
-            for current_value in iterator:
-                # subseq is not empty, therefore add this subseq's item to the list
-                heapq.heappush(
-                    heap, (Compared(current_value, compared_attr, reverse=reverse), current_value, iterator))
-                break
-
-        while heap:
-            # get and yield lowest current value (and corresponding iterator)
-            _, current_value, iterator = heap[0]
-            yield current_value
-            for current_value in iterator:
-                # subseq is not finished, therefore add this subseq's item back into the priority queue
-                heapq.heapreplace(
-                    heap, (Compared(current_value, compared_attr, reverse=reverse), current_value, iterator))
-                break
+            output_field = copy.deepcopy(next(field for field in fields if field is not None))
+
+        expressions = []
+        for field in fields:
+            if field is None:
+                expressions.append(Cast(models.Value(None), output_field))
+            elif isinstance(field, (models.CharField, models.TextField)):
+                expressions.append(Cast(Lower(path), output_field))
+            elif len(types) > 1:
+                expressions.append(Cast(path, output_field))
+            else:
+                expressions.append(models.F(path))
+        return expressions
+
+    def _get_union_sql(self, ordering=None):
+        parts = []
+        params = []
+        if ordering:
+            ordering_expressions = self._get_ordering_expressions(ordering.lstrip('-'))
+        for index, queryset in enumerate(self.querysets):
+            projection = queryset.order_by().annotate(summary_id=models.F('pk'))
+            columns = ['summary_id']
+            if ordering:
+                projection = projection.annotate(summary_order=ordering_expressions[index])
+                columns.append('summary_order')
+            projection = projection.values(*columns)
+
+            try:
+                sql, projection_params = projection.query.get_compiler(queryset.db).as_sql()
+            except EmptyResultSet:
+                continue
+            parts.append('SELECT %s AS summary_model, %s FROM (%s) AS summary_%s' % (
+                index, ', '.join(columns), sql, index))
+            params.extend(projection_params)
+
+        return ' UNION ALL '.join(parts), params
+
+    def _get_rows(self, offset=0, limit=None):
+        """ Return list of (queryset index, object id) pairs for given slice of union """
+        ordering = self._get_ordering()
+        sql, params = self._get_union_sql(ordering)
+        if not sql:
+            return []
+
+        order_by = ['summary_model', 'summary_id']
+        if ordering:
+            # NULL values come first with ascending sort order, as they do in MySQL.
+            if ordering.startswith('-'):
+                order_by = ['CASE WHEN summary_order IS NULL THEN 1 ELSE 0 END', 'summary_order DESC'] + order_by
             else:
-                # subseq has been exhausted, therefore remove it from the queue
-                heapq.heappop(heap)
+                order_by = ['CASE WHEN summary_order IS NULL THEN 0 ELSE 1 END', 'summary_order ASC'] + order_by
+        sql = 'SELECT summary_model, summary_id FROM (%s) AS summary ORDER BY %s' % (sql, ', '.join(order_by))
+
+        connection = self._get_connection()
+        if limit is None and offset:
+            limit = connection.ops.no_limit_value()
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        if offset:
+            sql += ' OFFSET %d' % offset
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def _get_objects(self, rows):
+        """ Fetch objects for (queryset index, object id) pairs preserving their order """
+        ids = defaultdict(list)
+        for index, pk in rows:
+            ids[index].append(pk)
+
+        objects = {}
+        for index, pks in ids.items():
+            for obj in self.querysets[index].filter(pk__in=pks):
+                objects[(index, obj.pk)] = obj
+
+        return [objects[row] for row in rows if row in objects]
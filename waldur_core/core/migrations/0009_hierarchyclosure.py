@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0008_sshpublickey_is_shared'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HierarchyClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_object_id', models.PositiveIntegerField()),
+                ('descendant_object_id', models.PositiveIntegerField()),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('ancestor_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('descendant_content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='hierarchyclosure',
+            unique_together=set([('descendant_content_type', 'descendant_object_id', 'ancestor_content_type', 'ancestor_object_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='hierarchyclosure',
+            index_together=set([('ancestor_content_type', 'ancestor_object_id')]),
+        ),
+    ]
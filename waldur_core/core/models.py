@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from collections import defaultdict
 from datetime import datetime
 import logging
 import re
@@ -12,10 +13,11 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin, UserManager
+from django.contrib.contenttypes.models import ContentType
 from django.core import validators
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone as django_timezone
 from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.lru_cache import lru_cache
@@ -411,6 +413,7 @@ class ReversionMixin(object):
 class DescendantMixin(object):
     """ Mixin to provide child-parent relationships.
         Each related model can provide list of its parents/children.
+        Ancestors and descendants of models registered in HierarchyClosure are looked up in closure table.
     """
 
     def get_parents(self):
@@ -423,6 +426,11 @@ class DescendantMixin(object):
 
     def get_ancestors(self):
         """ Get all unique instance ancestors """
+        if HierarchyClosure.is_registered(self):
+            ancestors = HierarchyClosure.get_ancestors(self)
+            if ancestors is not None:
+                return ancestors
+
         ancestors = list(self.get_parents())
         ancestor_unique_attributes = set([(a.__class__, a.id) for a in ancestors])
         ancestors_with_parents = [a for a in ancestors if isinstance(a, DescendantMixin)]
@@ -433,6 +441,11 @@ class DescendantMixin(object):
         return ancestors
 
     def get_descendants(self):
+        if HierarchyClosure.is_registered(self):
+            descendants = HierarchyClosure.get_descendants(self)
+            if descendants is not None:
+                return descendants
+
         def traverse(obj):
             for child in obj.get_children():
                 yield child
@@ -441,6 +454,180 @@ class DescendantMixin(object):
         return list(set(traverse(self)))
 
 
+class HierarchyClosure(models.Model):
+    """ Closure table of DescendantMixin objects hierarchy.
+
+        Each row links object with one of its ancestors, depth is length of the shortest path between them.
+        Each stored object is also linked with itself with zero depth. Closure table is used for the object
+        only if this row exists, so ancestors and descendants of objects that were created before closure
+        table was filled are found by traversal until missing objects are added with `add_missing`.
+
+        Limitations:
+         - only objects of registered models are stored as descendants, so all DescendantMixin models
+           that could be children of registered model should be registered too, otherwise their
+           objects are not returned as descendants of registered objects;
+         - rows are added when object is created and removed when it is deleted. If parents of
+           object are changed, closure table should be rebuilt with `rebuild`.
+    """
+    class Meta(object):
+        unique_together = ('descendant_content_type', 'descendant_object_id',
+                           'ancestor_content_type', 'ancestor_object_id')
+        index_together = (('ancestor_content_type', 'ancestor_object_id'),)
+
+    ancestor_content_type = models.ForeignKey(ContentType, related_name='+')
+    ancestor_object_id = models.PositiveIntegerField()
+    descendant_content_type = models.ForeignKey(ContentType, related_name='+')
+    descendant_object_id = models.PositiveIntegerField()
+    depth = models.PositiveSmallIntegerField()
+
+    # models whose objects are stored in closure table, in order of hierarchy levels.
+    _registry = []
+
+    @classmethod
+    def register(cls, model):
+        if model not in cls._registry:
+            cls._registry.append(model)
+
+    @classmethod
+    def get_registered_models(cls):
+        return list(cls._registry)
+
+    @classmethod
+    def is_registered(cls, obj):
+        return obj.__class__ in cls._registry and obj.pk is not None
+
+    @classmethod
+    def get_ancestors(cls, obj):
+        """ Return ancestors of object ordered by depth or None if object is not stored in closure table. """
+        keys = cls.get_ancestors_keys(obj)
+        return None if keys is None else cls._get_objects(keys)
+
+    @classmethod
+    def get_ancestors_keys(cls, obj):
+        """ Return (content_type_id, object_id) pairs of object ancestors ordered by depth
+            or None if object is not stored in closure table. Ancestors are not fetched.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        rows = list(cls.objects.filter(descendant_content_type=content_type, descendant_object_id=obj.pk)
+                    .order_by('depth').values_list('ancestor_content_type_id', 'ancestor_object_id', 'depth'))
+        return cls._get_related_keys(rows)
+
+    @classmethod
+    def get_descendants(cls, obj):
+        """ Return descendants of object ordered by depth or None if object is not stored in closure table.
+
+            Object is stored only if it has self row: descendants of object that was created
+            before closure table was filled could be stored only partially.
+        """
+        content_type = ContentType.objects.get_for_model(obj)
+        rows = list(cls.objects.filter(ancestor_content_type=content_type, ancestor_object_id=obj.pk)
+                    .order_by('depth').values_list('descendant_content_type_id', 'descendant_object_id', 'depth'))
+        return cls._get_related_objects(rows)
+
+    @classmethod
+    def _get_related_objects(cls, rows):
+        """ Return objects of rows ordered by depth or None if there is no self row with zero depth """
+        keys = cls._get_related_keys(rows)
+        return None if keys is None else cls._get_objects(keys)
+
+    @classmethod
+    def _get_related_keys(cls, rows):
+        """ Return (content_type_id, object_id) pairs of rows except self row or None if there is no self row """
+        if not rows or rows[0][2] != 0:
+            return None
+        return [(content_type_id, object_id) for content_type_id, object_id, depth in rows if depth]
+
+    @classmethod
+    def add_object(cls, obj):
+        """ Store links between object and all its ancestors """
+        content_type = ContentType.objects.get_for_model(obj)
+        depths = cls._get_ancestors_depths(obj)
+        depths[(content_type.id, obj.pk)] = 0
+        cls.objects.bulk_create([
+            cls(ancestor_content_type_id=ancestor_content_type_id, ancestor_object_id=ancestor_object_id,
+                descendant_content_type=content_type, descendant_object_id=obj.pk, depth=depth)
+            for (ancestor_content_type_id, ancestor_object_id), depth in depths.items()
+        ])
+
+    @classmethod
+    def remove_object(cls, obj):
+        content_type = ContentType.objects.get_for_model(obj)
+        cls.objects.filter(
+            models.Q(ancestor_content_type=content_type, ancestor_object_id=obj.pk) |
+            models.Q(descendant_content_type=content_type, descendant_object_id=obj.pk)
+        ).delete()
+
+    @classmethod
+    def rebuild(cls):
+        """ Rebuild closure table for all objects of registered models. Return number of stored links. """
+        with transaction.atomic():
+            cls.objects.all().delete()
+            for model in cls._registry:
+                for obj in model.objects.all().iterator():
+                    cls.add_object(obj)
+            return cls.objects.count()
+
+    @classmethod
+    def add_missing(cls):
+        """ Store objects of registered models that do not have self row. Return number of stored objects. """
+        count = 0
+        for model in cls._registry:
+            content_type = ContentType.objects.get_for_model(model)
+            stored = cls.objects.filter(
+                descendant_content_type=content_type, ancestor_content_type=content_type,
+                depth=0).values('descendant_object_id')
+            for obj in model.objects.exclude(pk__in=stored).order_by('pk').iterator():
+                with transaction.atomic():
+                    # object could have rows of partially stored ancestors
+                    cls.objects.filter(descendant_content_type=content_type, descendant_object_id=obj.pk).delete()
+                    cls.add_object(obj)
+                count += 1
+        return count
+
+    @classmethod
+    def _get_ancestors_depths(cls, obj):
+        """ Return dictionary {(content_type_id, object_id): depth} of object ancestors """
+        depths = {}
+
+        def add(key, depth):
+            if key not in depths or depths[key] > depth:
+                depths[key] = depth
+
+        for parent in obj.get_parents():
+            if parent is None:
+                continue
+            parent_content_type = ContentType.objects.get_for_model(parent)
+            add((parent_content_type.id, parent.pk), 1)
+            ancestors = []
+            if cls.is_registered(parent):
+                ancestors = list(cls.objects.filter(
+                    descendant_content_type=parent_content_type, descendant_object_id=parent.pk).values_list(
+                    'ancestor_content_type_id', 'ancestor_object_id', 'depth'))
+            if ancestors:
+                for content_type_id, object_id, depth in ancestors:
+                    add((content_type_id, object_id), depth + 1)
+            elif isinstance(parent, DescendantMixin):
+                # parent is not registered or was created before closure table was filled
+                for key, depth in cls._get_ancestors_depths(parent).items():
+                    add(key, depth + 1)
+        return depths
+
+    @classmethod
+    def _get_objects(cls, rows):
+        """ Fetch objects by (content_type_id, object_id) pairs with one query per model, keep pairs order """
+        ids = defaultdict(list)
+        for content_type_id, object_id in rows:
+            ids[content_type_id].append(object_id)
+
+        objects = {}
+        for content_type_id, object_ids in ids.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for obj in model._default_manager.filter(pk__in=object_ids):
+                objects[(content_type_id, obj.pk)] = obj
+
+        return [objects[row] for row in rows if row in objects]
+
+
 class AbstractFieldTracker(FieldTracker):
     """
     Workaround for abstract models
@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
+import base64
 from collections import OrderedDict
+import json
 
-from rest_framework import pagination
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions, pagination
 from rest_framework.response import Response
 from rest_framework.utils.urls import remove_query_param, replace_query_param
 
@@ -52,3 +56,108 @@ class UnlimitedLinkHeaderPagination(LinkHeaderPagination):
     Should be used only as a temporary workaround!
     """
     page_size = None
+
+
+def get_keyset_filter(ordering, values):
+    """ Build query that selects rows located after row with given values of ordering fields.
+
+        For ordering (name, id) and values (n, i) query is: name > n OR (name = n AND id > i).
+    """
+    query = Q()
+    for index, field in enumerate(ordering):
+        condition = Q(**{field + '__gt': values[index]})
+        for previous_field, previous_value in zip(ordering[:index], values[:index]):
+            condition &= Q(**{previous_field: previous_value})
+        query |= condition
+    return query
+
+
+def iterate_by_keyset(queryset, ordering=('id',), chunk_size=1000):
+    """ Iterate over queryset by chunks, each chunk is fetched with keyset condition instead of offset. """
+    queryset = queryset.order_by(*ordering)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        values = [getattr(last, field) for field in ordering]
+        chunk = list(queryset.filter(get_keyset_filter(ordering, values))[:chunk_size])
+
+
+class KeysetLinkHeaderPagination(pagination.BasePagination):
+    """
+    Keyset pagination: next page is selected by values of ordering fields of the last item of current page,
+    so page fetching cost does not depend on page position.
+
+    Available orderings are defined in `orderings` and are selected by `cursor_ordering` query parameter.
+    Link to the next page is rendered in Link header, total count of items is not calculated.
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'cursor_ordering'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+    orderings = {
+        'id': ('id',),
+    }
+    default_ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(get_keyset_filter(self.ordering, cursor))
+
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.last_values = [getattr(page[-1], field) for field in self.ordering] if page else None
+        return page
+
+    def get_paginated_response(self, data):
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link:
+            headers['Link'] = '<%s>; rel="next"' % next_link
+        return Response(data, headers=headers)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_values))
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        try:
+            return self.orderings[ordering]
+        except KeyError:
+            raise exceptions.ValidationError({
+                self.ordering_query_param: _('Ordering should be one of: %s.') % ', '.join(sorted(self.orderings))})
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise exceptions.ValidationError({self.cursor_query_param: _('Cursor is invalid.')})
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise exceptions.ValidationError({self.cursor_query_param: _('Cursor is invalid.')})
+        return values
@@ -6,7 +6,7 @@ import logging
 from uuid import uuid4
 
 import six
-from celery import group
+from celery import group, states
 from celery.backends.base import Backend
 from celery.execute import send_task as send_celery_task
 from celery.task import Task as CeleryTask
@@ -338,36 +338,76 @@ class BackgroundTask(CeleryTask):
            should log themselves explicitly and make sure that they will not
            spam error messages.
 
-        Implement "is_equal" method to define what tasks are equal and should
-        be executed simultaneously.
+        Uncompleted tasks are tracked with leases stored in cache. Lease is taken
+        when task is published and released when task is completed or failed.
+        Lease of a task that was lost by crashed worker expires after LEASE_LIFETIME seconds.
+
+        Tasks are equal if they have the same name and equality key. By default equality key
+        consists of task arguments, override "get_equality_key" if equal tasks could have
+        different arguments.
     """
     is_background = True
+    LEASE_LIFETIME = 60 * 60
+
+    def get_equality_key(self, *args, **kwargs):
+        """ Return value that is the same for tasks that do the same operation. """
+        return {'args': list(args), 'kwargs': kwargs}
 
     def is_equal(self, other_task, *args, **kwargs):
         """ Return True if task do the same operation as other_task.
 
             Note! Other task is represented as serialized celery task - dictionary.
+
+            Deprecated: it is not used for deduplication anymore, override "get_equality_key" instead.
         """
-        raise NotImplementedError('BackgroundTask should implement "is_equal" method to avoid queue overload.')
+        other_key = self.get_equality_key(*other_task.get('args', []), **other_task.get('kwargs', {}))
+        return self.name == other_task.get('name') and self.get_equality_key(*args, **kwargs) == other_key
+
+    def get_lease_key(self, *args, **kwargs):
+        key = self.get_equality_key(*args, **kwargs)
+        try:
+            hash_input = json.dumps({'name': self.name, 'key': key}, sort_keys=True)
+        except (TypeError, ValueError):
+            # arguments could be serialized by other celery serializer, for example pickle
+            hash_input = repr((self.name, key))
+        # md5 is used for internal caching, not need to care about security
+        return 'background_task:lease:%s' % hashlib.md5(hash_input.encode('utf-8')).hexdigest()  # nosec
 
     def is_previous_task_processing(self, *args, **kwargs):
         """ Return True if exist task that is equal to current and is uncompleted """
-        app = self._get_app()
-        inspect = app.control.inspect()
-        active = inspect.active() or {}
-        scheduled = inspect.scheduled() or {}
-        reserved = inspect.reserved() or {}
-        uncompleted = sum(list(active.values()) + list(scheduled.values()) + reserved.values(), [])
-        return any(self.is_equal(task, *args, **kwargs) for task in uncompleted)
+        return cache.get(self.get_lease_key(*args, **kwargs)) is not None
+
+    def acquire_lease(self, task_id, *args, **kwargs):
+        """ Take lease for task. Task could take its own lease again on retry. """
+        key = self.get_lease_key(*args, **kwargs)
+        if cache.add(key, task_id, self.LEASE_LIFETIME):
+            return True
+        return cache.get(key) == task_id
+
+    def release_lease(self, task_id, *args, **kwargs):
+        key = self.get_lease_key(*args, **kwargs)
+        if cache.get(key) == task_id:
+            cache.delete(key)
 
     def apply_async(self, args=None, kwargs=None, **options):
         """ Do not run background task if previous task is uncompleted """
-        if self.is_previous_task_processing(*args, **kwargs):
+        task_id = options.setdefault('task_id', str(uuid4()))
+        if not self.acquire_lease(task_id, *(args or ()), **(kwargs or {})):
             message = 'Background task %s was not scheduled, because its predecessor is not completed yet.' % self.name
             logger.info(message)
             # It is expected by Celery that apply_async return AsyncResult, otherwise celerybeat dies
-            return self.AsyncResult(options.get('task_id') or str(uuid4()))
-        return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+            return self.AsyncResult(task_id)
+        try:
+            return super(BackgroundTask, self).apply_async(args=args, kwargs=kwargs, **options)
+        except Exception:
+            self.release_lease(task_id, *(args or ()), **(kwargs or {}))
+            raise
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        # retried task keeps its lease, it is released when last attempt is completed.
+        if status != states.RETRY:
+            self.release_lease(task_id, *(args or ()), **(kwargs or {}))
+        return super(BackgroundTask, self).after_return(status, retval, task_id, args, kwargs, einfo)
 
 
 class PenalizedBackgroundTask(BackgroundTask):
@@ -1,8 +1,12 @@
 import mock
+from celery import states
 from celery.app.task import Context
 from celery.backends.base import Backend
+from django.core.cache import cache
 from django.test import testcases
 
+from waldur_core.core import tasks
+
 
 class ExecutorTest(testcases.TestCase):
     def setUp(self):
@@ -25,3 +29,61 @@ class ExecutorTest(testcases.TestCase):
     def test_use_old_signature_in_task_error(self, mock_group):
         self.backend._call_task_errbacks(self.request, Exception('test'), '')
         self.assertEqual(mock_group.call_count, 1)
+
+
+class TestBackgroundTask(tasks.BackgroundTask):
+    name = 'waldur_core.core.tests.TestBackgroundTask'
+
+    def run(self, value):
+        pass
+
+
+@mock.patch('celery.app.task.Task.apply_async')
+class BackgroundTaskTest(testcases.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.task = TestBackgroundTask()
+
+    def test_task_is_not_published_if_equal_task_is_not_completed(self, apply_async_mock):
+        self.task.apply_async(args=('value',))
+        self.task.apply_async(args=('value',))
+        self.assertEqual(apply_async_mock.call_count, 1)
+
+    def test_task_with_other_arguments_is_published(self, apply_async_mock):
+        self.task.apply_async(args=('value',))
+        self.task.apply_async(args=('other value',))
+        self.assertEqual(apply_async_mock.call_count, 2)
+
+    def test_task_is_published_after_predecessor_completion(self, apply_async_mock):
+        self.task.apply_async(args=('value',), task_id='task_id')
+        self.task.after_return(states.SUCCESS, None, 'task_id', ['value'], {}, None)
+
+        self.task.apply_async(args=('value',))
+        self.assertEqual(apply_async_mock.call_count, 2)
+
+    def test_lease_is_kept_on_retry(self, apply_async_mock):
+        self.task.apply_async(args=('value',), task_id='task_id')
+        self.task.apply_async(args=('value',), task_id='task_id')
+        self.task.after_return(states.RETRY, None, 'task_id', ['value'], {}, None)
+
+        self.task.apply_async(args=('value',))
+        self.assertEqual(apply_async_mock.call_count, 2)
+        self.assertTrue(self.task.is_previous_task_processing('value'))
+
+    def test_lease_is_released_if_task_publishing_failed(self, apply_async_mock):
+        apply_async_mock.side_effect = IOError('Broker is not available.')
+        self.assertRaises(IOError, self.task.apply_async, args=('value',))
+        self.assertFalse(self.task.is_previous_task_processing('value'))
+
+    def test_task_with_non_serializable_arguments_is_published(self, apply_async_mock):
+        value = object()
+        self.task.apply_async(args=(value,))
+        self.task.apply_async(args=(value,))
+        self.assertEqual(apply_async_mock.call_count, 1)
+
+    def test_equality_key_defines_equal_tasks(self, apply_async_mock):
+        with mock.patch.object(TestBackgroundTask, 'get_equality_key', lambda self, value: value.lower()):
+            self.task.apply_async(args=('value',))
+            self.task.apply_async(args=('VALUE',))
+        self.assertEqual(apply_async_mock.call_count, 1)
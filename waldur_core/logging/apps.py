@@ -9,7 +9,7 @@ class EventsConfig(AppConfig):
     verbose_name = 'Logging'
 
     def ready(self):
-        from waldur_core.logging import handlers, utils
+        from waldur_core.logging import handlers, models, utils
 
         for index, model in enumerate(utils.get_loggable_models()):
             signals.post_delete.connect(
@@ -17,3 +17,10 @@ class EventsConfig(AppConfig):
                 sender=model,
                 dispatch_uid='waldur_core.logging.handlers.remove_{}_{}_related_alerts'.format(model.__name__, index),
             )
+
+        for index, model in enumerate(models.AlertThresholdMixin.get_all_models()):
+            signals.post_save.connect(
+                handlers.check_threshold,
+                sender=model,
+                dispatch_uid='waldur_core.logging.handlers.check_threshold_{}_{}'.format(model.__name__, index),
+            )
@@ -1,6 +1,6 @@
 from django.contrib.contenttypes import models as ct_models
 
-from waldur_core.logging import models
+from waldur_core.logging import models, utils
 
 
 def remove_related_alerts(sender, instance, **kwargs):
@@ -8,3 +8,14 @@ def remove_related_alerts(sender, instance, **kwargs):
     for alert in models.Alert.objects.filter(
             object_id=instance.id, content_type=content_type, closed__isnull=True).iterator():
         alert.close()
+
+
+def check_threshold(sender, instance, created=False, **kwargs):
+    """ Open or close threshold alert if object has crossed its threshold """
+    was_alert_required = False if created else instance.was_threshold_alert_required()
+    if was_alert_required is None:
+        # previous state is unknown, alert is reconciled by check_threshold task.
+        return
+    is_alert_required = instance.is_threshold_alert_required()
+    if was_alert_required != is_alert_required:
+        utils.update_threshold_alert(instance, is_alert_required)
@@ -90,6 +90,44 @@ class AlertThresholdMixin(models.Model):
         """
         raise NotImplementedError
 
+    def is_threshold_alert_required(self):
+        return self.threshold > 0 and self.is_over_threshold()
+
+    def was_threshold_alert_required(self):
+        """
+        Return True if alert was required before the latest object change.
+        If previous state is unknown - None is returned.
+        """
+        return None
+
+    def get_scope_key(self):
+        """
+        Return (content_type_id, object_id) of object scope or None if scope does not exist.
+        """
+        scope = self.scope
+        if scope is None:
+            return None
+        return ct_models.ContentType.objects.get_for_model(scope).id, scope.pk
+
+    @classmethod
+    def get_over_threshold_objects(cls):
+        """
+        Return objects that require threshold alert.
+        """
+        return [obj for obj in cls.get_checkable_objects().filter(threshold__gt=0).iterator()
+                if obj.is_over_threshold() and obj.scope]
+
+    @classmethod
+    def get_checked_scope_keys(cls, scope_keys):
+        """
+        Return keys of scopes from given ones that have checkable objects.
+        """
+        scope_keys = set(scope_keys)
+        if not scope_keys:
+            return set()
+        return {key for key in (obj.get_scope_key() for obj in cls.get_checkable_objects().iterator())
+                if key in scope_keys}
+
     @classmethod
     @lru_cache(maxsize=1)
     def get_all_models(cls):
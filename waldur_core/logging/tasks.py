@@ -4,8 +4,9 @@ from celery import shared_task
 from django.conf import settings
 from django.utils import timezone
 
-from waldur_core.logging.loggers import alert_logger, event_logger
+from waldur_core.logging.loggers import event_logger
 from waldur_core.logging.models import BaseHook, Alert, AlertThresholdMixin
+from waldur_core.logging.utils import update_threshold_alert
 
 logger = logging.getLogger(__name__)
 
@@ -44,17 +45,30 @@ def alerts_cleanup():
 
 @shared_task(name='waldur_core.logging.check_threshold')
 def check_threshold():
-    for model in AlertThresholdMixin.get_all_models():
-        for obj in model.get_checkable_objects().filter(threshold__gt=0).iterator():
-            if obj.is_over_threshold() and obj.scope:
-                alert_logger.threshold.warning(
-                    'Threshold for {scope_name} is exceeded.',
-                    scope=obj.scope,
-                    alert_type='threshold_exceeded',
-                    alert_context={
-                        'object': obj
-                    })
-            else:
-                alert_logger.threshold.close(
-                    scope=obj.scope,
-                    alert_type='threshold_exceeded')
+    """ Reconcile threshold alerts with objects state.
+
+        Usually alerts are opened and closed on objects change, so only alerts
+        that are inconsistent with objects state are changed here.
+    """
+    threshold_models = AlertThresholdMixin.get_all_models()
+    required_alerts = {}
+    for model in threshold_models:
+        for obj in model.get_over_threshold_objects():
+            key = obj.get_scope_key()
+            if key is not None:
+                required_alerts.setdefault(key, obj)
+
+    opened_alerts = {(alert.content_type_id, alert.object_id): alert for alert in Alert.objects.filter(
+        alert_type='threshold_exceeded', closed__isnull=True)}
+
+    for key, obj in required_alerts.items():
+        if key not in opened_alerts:
+            update_threshold_alert(obj, is_alert_required=True)
+
+    # only alerts of scopes that have checked objects are closed.
+    stale_keys = set(opened_alerts) - set(required_alerts)
+    checked_keys = set()
+    for model in threshold_models:
+        checked_keys.update(model.get_checked_scope_keys(stale_keys - checked_keys))
+    for key in checked_keys:
+        opened_alerts[key].close()
@@ -1,6 +1,6 @@
 from django.apps import apps
 
-from waldur_core.logging.loggers import LoggableMixin
+from waldur_core.logging.loggers import LoggableMixin, alert_logger
 
 
 def get_loggable_models():
@@ -13,3 +13,21 @@ def get_scope_types_mapping():
 
 def get_reverse_scope_types_mapping():
     return {m: str(m._meta) for m in get_loggable_models()}
+
+
+def update_threshold_alert(obj, is_alert_required):
+    """ Open or close threshold alert for scope of object with threshold. """
+    if obj.scope is None:
+        return
+    if is_alert_required:
+        alert_logger.threshold.warning(
+            'Threshold for {scope_name} is exceeded.',
+            scope=obj.scope,
+            alert_type='threshold_exceeded',
+            alert_context={
+                'object': obj
+            })
+    else:
+        alert_logger.threshold.close(
+            scope=obj.scope,
+            alert_type='threshold_exceeded')
@@ -53,6 +53,9 @@ class QuotasConfig(AppConfig):
             for counter_field in model.get_quotas_fields(field_class=fields.CounterQuotaField):
                 self.register_counter_field_signals(model, counter_field)
 
+        # Build aggregator fields index once to avoid quota ancestors traversal on each quota save.
+        utils.get_aggregator_fields_index()
+
         # Aggregator quotas signals
         signals.post_save.connect(
             handlers.handle_aggregated_quotas,
@@ -66,6 +69,19 @@ class QuotasConfig(AppConfig):
             dispatch_uid='waldur_core.quotas.handle_aggregated_quotas_pre_delete',
         )
 
+        # Quotas cache signals
+        signals.post_save.connect(
+            handlers.update_quota_cache,
+            sender=Quota,
+            dispatch_uid='waldur_core.quotas.update_quota_cache',
+        )
+
+        signals.post_delete.connect(
+            handlers.invalidate_quota_cache,
+            sender=Quota,
+            dispatch_uid='waldur_core.quotas.invalidate_quota_cache',
+        )
+
     @staticmethod
     def register_counter_field_signals(model, counter_field):
         from waldur_core.quotas import handlers
@@ -0,0 +1,128 @@
+""" Read cache of scope quotas stored in Django cache.
+
+Cache is disabled by default, it could be enabled with WALDUR_CORE['QUOTA_CACHE']['ENABLED'] setting.
+
+Each quota is identified by (content_type_id, object_id, name) and has version stored in cache.
+Cached values are stored under versioned key, so any quota write makes previously cached value unreachable.
+Version is increased right after write and once again after transaction commit, when committed quota
+state is stored in cache. Value read from database is stored only under version that was actual
+before the read, so concurrent write always invalidates it.
+
+Cached quotas should be used only for reading: quota limits validation and usage changes
+are always performed against database.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+
+HITS_KEY = 'quotas:cache:hits'
+MISSES_KEY = 'quotas:cache:misses'
+
+
+def is_enabled():
+    return settings.WALDUR_CORE['QUOTA_CACHE']['ENABLED']
+
+
+def get_quota(model, content_type_id, object_id, name, fetch):
+    """ Return cached quota or fetch it with <fetch> function and store it in cache. """
+    if not is_enabled():
+        return fetch()
+
+    key = _get_key(content_type_id, object_id, name)
+    version = _get_version(key)
+    values = cache.get(_get_data_key(key, version))
+    if values is not None:
+        _increment(HITS_KEY)
+        return model.from_db(router.db_for_read(model), _get_field_names(model), values)
+
+    _increment(MISSES_KEY)
+    quota = fetch()
+    cache.add(_get_data_key(key, version), _serialize(quota), _get_timeout())
+    return quota
+
+
+def update_quota(quota):
+    """ Invalidate cached quota and store its committed state after transaction commit. """
+    if not is_enabled() or quota.content_type_id is None:
+        return
+    key = _get_key(quota.content_type_id, quota.object_id, quota.name)
+    _increase_version(key)
+
+    def store():
+        version = _increase_version(key)
+        try:
+            committed_quota = quota.__class__.objects.get(pk=quota.pk)
+        except quota.__class__.DoesNotExist:
+            return
+        cache.add(_get_data_key(key, version), _serialize(committed_quota), _get_timeout())
+
+    transaction.on_commit(store)
+
+
+def invalidate_quota(quota):
+    if not is_enabled() or quota.content_type_id is None:
+        return
+    key = _get_key(quota.content_type_id, quota.object_id, quota.name)
+    _increase_version(key)
+    transaction.on_commit(lambda: _increase_version(key))
+
+
+def get_stats():
+    """ Return number of cache hits and misses. """
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
+
+def _get_key(content_type_id, object_id, name):
+    return 'quotas:cache:%s:%s:%s' % (content_type_id, object_id, name)
+
+
+def _get_data_key(key, version):
+    return '%s:%s' % (key, version)
+
+
+def _get_version_key(key):
+    return '%s:version' % key
+
+
+def _get_version(key):
+    # version starts from current time, so versions are not reused if version key is evicted from cache
+    version_key = _get_version_key(key)
+    cache.add(version_key, int(time.time() * 1000), None)
+    return cache.get(version_key)
+
+
+def _increase_version(key):
+    version_key = _get_version_key(key)
+    cache.add(version_key, int(time.time() * 1000), None)
+    try:
+        return cache.incr(version_key)
+    except ValueError:
+        # version key was evicted between add and incr calls
+        return _get_version(key)
+
+
+def _increment(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def _get_timeout():
+    return settings.WALDUR_CORE['QUOTA_CACHE']['TIMEOUT']
+
+
+def _get_field_names(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def _serialize(quota):
+    return [getattr(quota, field_name) for field_name in _get_field_names(quota.__class__)]
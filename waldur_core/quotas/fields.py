@@ -1,7 +1,8 @@
 from functools import reduce
 
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Count, Q, Sum, prefetch_related_objects
 import six
 
 from . import exceptions
@@ -41,7 +42,7 @@ class QuotaLimitField(models.IntegerField):
             if instance is None:
                 raise AttributeError("Can only be accessed via instance")
             try:
-                return instance.quotas.get(name=quota_field).limit
+                return instance.get_cached_quota(quota_field).limit
             except instance.quotas.model.DoesNotExist:
                 return quota_field.default_limit
 
@@ -108,25 +109,59 @@ class QuotaField(object):
         except AttributeError:
             return self.default_limit(scope) if six.callable(self.default_limit) else self.default_limit
 
-    def get_or_create_quota(self, scope):
-        if not self.is_connected_to_scope(scope):
-            raise exceptions.CreationConditionFailedQuotaError(
-                'Wrong scope: Cannot create quota "%s" for scope "%s".' % (self.name, scope))
-        defaults = {
+    def get_defaults(self, scope):
+        return {
             'limit': self.scope_default_limit(scope),
             'usage': self.default_usage(scope) if six.callable(self.default_usage) else self.default_usage,
         }
 
-        return scope.quotas.get_or_create(name=self.name, defaults=defaults)
+    def get_or_create_quota(self, scope):
+        if not self.is_connected_to_scope(scope):
+            raise exceptions.CreationConditionFailedQuotaError(
+                'Wrong scope: Cannot create quota "%s" for scope "%s".' % (self.name, scope))
+        return scope.quotas.get_or_create(name=self.name, defaults=self.get_defaults(scope))
 
     def get_aggregator_quotas(self, quota):
-        """ Fetch ancestors quotas that have the same name and are registered as aggregator quotas. """
-        ancestors = quota.scope.get_quota_ancestors()
-        aggregator_quotas = []
-        for ancestor in ancestors:
-            for ancestor_quota_field in ancestor.get_quotas_fields(field_class=AggregatorQuotaField):
-                if ancestor_quota_field.get_child_quota_name() == quota.name:
-                    aggregator_quotas.append(ancestor.quotas.get(name=ancestor_quota_field))
+        """ Fetch ancestors quotas that have the same name and are registered as aggregator quotas.
+
+            Aggregator fields are taken from precomputed index, so ancestors are not resolved at all
+            if quota is not aggregated. If quota scope is stored in hierarchy closure table, ancestors
+            keys are taken from it with one query regardless of hierarchy depth and only scopes of
+            aggregator quotas are fetched, otherwise ancestors are traversed.
+            Quotas of all ancestors are fetched with one query.
+        """
+        from waldur_core.core.models import HierarchyClosure
+        from waldur_core.quotas import utils
+
+        aggregator_fields = utils.get_aggregator_fields(quota.name)
+        if not aggregator_fields:
+            return []
+        names = {ContentType.objects.get_for_model(model).id: [f.name for f in model_fields]
+                 for model, model_fields in aggregator_fields.items()}
+
+        scope = quota.scope
+        ancestors = None
+        keys = HierarchyClosure.get_ancestors_keys(scope) if HierarchyClosure.is_registered(scope) else None
+        if keys is None:
+            ancestors = {(ContentType.objects.get_for_model(ancestor).id, ancestor.id): ancestor
+                         for ancestor in scope.get_quota_ancestors()}
+            keys = ancestors.keys()
+
+        query = Q()
+        for content_type_id, object_id in keys:
+            if content_type_id in names:
+                query |= Q(content_type_id=content_type_id, object_id=object_id, name__in=names[content_type_id])
+        if not query:
+            return []
+
+        aggregator_quotas = list(quota.__class__.objects.filter(query))
+        if ancestors is None:
+            # fetch scopes with one query per model instead of query for each quota
+            prefetch_related_objects(aggregator_quotas, 'scope')
+        else:
+            for aggregator_quota in aggregator_quotas:
+                # set already fetched scope to avoid extra query for each quota
+                aggregator_quota.scope = ancestors[(aggregator_quota.content_type_id, aggregator_quota.object_id)]
         return aggregator_quotas
 
     def __str__(self):
@@ -179,8 +214,38 @@ class CounterQuotaField(QuotaField):
         if self._raw_get_current_usage is not None:
             return self._raw_get_current_usage(models, scope)
         else:
-            filter_path_to_scope = self.path_to_scope.replace('.', '__')
-            return sum([m.objects.filter(**{filter_path_to_scope: scope}).count() for m in models])
+            return self._get_current_usages(models, [scope.pk])[scope.pk]
+
+    def get_current_usages(self, scope_ids):
+        """ Return current usages of scopes with given ids as dictionary {scope_id: usage}.
+
+            Usages are calculated with one query grouped by path to scope.
+            Returns None if usages cannot be calculated in batch,
+            for example if custom get_current_usage function is defined.
+        """
+        if self._raw_get_current_usage is not None:
+            return None
+        return self._get_current_usages(self.target_models, scope_ids)
+
+    def _get_current_usages(self, models, scope_ids):
+        """ Aggregate target models of all scopes with single UNION ALL query. """
+        usages = {scope_id: 0 for scope_id in scope_ids}
+        if not models or not scope_ids:
+            return usages
+        filter_path_to_scope = self.path_to_scope.replace('.', '__')
+        querysets = [model.objects
+                     .filter(**{filter_path_to_scope + '__in': scope_ids})
+                     .order_by()
+                     .values(filter_path_to_scope)
+                     .annotate(usage=self._get_usage_aggregate())
+                     for model in models]
+        queryset = querysets[0].union(*querysets[1:], all=True) if len(querysets) > 1 else querysets[0]
+        for row in queryset:
+            usages[row[filter_path_to_scope]] += row['usage'] or 0
+        return usages
+
+    def _get_usage_aggregate(self):
+        return Count('pk')
 
     @property
     def target_models(self):
@@ -221,21 +286,12 @@ class TotalQuotaField(CounterQuotaField):
         self.target_field = target_field
         super(TotalQuotaField, self).__init__(target_models, path_to_scope)
 
-    def get_current_usage(self, models, scope):
-        total_usage = 0
-        filter_path_to_scope = self.path_to_scope.replace('.', '__')
-        query = {filter_path_to_scope: scope}
-        for model in models:
-            resources = model.objects.filter(**query)
-            subtotal = (resources.values(self.target_field)
-                        .aggregate(total_usage=Sum(self.target_field))['total_usage'])
-            if subtotal:
-                total_usage += subtotal
-        return total_usage
-
     def get_delta(self, target_instance):
         return getattr(target_instance, self.target_field)
 
+    def _get_usage_aggregate(self):
+        return Sum(self.target_field)
+
 
 class AggregatorQuotaField(QuotaField):
     """ Aggregates sum of quota scope children with the same name.
@@ -247,24 +303,60 @@ class AggregatorQuotaField(QuotaField):
             nc_resource_count = quotas_fields.UsageAggregatorQuotaField(
                 get_children=lambda customer: customer.projects.all(),
             )
+
+        If children are not returned as queryset, child_model function should be defined,
+        otherwise recalculation order of aggregators could not be resolved:
+            nc_resource_count = quotas_fields.UsageAggregatorQuotaField(
+                get_children=lambda customer: list(customer.projects.all()),
+                child_model=lambda: Project,
+            )
     """
     aggregation_field = NotImplemented
 
-    def __init__(self, get_children, child_quota_name=None, **kwargs):
+    def __init__(self, get_children, child_quota_name=None, child_model=None, **kwargs):
         self.get_children = get_children
         self._child_quota_name = child_quota_name
+        self._child_model = child_model
         super(AggregatorQuotaField, self).__init__(**kwargs)
 
     def get_child_quota_name(self):
         return self._child_quota_name if self._child_quota_name is not None else self.name
 
-    def recalculate_usage(self, scope):
+    def get_child_model(self, scope):
+        """ Return model of scope children or None if it could not be resolved.
+
+            Model is taken from child_model function if it is defined, otherwise it is resolved from
+            children queryset. Scope could be unsaved, queryset is not evaluated.
+        """
+        if self._child_model is not None:
+            return self._child_model()
+        try:
+            children = self.get_children(scope)
+        except (AttributeError, ValueError):
+            # children of unsaved scope could not be resolved
+            return None
+        return getattr(children, 'model', None)
+
+    def get_current_usage(self, scope):
         children = self.get_children(scope)
+        if isinstance(children, models.QuerySet):
+            # sum children quotas with one query instead of fetching quota of each child separately
+            content_type = ContentType.objects.get_for_model(children.model)
+            child_quotas = scope.quotas.model.objects.filter(
+                content_type=content_type,
+                object_id__in=children.values('pk'),
+                name=self.get_child_quota_name(),
+            )
+            return child_quotas.aggregate(usage=Sum(self.aggregation_field))['usage'] or 0
+
         current_usage = 0
         for child in children:
             child_quota = child.quotas.get(name=self.get_child_quota_name())
             current_usage += getattr(child_quota, self.aggregation_field)
-        scope.set_quota_usage(self.name, current_usage)
+        return current_usage
+
+    def recalculate_usage(self, scope):
+        scope.set_quota_usage(self.name, self.get_current_usage(scope))
 
     def post_child_quota_save(self, scope, child_quota, created=False):
         quota = scope.quotas.get(name=self.name)
@@ -1,8 +1,6 @@
-from django.db import transaction
 from django.db.models import signals
 
-from waldur_core.quotas import models, utils, fields
-from waldur_core.quotas.exceptions import CreationConditionFailedQuotaError
+from waldur_core.quotas import cache, models, utils, fields
 
 
 # XXX: rewrite global quotas
@@ -14,20 +12,14 @@ def create_global_quotas(**kwargs):
 
 def increase_global_quota(sender, instance=None, created=False, **kwargs):
     if created and hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage += 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_usage(1)
 
 
 def decrease_global_quota(sender, **kwargs):
     if hasattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'):
-        with transaction.atomic():
-            global_quota = models.Quota.objects.select_for_update().get(
-                name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
-            global_quota.usage -= 1
-            global_quota.save()
+        global_quota = models.Quota.objects.get(name=getattr(sender, 'GLOBAL_COUNT_QUOTA_NAME'))
+        global_quota.add_usage(-1)
 
 
 # new quotas
@@ -36,11 +28,7 @@ def init_quotas(sender, instance, created=False, **kwargs):
     """ Initialize new instances quotas """
     if not created:
         return
-    for field in sender.get_quotas_fields():
-        try:
-            field.get_or_create_quota(scope=instance)
-        except CreationConditionFailedQuotaError:
-            pass
+    sender.bulk_init_quotas([instance])
 
 
 def count_quota_handler_factory(count_quota_field):
@@ -59,6 +47,9 @@ def count_quota_handler_factory(count_quota_field):
 def handle_aggregated_quotas(sender, instance, **kwargs):
     """ Call aggregated quotas fields update methods """
     quota = instance
+    # skip scope fetching if there are no aggregators for quota.
+    if not utils.get_aggregator_fields(quota.name):
+        return
     # aggregation is not supported for global quotas.
     if quota.scope is None:
         return
@@ -73,3 +64,11 @@ def handle_aggregated_quotas(sender, instance, **kwargs):
             field.post_child_quota_save(aggregator_quota.scope, child_quota=quota, created=kwargs.get('created'))
         elif signal == signals.pre_delete:
             field.pre_child_quota_delete(aggregator_quota.scope, child_quota=quota)
+
+
+def update_quota_cache(sender, instance, **kwargs):
+    cache.update_quota(instance)
+
+
+def invalidate_quota_cache(sender, instance, **kwargs):
+    cache.invalidate_quota(instance)
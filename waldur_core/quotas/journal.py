@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import threading
+
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+
+from waldur_core.quotas import exceptions
+
+_locals = threading.local()
+
+
+def get_quota_usage_journal():
+    return getattr(_locals, 'journal', None)
+
+
+class QuotaUsageJournal(object):
+    """ Collects quota usage deltas and applies them with one UPDATE query per quota.
+
+        Deltas are coalesced by quota, so if many objects change usage of the same quota
+        or of the same ancestor aggregator quota - quota row is updated and versioned only once.
+    """
+
+    def __init__(self):
+        self.quotas = {}
+        self.deltas = OrderedDict()
+        self.validated = set()
+
+    def add(self, quota, usage_delta, validate=False):
+        self.quotas[quota.pk] = quota
+        self.deltas[quota.pk] = self.deltas.get(quota.pk, 0) + usage_delta
+        if validate:
+            self.validated.add(quota.pk)
+
+    def get_delta(self, quota):
+        return self.deltas.get(quota.pk, 0)
+
+    def flush(self):
+        for pk, usage_delta in self.deltas.items():
+            if not usage_delta:
+                continue
+            quota = self.quotas[pk]
+            try:
+                applied = quota.apply_usage_delta(usage_delta, validate=pk in self.validated)
+            except quota.DoesNotExist:
+                # quota was deleted together with its scope.
+                continue
+            if applied is None:
+                raise exceptions.QuotaValidationError(
+                    _('%(quota)s "%(name)s" quota is over limit. Required: %(usage)s, limit: %(limit)s.') % dict(
+                        quota=quota.scope, name=quota.name, usage=quota.usage + usage_delta, limit=quota.limit))
+            if applied != usage_delta:
+                # aggregators got the whole delta when it was journaled, but usage was clamped to zero.
+                quota._add_aggregators_usage(applied - usage_delta)
+        self.quotas.clear()
+        self.deltas.clear()
+        self.validated.clear()
+
+
+@contextmanager
+def quota_usage_journal():
+    """ Collect quota usage changes and apply them right before transaction commit.
+
+        Context manager opens transaction. If limit of validated quota is exceeded
+        on journal flush - QuotaValidationError is raised and transaction is rolled back.
+        Quota instances are not changed until journal is flushed.
+        Nested journals are merged into the outer one.
+
+        Example:
+
+            .. code-block:: python
+
+                with quota_usage_journal():
+                    for size in sizes:
+                        Volume.objects.create(project=project, size=size)
+    """
+    current_journal = get_quota_usage_journal()
+    if current_journal is not None:
+        yield current_journal
+        return
+
+    usage_journal = QuotaUsageJournal()
+    with transaction.atomic():
+        _locals.journal = usage_journal
+        try:
+            yield usage_journal
+        finally:
+            del _locals.journal
+        usage_journal.flush()
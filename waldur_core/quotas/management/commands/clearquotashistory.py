@@ -1,22 +1,21 @@
 from django.core.management.base import BaseCommand
-from reversion.models import Version
 from six.moves import input
 
-from waldur_core.quotas.models import Quota
+from waldur_core.quotas.models import QuotaUsageSample
 
 
 class Command(BaseCommand):
-    help = "Delete quotas versions duplicates."
+    help = "Delete quotas usage samples duplicates."
 
     def handle(self, *args, **options):
         self.stdout.write('Collecting duplicates...')
-        duplicates = sum([self.get_quota_duplicate_versions(quota) for quota in Quota.objects.all()], [])
+        duplicates = self.get_duplicate_samples_ids()
         self.stdout.write('...Done')
 
         if not duplicates:
             self.stdout.write('No duplicates were found. Congratulations!')
         else:
-            self.stdout.write('There are %s duplicates for quotas versions.' % len(duplicates))
+            self.stdout.write('There are %s duplicates for quotas usage samples.' % len(duplicates))
             while True:
                 delete = input('  Do you want to delete them? [Y/n]:') or 'y'
                 if delete.lower() not in ('y', 'n'):
@@ -25,27 +24,21 @@ class Command(BaseCommand):
                     delete = delete.lower() == 'y'
                     break
             if delete:
-                for duplicate in duplicates:
-                    duplicate.delete()
+                for start in range(0, len(duplicates), 1000):
+                    QuotaUsageSample.objects.filter(id__in=duplicates[start:start + 1000]).delete()
                 self.stdout.write('All duplicates were deleted.')
             else:
                 self.stdout.write('Duplicates were not deleted.')
 
-    def get_quota_duplicate_versions(self, quota):
-        versions = Version.objects.get_for_object(quota).order_by('revision__date_created')
-        if not versions:
-            return []
+    def get_duplicate_samples_ids(self):
+        """ Return ids of samples that repeat usage and limit of previous sample of the same quota and granularity """
+        samples = QuotaUsageSample.objects.order_by('quota_id', 'granularity', 'date', 'id').values_list(
+            'id', 'quota_id', 'granularity', 'usage', 'limit')
         duplicates = []
-        last_version = versions[0]
-        for version in versions[1:]:
-            next_version = version
-            if self.are_versions_equal(quota, last_version, next_version):
-                duplicates.append(next_version)
+        last_sample = None
+        for sample in samples.iterator():
+            if last_sample is not None and last_sample[1:] == sample[1:]:
+                duplicates.append(sample[0])
             else:
-                last_version = next_version
+                last_sample = sample
         return duplicates
-
-    def are_versions_equal(self, quota, v1, v2):
-        o1 = v1._object_version.object
-        o2 = v2._object_version.object
-        return all([getattr(o1, f) == getattr(o2, f) for f in quota.get_version_fields()])
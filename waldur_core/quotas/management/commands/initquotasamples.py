@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from reversion.models import Version
+
+from waldur_core.quotas.models import Quota, QuotaUsageSample
+
+
+class Command(BaseCommand):
+    help = ("Create quotas usage samples from quotas versions. "
+            "Only versions older than the earliest sample of quota are converted, so command could be run "
+            "after quotas have been changed and could be run several times.")
+
+    def handle(self, *args, **options):
+        self.stdout.write('Creating quotas usage samples...')
+        quotas = Quota.objects.annotate(earliest_sample_date=Min('usage_samples__date'))
+        for quota in quotas.iterator():
+            versions = Version.objects.get_for_object(quota).select_related('revision').order_by(
+                'revision__date_created')
+            if quota.earliest_sample_date is not None:
+                versions = versions.filter(revision__date_created__lt=quota.earliest_sample_date)
+            QuotaUsageSample.objects.bulk_create([
+                QuotaUsageSample(
+                    quota=quota,
+                    date=version.revision.date_created,
+                    usage=version._object_version.object.usage,
+                    limit=version._object_version.object.limit,
+                )
+                for version in versions.iterator()
+            ])
+        self.stdout.write('...Done')
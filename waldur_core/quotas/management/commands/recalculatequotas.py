@@ -1,16 +1,63 @@
 from __future__ import unicode_literals
 
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from collections import defaultdict
+import functools
+from multiprocessing.pool import ThreadPool
+import threading
 
-from waldur_core.quotas import models, fields, exceptions
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from waldur_core.logging import utils as logging_utils
+from waldur_core.quotas import cache as quota_cache, models, fields
 from waldur_core.quotas.utils import get_models_with_quotas
 
 
 class Command(BaseCommand):
-    """ Recalculate all quotas """
+    """ Recalculate all quotas
+
+        Counter and total quotas are calculated with one GROUP BY query per target model
+        for each chunk of scopes. Aggregator quotas are calculated in topological order:
+        aggregators of aggregators are processed after quotas they aggregate.
+        If --model is given, aggregator quotas of ancestors are recalculated too.
+        Only changed quotas are written to database. In dry run aggregator quotas
+        are calculated from would-be usages of quotas they aggregate.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jobs', type=int, default=1,
+            help='Number of parallel workers. Each worker uses its own database connection.',
+        )
+        parser.add_argument(
+            '--model', dest='models', action='append', default=[], metavar='APP_LABEL.MODEL',
+            help='Recalculate quotas only for given model. Could be specified several times.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of scopes processed by one query.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='Report quotas that would be changed without changing them.',
+        )
 
     def handle(self, *args, **options):
+        if options['jobs'] < 1:
+            raise CommandError('Number of jobs should be positive.')
+        if options['chunk_size'] < 1:
+            raise CommandError('Chunk size should be positive.')
+        self.jobs = options['jobs']
+        self.chunk_size = options['chunk_size']
+        self.dry_run = options['dry_run']
+        self.models = self.get_models(options['models'])
+        self.changes_count = 0
+        self.lock = threading.Lock()
+        # would-be usages of dry run: {(content_type_id, quota_name): {scope_id: (old_usage, new_usage)}}
+        self.dry_run_usages = defaultdict(dict)
+
         # TODO: implement other quotas recalculation
         # TODO: implement global stale quotas deletion
         self.delete_stale_quotas()
@@ -18,61 +65,271 @@ class Command(BaseCommand):
         self.recalculate_global_quotas()
         self.recalculate_counter_quotas()
         self.recalculate_aggregator_quotas()
-        self.stdout.write('XXX: Second time to make sure that aggregators of aggregators where calculated properly.')
-        self.recalculate_aggregator_quotas()
         self.recalculate_customers_user_count()
 
+        if self.dry_run:
+            self.stdout.write('Dry run: %s quotas would be changed.' % self.changes_count)
+        else:
+            self.stdout.write('%s quotas were changed.' % self.changes_count)
+
+    def get_models(self, labels):
+        models_with_quotas = get_models_with_quotas()
+        if not labels:
+            return models_with_quotas
+        models_by_label = {model._meta.label_lower: model for model in models_with_quotas}
+        try:
+            return [models_by_label[label.lower()] for label in labels]
+        except KeyError as e:
+            raise CommandError('Model %s does not exist or does not have quotas.' % e.args[0])
+
     def delete_stale_quotas(self):
         self.stdout.write('Deleting stale quotas')
-        for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                quotas_names = model.get_quotas_names()
-                obj.quotas.exclude(name__in=quotas_names).delete()
+        for model in self.models:
+            content_type = ContentType.objects.get_for_model(model)
+            stale_quotas = models.Quota.objects.filter(content_type=content_type).exclude(
+                name__in=model.get_quotas_names())
+            if self.dry_run:
+                count = stale_quotas.count()
+                if count:
+                    self.stdout.write('  %s: %s stale quotas would be deleted' % (model.__name__, count))
+            else:
+                stale_quotas.delete()
         self.stdout.write('...done')
 
     def init_missing_quotas(self):
         self.stdout.write('Initializing missing quotas')
-        for model in get_models_with_quotas():
-            for obj in model.objects.all():
-                for field in obj.get_quotas_fields():
-                    try:
-                        field.get_or_create_quota(scope=obj)
-                    except exceptions.CreationConditionFailedQuotaError:
-                        pass
+        for model in self.models:
+            content_type = ContentType.objects.get_for_model(model)
+            scopes_ids = set()
+            for field in model.get_quotas_fields():
+                existing_quotas = models.Quota.objects.filter(content_type=content_type, name=field.name)
+                scopes = model.objects.exclude(pk__in=existing_quotas.values('object_id'))
+                for scope in scopes.iterator():
+                    if not field.is_connected_to_scope(scope):
+                        continue
+                    scopes_ids.add(scope.pk)
+                    if self.dry_run:
+                        self.stdout.write('  %s #%s: quota %s would be created' % (
+                            model.__name__, scope.pk, field.name))
+            if self.dry_run:
+                continue
+            scopes_ids = sorted(scopes_ids)
+            for i in range(0, len(scopes_ids), self.chunk_size):
+                model.bulk_init_quotas(model.objects.filter(pk__in=scopes_ids[i:i + self.chunk_size]))
         self.stdout.write('...done')
 
     def recalculate_global_quotas(self):
         self.stdout.write('Recalculating global quotas')
-        for model in get_models_with_quotas():
+        for model in self.models:
             if hasattr(model, 'GLOBAL_COUNT_QUOTA_NAME'):
+                usage = model.objects.count()
+                if self.dry_run:
+                    quota = models.Quota.objects.filter(name=model.GLOBAL_COUNT_QUOTA_NAME).first()
+                    if quota is None or quota.usage != usage:
+                        self.report_change('Global', model.GLOBAL_COUNT_QUOTA_NAME, quota and quota.usage, usage)
+                    continue
                 with transaction.atomic():
                     quota, _ = models.Quota.objects.get_or_create(name=model.GLOBAL_COUNT_QUOTA_NAME)
-                    quota.usage = model.objects.count()
+                    quota.usage = usage
                     quota.save()
+                    if quota.is_sharded():
+                        quota.rebuild_usage_shards()
         self.stdout.write('...done')
 
     def recalculate_counter_quotas(self):
         self.stdout.write('Recalculating counter quotas')
-        for model in get_models_with_quotas():
+        tasks = []
+        for model in self.models:
+            chunks = self.get_chunks(model)
             for counter_field in model.get_quotas_fields(field_class=fields.CounterQuotaField):
-                for instance in model.objects.all():
-                    counter_field.recalculate(scope=instance)
+                tasks.extend(functools.partial(self.recalculate_counter_chunk, model, counter_field, chunk)
+                             for chunk in chunks)
+        self.run_tasks(tasks)
         self.stdout.write('...done')
 
     def recalculate_aggregator_quotas(self):
-        # TODO: recalculate child quotas first
         self.stdout.write('Recalculating aggregator quotas')
-        for model in get_models_with_quotas():
-            for aggregator_field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField):
-                for instance in model.objects.all():
-                    aggregator_field.recalculate(scope=instance)
+        for level in self.get_aggregator_levels():
+            tasks = []
+            for model, aggregator_field in level:
+                tasks.extend(functools.partial(self.recalculate_aggregator_chunk, model, aggregator_field, chunk)
+                             for chunk in self.get_chunks(model))
+            self.run_tasks(tasks)
         self.stdout.write('...done')
 
     # XXX: With current permissions structure it easier to handle customer quota separately.
     def recalculate_customers_user_count(self):
-        self.stdout.write('Recalculating customers user count')
         from waldur_core.structure.models import Customer
-        for customer in Customer.objects.all():
-            usage = len(set(customer.get_users()))
-            customer.set_quota_usage(Customer.Quotas.nc_user_count, usage)
+        if Customer not in self.models:
+            return
+        self.stdout.write('Recalculating customers user count')
+        field = Customer.Quotas.nc_user_count
+        for chunk in self.get_chunks(Customer):
+            usages = {customer.pk: len(set(customer.get_users()))
+                      for customer in Customer.objects.filter(pk__in=chunk)}
+            self.update_usages(Customer, field, usages)
         self.stdout.write('...done')
+
+    def get_chunks(self, model):
+        scope_ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        return [scope_ids[i:i + self.chunk_size] for i in range(0, len(scope_ids), self.chunk_size)]
+
+    def get_aggregator_levels(self):
+        """ Split aggregator fields into levels in topological order.
+
+            Fields of each level depend only on fields of previous levels, so fields
+            of one level could be recalculated in parallel.
+
+            If quotas are recalculated only for given models, aggregator fields of other models
+            that aggregate their quotas directly or through other aggregators are recalculated
+            too, otherwise ancestors of recalculated scopes would keep stale usages.
+        """
+        all_nodes = {(model, field.name): field
+                     for model in get_models_with_quotas()
+                     for field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField)}
+        children = {(model, name): self.get_aggregated_quotas(model, field)
+                    for (model, name), field in all_nodes.items()}
+
+        nodes = set(node for node in all_nodes if node[0] in self.models)
+        affected_nodes_found = True
+        while affected_nodes_found:
+            affected_nodes = set(node for node, node_children in children.items()
+                                 if node not in nodes and any(child[0] in self.models or child in nodes
+                                                              for child in node_children))
+            nodes.update(affected_nodes)
+            affected_nodes_found = bool(affected_nodes)
+        nodes = {node: all_nodes[node] for node in nodes}
+        dependencies = {node: children[node] & set(nodes) for node in nodes}
+
+        levels = []
+        resolved = set()
+        pending = sorted(nodes, key=lambda node: (node[0]._meta.label, node[1]))
+        while pending:
+            level = [node for node in pending if dependencies[node] <= resolved]
+            if not level:
+                raise CommandError('Aggregator quotas have circular dependency: %s.' % ', '.join(
+                    '%s.%s' % (model.__name__, name) for model, name in pending))
+            resolved.update(level)
+            pending = [node for node in pending if node not in resolved]
+            levels.append([(model, nodes[(model, name)]) for model, name in level])
+        return levels
+
+    def get_aggregated_quotas(self, model, field):
+        """ Return set of (model, quota_name) pairs of quotas aggregated by aggregator field of model.
+
+            Child model is resolved from field definition for unsaved scope, so it does not depend on
+            stored objects. If it could not be resolved, quotas with the same name of all other models
+            are considered as aggregated.
+        """
+        child_quota_name = field.get_child_quota_name()
+        child_model = field.get_child_model(model())
+        if child_model is not None:
+            return {(child_model, child_quota_name)}
+        return {(other_model, child_quota_name) for other_model in get_models_with_quotas()
+                if other_model is not model and child_quota_name in other_model.get_quotas_names()}
+
+    def recalculate_counter_chunk(self, model, field, scope_ids):
+        if field.creation_condition is None:
+            usages = field.get_current_usages(scope_ids)
+            if usages is not None:
+                return self.update_usages(model, field, usages)
+        usages = {scope.pk: field.get_current_usage(field.target_models, scope)
+                  for scope in model.objects.filter(pk__in=scope_ids)
+                  if field.is_connected_to_scope(scope)}
+        return self.update_usages(model, field, usages)
+
+    def recalculate_aggregator_chunk(self, model, field, scope_ids):
+        usages = {scope.pk: self.get_aggregator_usage(field, scope)
+                  for scope in model.objects.filter(pk__in=scope_ids)
+                  if field.is_connected_to_scope(scope)}
+        return self.update_usages(model, field, usages)
+
+    def get_aggregator_usage(self, field, scope):
+        usage = field.get_current_usage(scope)
+        if not self.dry_run or field.aggregation_field != 'usage':
+            return usage
+
+        # In dry run changed usages of children quotas are not stored, so their differences are added here.
+        children = field.get_children(scope)
+        if isinstance(children, QuerySet):
+            children_keys = [(children.model, pk) for pk in children.values_list('pk', flat=True)]
+        else:
+            children_keys = [(child.__class__, child.pk) for child in children]
+        for child_model, child_id in children_keys:
+            content_type = ContentType.objects.get_for_model(child_model)
+            changes = self.dry_run_usages.get((content_type.id, field.get_child_quota_name()), {})
+            if child_id in changes:
+                old_usage, new_usage = changes[child_id]
+                usage += new_usage - old_usage
+        return usage
+
+    def update_usages(self, model, field, usages):
+        """ Store changed usages of <field> quotas. Usages is a dictionary {scope_id: usage}. """
+        content_type = ContentType.objects.get_for_model(model)
+        quotas = models.Quota.objects.filter(
+            content_type=content_type, name=field.name, object_id__in=list(usages))
+
+        changed_quotas_ids = defaultdict(list)
+        threshold_crossed_quotas_ids = set()
+        for quota_id, scope_id, usage, threshold in quotas.values_list('id', 'object_id', 'usage', 'threshold'):
+            new_usage = usages[scope_id]
+            if usage != new_usage:
+                changed_quotas_ids[new_usage].append(quota_id)
+                self.report_change('%s #%s' % (model.__name__, scope_id), field.name, usage, new_usage)
+                if self.dry_run:
+                    with self.lock:
+                        self.dry_run_usages[(content_type.id, field.name)][scope_id] = (usage, new_usage)
+                if threshold > 0 and (usage >= threshold) != (new_usage >= threshold):
+                    threshold_crossed_quotas_ids.add(quota_id)
+
+        if self.dry_run or not changed_quotas_ids:
+            return
+
+        # Quotas usages are updated with one query per distinct value.
+        # Aggregators are not updated by signals here, they are recalculated separately.
+        with transaction.atomic():
+            for usage, quotas_ids in changed_quotas_ids.items():
+                models.Quota.objects.filter(id__in=quotas_ids).update(usage=usage)
+            all_quotas_ids = [quota_id for ids in changed_quotas_ids.values() for quota_id in ids]
+            for quota in models.Quota.objects.filter(id__in=all_quotas_ids):
+                quota.save_usage_sample()
+                quota_cache.update_quota(quota)
+                # threshold handler is not called for UPDATE query, so alert is updated explicitly.
+                if quota.id in threshold_crossed_quotas_ids:
+                    logging_utils.update_threshold_alert(quota, quota.is_threshold_alert_required())
+
+    def report_change(self, scope, name, old_usage, new_usage):
+        with self.lock:
+            self.changes_count += 1
+            if self.dry_run:
+                self.stdout.write('  %s %s: %s -> %s' % (scope, name, old_usage, new_usage))
+
+    def run_tasks(self, tasks):
+        self.processed_tasks_count = 0
+        self.total_tasks_count = len(tasks)
+        if self.jobs == 1:
+            for task in tasks:
+                self.run_task(task)
+            return
+
+        pool = ThreadPool(self.jobs)
+        try:
+            pool.map(self.run_task_in_thread, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_task(self, task):
+        model, field, scope_ids = task.args
+        task()
+        with self.lock:
+            self.processed_tasks_count += 1
+            self.stdout.write('  [%s/%s] %s.%s: %s scopes processed' % (
+                self.processed_tasks_count, self.total_tasks_count, model.__name__, field.name, len(scope_ids)))
+
+    def run_task_in_thread(self, task):
+        try:
+            self.run_task(task)
+        finally:
+            # each thread opens its own connection, it has to be closed explicitly.
+            connection.close()
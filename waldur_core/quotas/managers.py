@@ -27,3 +27,26 @@ class QuotaManager(GenericKeyMixin, models.Manager):
             query |= Q(object_id__in=user_object_ids, content_type_id=content_type_id)
 
         return queryset.filter(query)
+
+
+class QuotaScopeQuerySetMixin(object):
+    """ Provides efficient access to quotas of queryset objects.
+
+        Example:
+
+            .. code-block:: python
+
+                for project in Project.objects.filter(customer=customer).prefetch_quotas():
+                    # quotas of all projects are fetched with one query
+                    project.get_quota('nc_resource_count')
+    """
+
+    def prefetch_quotas(self):
+        return self.prefetch_related('quotas')
+
+
+class QuotaScopeQuerySet(QuotaScopeQuerySetMixin, models.QuerySet):
+    pass
+
+
+QuotaScopeManager = models.Manager.from_queryset(QuotaScopeQuerySet)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotas', '0004_quota_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaUsageShard',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.PositiveSmallIntegerField()),
+                ('usage', models.FloatField(default=0)),
+                ('quota', models.ForeignKey(related_name='usage_shards', to='quotas.Quota',
+                                            on_delete=django.db.models.deletion.CASCADE)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='quotausageshard',
+            unique_together=set([('quota', 'index')]),
+        ),
+    ]
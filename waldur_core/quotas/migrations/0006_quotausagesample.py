@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quotas', '0005_quotausageshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaUsageSample',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('usage', models.FloatField()),
+                ('limit', models.FloatField()),
+                ('granularity', models.CharField(default='raw', max_length=10,
+                                                 choices=[('raw', 'Raw'), ('hour', 'Hour'), ('day', 'Day')])),
+                ('quota', models.ForeignKey(related_name='usage_samples', to='quotas.Quota',
+                                            on_delete=django.db.models.deletion.CASCADE)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='quotausagesample',
+            index_together=set([('quota', 'date')]),
+        ),
+    ]
@@ -1,35 +1,45 @@
 from __future__ import unicode_literals
 
-from collections import defaultdict
+import bisect
+from collections import defaultdict, namedtuple
 import functools
 from functools import reduce
 import inspect
 import logging
+import operator
+import os
+import random
 
+from django.conf import settings
 from django.contrib.contenttypes import fields as ct_fields
 from django.contrib.contenttypes import models as ct_models
-from django.db import models
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, Max, OuterRef, Q, Sum, Value, When, signals
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from model_utils import FieldTracker
-from reversion import revisions as reversion
 import six
 
-from waldur_core.core.models import UuidMixin, ReversionMixin, DescendantMixin
+from waldur_core.core.models import UuidMixin, DescendantMixin
+from waldur_core.logging import utils as logging_utils
 from waldur_core.logging.loggers import LoggableMixin
 from waldur_core.logging.models import AlertThresholdMixin
-from waldur_core.quotas import exceptions, managers, fields
+from waldur_core.quotas import exceptions, managers, fields, journal
+from waldur_core.quotas import cache as quota_cache
 
 logger = logging.getLogger(__name__)
 
 
 @python_2_unicode_compatible
-@reversion.register(fields=['usage', 'limit'])
-class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, models.Model):
+class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, models.Model):
     """
     Abstract quota for any resource.
 
+    Quota history is stored as QuotaUsageSample on each usage or limit change.
+
     Quota can exist without scope: for example, a quota for all projects or all
     customers on site.
     If quota limit is set to -1 quota will never be exceeded.
@@ -88,6 +98,307 @@ class Quota(UuidMixin, AlertThresholdMixin, LoggableMixin, ReversionMixin, model
     def is_over_threshold(self):
         return self.usage >= self.threshold
 
+    def was_threshold_alert_required(self):
+        previous_threshold = self.tracker.previous('threshold')
+        previous_usage = self.tracker.previous('usage')
+        if previous_threshold is None or previous_usage is None:
+            return None
+        return previous_threshold > 0 and previous_usage >= previous_threshold
+
+    @classmethod
+    def get_over_threshold_objects(cls):
+        return cls.get_checkable_objects().filter(
+            threshold__gt=0, usage__gte=F('threshold'), content_type__isnull=False)
+
+    def get_scope_key(self):
+        if self.content_type_id is None:
+            return None
+        return self.content_type_id, self.object_id
+
+    @classmethod
+    def get_checked_scope_keys(cls, scope_keys):
+        query = Q()
+        for content_type_id, object_id in scope_keys:
+            query |= Q(content_type_id=content_type_id, object_id=object_id)
+        if not query:
+            return set()
+        return set(cls.get_checkable_objects().filter(query).values_list('content_type_id', 'object_id'))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        quota = super(Quota, cls).from_db(db, field_names, values)
+        if 'usage' in field_names and quota.is_sharded():
+            quota.usage += quota.get_shards_usage()
+            quota.tracker.set_saved_fields()
+        return quota
+
+    def save(self, **kwargs):
+        is_sample_required = self.pk is None or self.tracker.has_changed('usage') or self.tracker.has_changed('limit')
+        update_fields = kwargs.get('update_fields')
+        if self.pk is None or not self.is_sharded() or (update_fields and 'usage' not in update_fields):
+            result = super(Quota, self).save(**kwargs)
+        else:
+            # Quota usage is replaced with new value, so shards should not hold previous changes anymore.
+            with transaction.atomic():
+                self.usage_shards.update(usage=0)
+                result = super(Quota, self).save(**kwargs)
+            self._invalidate_shards_usage_cache()
+        if is_sample_required:
+            self.save_usage_sample()
+        return result
+
+    def save_usage_sample(self):
+        """ Store current usage and limit in quota history. """
+        if settings.WALDUR_CORE['QUOTA_USAGE_SAMPLES']['ENABLED']:
+            QuotaUsageSample.objects.create(quota=self, usage=self.usage, limit=self.limit)
+
+    def get_usage_samples(self, points):
+        """ Return quota state for each of given datetime points.
+
+            State is represented by the latest usage sample stored before or at the point,
+            or None if there is no such sample.
+        """
+        return QuotaUsageSample.get_for_points([self.id], points)[self.id]
+
+    def is_sharded(self):
+        """ Usage of global quota is stored in shards if sharded counters are enabled. """
+        return self.content_type_id is None and settings.WALDUR_CORE['GLOBAL_QUOTA_SHARDS']['ENABLED']
+
+    def get_shards_usage(self):
+        key = self._get_shards_usage_cache_key()
+        usage = cache.get(key)
+        if usage is None:
+            usage = self.usage_shards.aggregate(usage=Sum('usage'))['usage'] or 0
+            cache.set(key, usage, settings.WALDUR_CORE['GLOBAL_QUOTA_SHARDS']['CACHE_TIMEOUT'])
+        return usage
+
+    def rebuild_usage_shards(self):
+        """ Store current usage in quota row and recreate empty shards. """
+        with transaction.atomic():
+            self.save(update_fields=['usage'])
+            self.usage_shards.all().delete()
+            QuotaUsageShard.objects.bulk_create([
+                QuotaUsageShard(quota=self, index=index)
+                for index in range(settings.WALDUR_CORE['GLOBAL_QUOTA_SHARDS']['COUNT'])
+            ])
+        self._invalidate_shards_usage_cache()
+
+    def _get_shards_usage_cache_key(self):
+        return 'quotas:shards_usage:%s' % self.pk
+
+    def _invalidate_shards_usage_cache(self):
+        """ Drop cached shards usage when transaction is committed.
+
+            If cache is dropped inside transaction, concurrent reader could cache
+            shards usage without uncommitted change again.
+        """
+        key = self._get_shards_usage_cache_key()
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def _add_shard_usage(self, usage_delta):
+        options = settings.WALDUR_CORE['GLOBAL_QUOTA_SHARDS']
+        if options['SELECTION'] == 'pid':
+            index = os.getpid() % options['COUNT']
+        else:
+            index = random.randrange(options['COUNT'])
+
+        updated = self.usage_shards.filter(index=index).update(usage=F('usage') + usage_delta)
+        if not updated:
+            shard, _ = QuotaUsageShard.objects.get_or_create(quota=self, index=index)
+            self.usage_shards.filter(pk=shard.pk).update(usage=F('usage') + usage_delta)
+        self._invalidate_shards_usage_cache()
+
+    def add_usage(self, usage_delta, validate=False):
+        """ Atomically add delta to quota usage.
+
+            Usage is changed with single conditional UPDATE query on database side,
+            so concurrent changes are not lost and row is not locked before update.
+            Usage never becomes negative.
+
+            If validate is True - usage is changed only if it does not exceed limit
+            after the change. Return False if quota was not changed because of the limit.
+
+            Change is propagated to aggregator quotas explicitly. If usage was clamped to zero,
+            only the applied part of delta is propagated. post_save signal is sent with reset
+            tracker, so its receivers are notified but aggregators are not updated twice.
+
+            If quota usage journal is active - delta is stored in journal and
+            applied to quota and its aggregators when journal is flushed.
+        """
+        usage_journal = journal.get_quota_usage_journal()
+        if usage_journal is not None:
+            pending_delta = usage_journal.get_delta(self)
+            if validate and usage_delta > 0 and self.is_exceeded(pending_delta + usage_delta):
+                return False
+            usage_journal.add(self, usage_delta, validate=validate)
+            self._add_aggregators_usage(usage_delta)
+            return True
+
+        applied_delta = self.apply_usage_delta(usage_delta, validate=validate)
+        if applied_delta is None:
+            return False
+        self._add_aggregators_usage(applied_delta)
+        return True
+
+    def apply_usage_delta(self, usage_delta, validate=False):
+        """ Add delta to quota usage with single UPDATE query and store quota usage sample.
+
+            Return delta that was actually applied: it differs from given one if usage
+            was clamped to zero. Return None if quota was not changed because of the limit.
+
+            Aggregator quotas are not updated, use `add_usage` to update them too.
+        """
+        if self.is_sharded():
+            # global quotas do not have limits, so validation is not needed.
+            self._add_shard_usage(usage_delta)
+            self.usage += usage_delta
+            self.tracker.set_saved_fields()
+            self.save_usage_sample()
+            self._send_usage_post_save()
+            return usage_delta
+
+        previous_usage = self.usage
+        was_threshold_alert_required = self.is_threshold_alert_required()
+        queryset = Quota.objects.filter(pk=self.pk)
+        if validate and usage_delta > 0:
+            queryset = queryset.filter(Q(limit=-1) | Q(usage__lte=F('limit') - usage_delta))
+        updated = queryset.update(usage=Greatest(F('usage') + usage_delta, 0))
+
+        self.refresh_from_db(fields=['usage', 'limit', 'threshold'])
+        # previous values should be equal to stored ones, otherwise next
+        # save will propagate the same change to aggregators again.
+        self.tracker.set_saved_fields()
+        if not updated:
+            return None
+
+        applied_delta = usage_delta
+        if self.usage == 0 and usage_delta < 0 and previous_usage + usage_delta < 0:
+            logger.error('%(scope)s "%(name)s" quota usage should not be negative. '
+                         'Current usage: %(usage)s, delta: %(usage_delta)s',
+                         dict(scope=self.scope, name=self.name, usage=previous_usage, usage_delta=usage_delta))
+            # only the part of delta that was applied before clamping is propagated.
+            applied_delta = -previous_usage
+
+        self.save_usage_sample()
+        self._send_usage_post_save()
+        # threshold handler does not see the change because tracker is reset, so it is checked explicitly.
+        if self.is_threshold_alert_required() != was_threshold_alert_required:
+            logging_utils.update_threshold_alert(self, self.is_threshold_alert_required())
+        return applied_delta
+
+    def _send_usage_post_save(self):
+        """ Notify post_save receivers about usage change done with UPDATE query.
+
+            Tracker is already reset, so aggregator handlers do not propagate the change again.
+        """
+        signals.post_save.send(sender=Quota, instance=self, created=False, update_fields=['usage'],
+                               raw=False, using=self._state.db)
+
+    def _add_aggregators_usage(self, usage_delta):
+        from waldur_core.quotas import utils
+
+        # skip scope fetching if there are no aggregators for quota.
+        if not utils.get_aggregator_fields(self.name):
+            return
+        # aggregation is not supported for global quotas.
+        if self.scope is None:
+            return
+        quota_field = self.get_field()
+        # usage aggregation should not count another usage aggregator field to avoid calls duplication.
+        if quota_field is None or isinstance(quota_field, fields.UsageAggregatorQuotaField):
+            return
+        for aggregator_quota in quota_field.get_aggregator_quotas(self):
+            if aggregator_quota.get_field().aggregation_field == 'usage':
+                aggregator_quota.add_usage(usage_delta)
+
+
+class QuotaUsageShard(models.Model):
+    """ Part of global quota usage.
+
+    If sharded counters are enabled, usage changes of global quota are distributed between
+    several shards instead of updating single quota row. Quota usage is equal to sum of
+    quota row usage and usage of all its shards.
+    """
+    class Meta:
+        unique_together = (('quota', 'index'),)
+
+    quota = models.ForeignKey(Quota, related_name='usage_shards', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField()
+    usage = models.FloatField(default=0)
+
+
+class QuotaUsageSample(models.Model):
+    """ Quota usage and limit at the moment of quota change.
+
+    Samples are used as quota history. Old raw samples are periodically rolled up
+    to hourly and daily samples and deleted after retention period.
+    """
+    class Granularity(object):
+        RAW = 'raw'
+        HOUR = 'hour'
+        DAY = 'day'
+
+        CHOICES = ((RAW, 'Raw'), (HOUR, 'Hour'), (DAY, 'Day'))
+
+    class Meta:
+        index_together = (('quota', 'date'),)
+
+    quota = models.ForeignKey(Quota, related_name='usage_samples', on_delete=models.CASCADE)
+    date = models.DateTimeField(default=timezone.now)
+    usage = models.FloatField()
+    limit = models.FloatField()
+    granularity = models.CharField(max_length=10, choices=Granularity.CHOICES, default=Granularity.RAW)
+
+    @classmethod
+    def get_for_points(cls, quotas_ids, points):
+        """ Return state of each quota for each of given datetime points.
+
+            Result format: {quota_id: [sample_for_point1, sample_for_point2, ...]}.
+            State is represented by the latest sample stored before or at the point, or None if there
+            is no such sample. Samples of all quotas are fetched with two queries: samples within
+            points range and the latest sample of each quota before range start.
+            Sample for each point is found with binary search over sorted samples dates.
+        """
+        quotas_ids = list(quotas_ids)
+        if not points or not quotas_ids:
+            return {quota_id: [None] * len(points) for quota_id in quotas_ids}
+        start, end = min(points), max(points)
+
+        samples = cls.objects.filter(quota_id__in=quotas_ids)
+        previous_samples_ids = cls.get_latest_samples(samples.filter(date__lt=start)).values_list('id', flat=True)
+        samples = samples.filter(Q(date__gte=start, date__lte=end) | Q(id__in=list(previous_samples_ids)))
+
+        quotas_samples = defaultdict(list)
+        for sample in samples.order_by('quota_id', 'date', 'id'):
+            quotas_samples[sample.quota_id].append(sample)
+
+        result = {}
+        for quota_id in quotas_ids:
+            quota_samples = quotas_samples[quota_id]
+            dates = [sample.date for sample in quota_samples]
+            result[quota_id] = []
+            for point in points:
+                index = bisect.bisect_right(dates, point)
+                result[quota_id].append(quota_samples[index - 1] if index else None)
+        return result
+
+    @classmethod
+    def get_latest_samples(cls, samples, trunc=None):
+        """ Return the latest of given samples for each quota or for each quota and period if trunc is given.
+
+            Samples are compared by date and by id if dates are equal, so samples created from
+            old history after newer samples are handled correctly.
+        """
+        def annotate(queryset):
+            return queryset.annotate(period=trunc('date')) if trunc else queryset
+
+        newer_samples = annotate(samples).filter(
+            Q(date__gt=OuterRef('date')) | Q(date=OuterRef('date'), id__gt=OuterRef('id')),
+            quota_id=OuterRef('quota_id'))
+        if trunc:
+            newer_samples = newer_samples.filter(period=OuterRef('period'))
+        return annotate(samples).annotate(has_newer=Exists(newer_samples)).filter(has_newer=False)
+
 
 def _fail_silently(method):
 
@@ -105,6 +416,10 @@ def _fail_silently(method):
     return wrapped
 
 
+# Quota that will be exceeded: quota scope and name, current limit and usage, usage required after change.
+QuotaViolation = namedtuple('QuotaViolation', ('scope', 'name', 'limit', 'usage', 'required'))
+
+
 class QuotaModelMixin(models.Model):
     """
     Add general fields and methods to model for quotas usage.
@@ -132,6 +447,9 @@ class QuotaModelMixin(models.Model):
     Use such methods to change objects quotas:
       set_quota_limit, set_quota_usage, add_quota_usage.
 
+    Use get_quota to read object quota. If quotas of several objects are needed - load them
+    with one query using `prefetch_quotas` queryset method (or `prefetch_related('quotas')`).
+
     Helper methods validate_quota_change and get_sum_of_quotas_as_dict provide common operations with objects quotas.
     Check methods docstrings for more details.
     """
@@ -145,34 +463,73 @@ class QuotaModelMixin(models.Model):
 
     quotas = ct_fields.GenericRelation('quotas.Quota', related_query_name='quotas')
 
+    def _get_quotas_cache(self):
+        """ Return identity map {quota name: quota} built from prefetched quotas.
+
+            Map is available only if quotas were prefetched for the instance,
+            for example with `prefetch_quotas` queryset method. Otherwise None is returned.
+        """
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('quotas')
+        if prefetched is None:
+            return None
+        # rebuild map if quotas were prefetched again after map creation
+        source, cache = getattr(self, '_quotas_cache', (None, None))
+        if source is not prefetched:
+            cache = {quota.name: quota for quota in prefetched}
+            self._quotas_cache = (prefetched, cache)
+        return cache
+
+    def get_quota(self, quota_name):
+        """ Get scope quota by name.
+
+            If quotas were prefetched - quota is taken from instance cache without DB query.
+            The same quota object is returned on each call, so changes made by
+            set_quota_limit, set_quota_usage and add_quota_usage stay visible for further reads.
+        """
+        quota_name = six.text_type(quota_name)
+        cache = self._get_quotas_cache()
+        if cache is not None and quota_name in cache:
+            return cache[quota_name]
+        quota = self.quotas.get(name=quota_name)
+        if cache is not None:
+            cache[quota_name] = quota
+        return quota
+
+    def get_cached_quota(self, quota_name):
+        """ Get scope quota by name from quotas cache.
+
+            Quota could be slightly outdated, so it should be used only for reading.
+            Use get_quota if quota is going to be changed or validated.
+        """
+        quota_name = six.text_type(quota_name)
+        prefetched_quotas = self._get_quotas_cache()
+        if prefetched_quotas is not None and quota_name in prefetched_quotas:
+            return prefetched_quotas[quota_name]
+        content_type = ct_models.ContentType.objects.get_for_model(self)
+        return quota_cache.get_quota(Quota, content_type.id, self.id, quota_name,
+                                     fetch=lambda: self.quotas.get(name=quota_name))
+
     @_fail_silently
     def set_quota_limit(self, quota_name, limit, fail_silently=False):
-        quota = self.quotas.get(name=quota_name)
+        quota = self.get_quota(quota_name)
         if quota.limit != limit:
             quota.limit = limit
             quota.save(update_fields=['limit'])
 
     @_fail_silently
     def set_quota_usage(self, quota_name, usage, fail_silently=False):
-        quota = self.quotas.get(name=quota_name)
+        quota = self.get_quota(quota_name)
         if quota.usage != usage:
             quota.usage = usage
             quota.save(update_fields=['usage'])
 
     @_fail_silently
     def add_quota_usage(self, quota_name, usage_delta, fail_silently=False, validate=False):
-        quota = self.quotas.get(name=quota_name)
-        if validate and quota.is_exceeded(usage_delta):
+        quota = self.get_quota(quota_name)
+        if not quota.add_usage(usage_delta, validate=validate):
             raise exceptions.QuotaValidationError(
                 _('%(quota)s "%(name)s" quota is over limit. Required: %(usage)s, limit: %(limit)s.') % dict(
                     quota=self, name=quota_name, usage=quota.usage + usage_delta, limit=quota.limit))
-        quota.usage += usage_delta
-        if quota.usage < 0:
-            logger.error('%(quota)s "%(name)s" quota usage should not be negative. '
-                         'Current usage: %(usage)s, delta: %(usage_delta)s',
-                         dict(quota=self, name=quota_name, usage=quota.usage, usage_delta=usage_delta))
-            quota.usage = 0
-        quota.save(update_fields=['usage'])
 
     def get_quota_ancestors(self):
         if isinstance(self, DescendantMixin):
@@ -183,11 +540,68 @@ class QuotaModelMixin(models.Model):
             return {a for a in self.get_ancestors() if isinstance(a, QuotaModelMixin)}
         return {}
 
-    def validate_quota_change(self, quota_deltas, raise_exception=False):
+    def get_quota_violations(self, quota_deltas, include_ancestors=False, lock=False):
+        """
+        Get quotas of object and optionally of his ancestors that will be exceeded if quota_deltas will be added.
+
+        Quotas of object and all ancestors are fetched with one query. Quotas of scopes that
+        have prefetched quotas are taken from instance cache, unless lock is requested.
+        Ancestors quotas are checked only if ancestor has quota with the same name.
+        If lock is True - quotas rows are locked with SELECT FOR UPDATE until the end of transaction,
+        so usage could be increased later in the same transaction without race conditions.
+
+        Returns list of QuotaViolation tuples.
+        """
+        scopes = [self]
+        if include_ancestors:
+            scopes.extend(self.get_quota_ancestors())
+        names = [six.text_type(name) for name in quota_deltas]
+
+        quotas_by_key = {}
+        query = Q()
+        scopes_by_key = {}
+        for scope in scopes:
+            cache = None if lock else scope._get_quotas_cache()
+            if cache is not None and all(name in cache for name in names):
+                for name in names:
+                    quotas_by_key[(scope, name)] = cache[name]
+                continue
+            content_type = ct_models.ContentType.objects.get_for_model(scope)
+            scopes_by_key[(content_type.id, scope.id)] = scope
+            query |= Q(content_type=content_type, object_id=scope.id)
+
+        if scopes_by_key:
+            quotas = Quota.objects.filter(query, name__in=names).order_by('pk')
+            if lock:
+                quotas = quotas.select_for_update()
+            for quota in quotas:
+                # set already fetched scope to avoid extra query for each quota
+                quota.scope = scopes_by_key[(quota.content_type_id, quota.object_id)]
+                quotas_by_key[(quota.scope, quota.name)] = quota
+
+        usage_journal = journal.get_quota_usage_journal()
+        violations = []
+        for scope in scopes:
+            for name, delta in six.iteritems(quota_deltas):
+                quota = quotas_by_key.get((scope, six.text_type(name)))
+                if quota is None:
+                    if scope is self:
+                        raise Quota.DoesNotExist('Quota "%s" does not exist for %s.' % (name, self))
+                    continue
+                if usage_journal is not None:
+                    delta += usage_journal.get_delta(quota)
+                if quota.is_exceeded(delta):
+                    violations.append(QuotaViolation(
+                        scope=scope, name=quota.name, limit=quota.limit, usage=quota.usage, required=quota.usage + delta))
+        return violations
+
+    def validate_quota_change(self, quota_deltas, raise_exception=False, include_ancestors=False, lock=False):
         """
         Get error messages about object and his ancestor quotas that will be exceeded if quota_delta will be added.
 
         raise_exception - if True QuotaExceededException will be raised if validation fails
+        include_ancestors - if True quotas of object ancestors are validated too
+        lock - if True quotas rows are locked until the end of transaction, check get_quota_violations
         quota_deltas - dictionary of quotas deltas, example:
         {
             'ram': 1024,
@@ -198,12 +612,9 @@ class QuotaModelMixin(models.Model):
             ['ram quota limit: 1024, requires: 2048(instance#1)', ...]
 
         """
-        errors = []
-        for name, delta in six.iteritems(quota_deltas):
-            quota = self.quotas.get(name=name)
-            if quota.is_exceeded(delta):
-                errors.append('%s quota limit: %s, requires %s (%s)\n' % (
-                    quota.name, quota.limit, quota.usage + delta, quota.scope))
+        violations = self.get_quota_violations(quota_deltas, include_ancestors=include_ancestors, lock=lock)
+        errors = ['%s quota limit: %s, requires %s (%s)\n' % (v.name, v.limit, v.required, v.scope)
+                  for v in violations]
         if not raise_exception:
             return errors
         else:
@@ -216,6 +627,53 @@ class QuotaModelMixin(models.Model):
         """
         return user.is_staff
 
+    @classmethod
+    def bulk_init_quotas(cls, scopes):
+        """
+        Create missing quotas of given scopes. All `scopes` have to be instances of the class.
+
+        Quotas creation conditions and default values are evaluated in Python and all
+        quotas are created with one INSERT query. Usage samples of created quotas
+        are stored in bulk too, post_save signal is sent for each created quota.
+        Returns list of created quotas.
+        """
+        scopes = {scope.id: scope for scope in scopes}
+        if not scopes:
+            return []
+        content_type = ct_models.ContentType.objects.get_for_model(cls)
+        existing_quotas = set(Quota.objects.filter(content_type=content_type, object_id__in=list(scopes))
+                              .values_list('object_id', 'name'))
+
+        new_quotas = []
+        for scope in scopes.values():
+            for field in cls.get_quotas_fields():
+                if (scope.id, field.name) in existing_quotas or not field.is_connected_to_scope(scope):
+                    continue
+                new_quotas.append(Quota(
+                    content_type=content_type, object_id=scope.id, name=field.name, **field.get_defaults(scope)))
+        if not new_quotas:
+            return []
+
+        with transaction.atomic():
+            Quota.objects.bulk_create(new_quotas)
+            if any(quota.pk is None for quota in new_quotas):
+                # primary keys are not set by bulk_create on some databases
+                new_quotas = [quota for quota in Quota.objects.filter(
+                    content_type=content_type, object_id__in=list(scopes))
+                    if (quota.object_id, quota.name) not in existing_quotas]
+
+            for quota in new_quotas:
+                quota.scope = scopes[quota.object_id]
+
+            if settings.WALDUR_CORE['QUOTA_USAGE_SAMPLES']['ENABLED']:
+                QuotaUsageSample.objects.bulk_create([
+                    QuotaUsageSample(quota=quota, usage=quota.usage, limit=quota.limit) for quota in new_quotas])
+
+            for quota in new_quotas:
+                signals.post_save.send(sender=Quota, instance=quota, created=True,
+                                       update_fields=None, raw=False, using=quota._state.db)
+        return new_quotas
+
     @classmethod
     def get_sum_of_quotas_as_dict(cls, scopes, quota_names=None, fields=['usage', 'limit']):
         """
@@ -227,62 +685,84 @@ class QuotaModelMixin(models.Model):
             'quota_name1_usage': 'sum of usages for quotas with such quota_name1',
             ...
         }
-        All `scopes` have to be instances of the same model.
+        All `scopes` have to be instances of the same model, `scopes` could be a queryset.
         `fields` keyword argument defines sum of which fields of quotas will present in result.
+        Sums are calculated with one query.
         """
-        if not scopes:
-            return {}
+        if isinstance(scopes, models.QuerySet):
+            # use subquery instead of fetching scopes
+            scope_model, scopes_ids = scopes.model, scopes.values('pk')
+        else:
+            if not scopes:
+                return {}
+            scope_models = set([scope._meta.model for scope in scopes])
+            if len(scope_models) > 1:
+                raise exceptions.QuotaError(_('All scopes have to be instances of the same model.'))
+            scope_model, scopes_ids = scopes[0]._meta.model, [scope.id for scope in scopes]
 
         if quota_names is None:
-            quota_names = cls.get_quotas_names()
+            quota_names = scope_model.get_quotas_names()
 
-        scope_models = set([scope._meta.model for scope in scopes])
-        if len(scope_models) > 1:
-            raise exceptions.QuotaError(_('All scopes have to be instances of the same model.'))
+        query = Q(content_type=ct_models.ContentType.objects.get_for_model(scope_model),
+                  object_id__in=scopes_ids, name__in=quota_names)
+        return cls._get_sum_of_quotas(query, fields)
 
-        filter_kwargs = {
-            'content_type': ct_models.ContentType.objects.get_for_model(scopes[0]),
-            'object_id__in': [scope.id for scope in scopes],
-            'name__in': quota_names
-        }
+    @classmethod
+    def get_sum_of_quotas_for_querysets(cls, querysets, quota_names=None):
+        """ Return dictionary with sum of quotas of all querysets objects. Querysets could be of different models.
 
-        result = {}
-        if 'usage' in fields:
-            items = Quota.objects.filter(**filter_kwargs)\
-                         .values('name').annotate(usage=Sum('usage'))
-            for item in items:
-                result[item['name'] + '_usage'] = item['usage']
+            Sums are calculated with one query for all querysets. Limits are summed for each model
+            separately: sum of limits of model is -1 if at least one its quota is unlimited.
+            Unlimited sums are ignored if other models have limited sums, so total limit is -1
+            only if sums of all models are unlimited.
+        """
+        queries = []
+        for queryset in querysets:
+            names = quota_names if quota_names is not None else queryset.model.get_quotas_names()
+            queries.append(Q(content_type=ct_models.ContentType.objects.get_for_model(queryset.model),
+                             object_id__in=queryset.values('pk'), name__in=names))
+        total = defaultdict(lambda: 0)
+        if not queries:
+            return total
+
+        limits = defaultdict(list)
+        items = cls._get_sums_of_quotas_items(
+            reduce(operator.or_, queries), fields=['usage', 'limit'], group_by=['content_type', 'name'])
+        for item in items:
+            total[item['name'] + '_usage'] += item['usage_sum']
+            limits[item['name']].append(-1 if item['has_unlimited'] else item['limit_sum'])
+        for name, models_limits in limits.items():
+            finite_limits = [limit for limit in models_limits if limit != -1]
+            total[name] = sum(finite_limits) if finite_limits else -1
+        return total
 
-        if 'limit' in fields:
-            unlimited_quotas = Quota.objects.filter(limit=-1, **filter_kwargs)
-            unlimited_quotas = list(unlimited_quotas.values_list('name', flat=True))
-            for quota_name in unlimited_quotas:
-                result[quota_name] = -1
-
-            items = Quota.objects\
-                         .filter(**filter_kwargs)\
-                         .exclude(name__in=unlimited_quotas)\
-                         .values('name')\
-                         .annotate(limit=Sum('limit'))
-            for item in items:
-                result[item['name']] = item['limit']
+    @classmethod
+    def _get_sum_of_quotas(cls, query, fields):
+        """ Calculate sums of usages and limits of quotas matched by query grouped by quota name.
 
+            Sum of limits is -1 if at least one quota is unlimited.
+        """
+        result = {}
+        for item in cls._get_sums_of_quotas_items(query, fields, group_by=['name']):
+            if 'usage' in fields:
+                result[item['name'] + '_usage'] = item['usage_sum']
+            if 'limit' in fields:
+                result[item['name']] = -1 if item['has_unlimited'] else item['limit_sum']
         return result
 
     @classmethod
-    def get_sum_of_quotas_for_querysets(cls, querysets, quota_names=None):
-        partial_sums = [qs.model.get_sum_of_quotas_as_dict(qs, quota_names) for qs in querysets]
-        return reduce(cls._sum_dicts, partial_sums, defaultdict(lambda: 0))
-
-    @classmethod
-    def _sum_dicts(cls, total, partial):
-        for key, val in partial.items():
-            if val != -1:
-                total[key] += val
-        for key in partial.keys():
-            if key not in total:
-                total[key] = -1
-        return total
+    def _get_sums_of_quotas_items(cls, query, fields, group_by):
+        """ Return sums of usages and limits of quotas matched by query grouped by given fields. """
+        annotations = {}
+        if 'usage' in fields:
+            annotations['usage_sum'] = Sum('usage')
+        if 'limit' in fields:
+            annotations['limit_sum'] = Sum('limit')
+            annotations['has_unlimited'] = Max(Case(
+                When(limit=-1, then=Value(1)), default=Value(0), output_field=models.IntegerField()))
+        if not annotations:
+            return []
+        return Quota.objects.filter(query).order_by().values(*group_by).annotate(**annotations)
 
     @classmethod
     def get_quotas_fields(cls, field_class=None):
@@ -322,7 +802,10 @@ class ExtendableQuotaModelMixin(QuotaModelMixin):
         # and initialization is not executed automatically.
         quota_field.name = name
         setattr(cls.Quotas, name, quota_field)
+        from waldur_core.quotas import utils
         from waldur_core.quotas.apps import QuotasConfig
+        if isinstance(quota_field, fields.AggregatorQuotaField):
+            utils.get_aggregator_fields_index.cache_clear()
         # For counter quotas we need to register signals explicitly
         if isinstance(quota_field, fields.CounterQuotaField):
             QuotasConfig.register_counter_field_signals(model=cls, counter_field=quota_field)
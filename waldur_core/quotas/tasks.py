@@ -0,0 +1,34 @@
+from celery import shared_task
+from django.conf import settings
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from waldur_core.quotas.models import QuotaUsageSample
+
+
+@shared_task(name='waldur_core.quotas.rollup_usage_samples')
+def rollup_usage_samples():
+    """ Downsample old quota usage samples and delete samples that are older than retention period. """
+    options = settings.WALDUR_CORE['QUOTA_USAGE_SAMPLES']
+    now = timezone.now()
+    Granularity = QuotaUsageSample.Granularity
+
+    _rollup_samples(Granularity.RAW, Granularity.HOUR, TruncHour, now - options['RAW_RETENTION'])
+    _rollup_samples(Granularity.HOUR, Granularity.DAY, TruncDay, now - options['HOURLY_RETENTION'])
+
+    if options['DAILY_RETENTION']:
+        # the latest sample of each quota is kept to know quota state after retention date.
+        latest_samples_ids = QuotaUsageSample.get_latest_samples(QuotaUsageSample.objects.all()).values_list(
+            'id', flat=True)
+        (QuotaUsageSample.objects
+         .filter(granularity=Granularity.DAY, date__lt=now - options['DAILY_RETENTION'])
+         .exclude(id__in=list(latest_samples_ids))
+         .delete())
+
+
+def _rollup_samples(source_granularity, target_granularity, trunc, date_before):
+    """ Keep only the latest sample of each quota within each period, it represents quota state at period end. """
+    samples = QuotaUsageSample.objects.filter(granularity=source_granularity, date__lt=date_before)
+    latest_samples_ids = QuotaUsageSample.get_latest_samples(samples, trunc).values_list('id', flat=True)
+    QuotaUsageSample.objects.filter(id__in=list(latest_samples_ids)).update(granularity=target_granularity)
+    samples.delete()
@@ -1,10 +1,12 @@
 from django.db import models as django_models
 
 from waldur_core.core import models as core_models
-from waldur_core.quotas import fields, models as quotas_models
+from waldur_core.quotas import fields, managers as quotas_managers, models as quotas_models
 
 
 class GrandparentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, core_models.DescendantMixin):
+    objects = quotas_managers.QuotaScopeManager()
+
     class Quotas(quotas_models.QuotaModelMixin.Quotas):
         regular_quota = fields.QuotaField()
         quota_with_default_limit = fields.QuotaField(default_limit=100)
@@ -14,6 +16,10 @@ class GrandparentModel(core_models.UuidMixin, quotas_models.QuotaModelMixin, cor
         limit_aggregator_quota = fields.LimitAggregatorQuotaField(
             get_children=lambda scope: ChildModel.objects.filter(parent__parent=scope),
         )
+        counter_aggregator_quota = fields.UsageAggregatorQuotaField(
+            get_children=lambda scope: scope.children.all(),
+            child_quota_name='counter_quota',
+        )
 
     regular_quota = fields.QuotaLimitField(quota_field=Quotas.regular_quota)
 
@@ -1,7 +1,14 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
 from django.test import TransactionTestCase
-from reversion.models import Version
+import six
+from six.moves import mock
 
+from waldur_core.core.models import HierarchyClosure
 from waldur_core.core.utils import silent_call
+from waldur_core.quotas import fields
+from waldur_core.quotas.management.commands import recalculatequotas
+from waldur_core.quotas.models import Quota
 
 from . import models as test_models
 
@@ -22,21 +29,32 @@ class TestQuotaField(TransactionTestCase):
         child.save()
         self.assertEqual(child.quotas.get(name='regular_quota').limit, 9)
 
-    # XXX: Ideally this method should belong to ReversionMixin tests and
-    #      should be separated into several smaller tests.
-    def test_quota_versions(self):
+    def test_missing_quotas_are_created_for_many_scopes(self):
+        scopes = [test_models.GrandparentModel.objects.create() for _ in range(3)]
+        Quota.objects.filter(
+            content_type=ContentType.objects.get_for_model(test_models.GrandparentModel),
+            object_id__in=[scope.id for scope in scopes],
+            name='quota_with_default_limit',
+        ).delete()
+
+        created_quotas = test_models.GrandparentModel.bulk_init_quotas(scopes)
+
+        self.assertEqual(len(created_quotas), 3)
+        for scope in scopes:
+            self.assertEqual(scope.quotas.get(name='quota_with_default_limit').limit, 100)
+
+    def test_quota_usage_samples(self):
         scope = test_models.GrandparentModel.objects.create()
         quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
         quota.usage = 13.0
         quota.save()
-        # make sure that new version was created after quota usage change.
-        latest_version = Version.objects.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(latest_version._object_version.object.usage, quota.usage)
-        # make sure that new version was not created if object was saved without data change.
+        # make sure that new sample was created after quota usage change.
+        latest_sample = quota.usage_samples.latest('id')
+        self.assertEqual(latest_sample.usage, quota.usage)
+        # make sure that new sample was not created if object was saved without data change.
         quota.usage = 13
         quota.save()
-        new_latest_version = Version.objects.get_for_object(quota).latest('revision__date_created')
-        self.assertEqual(new_latest_version, latest_version)
+        self.assertEqual(quota.usage_samples.latest('id'), latest_sample)
 
 
 class TestCounterQuotaField(TransactionTestCase):
@@ -72,6 +90,15 @@ class TestCounterQuotaField(TransactionTestCase):
         quota = self.parent.quotas.get(name=test_models.ParentModel.Quotas.two_targets_counter_quota)
         self.assertEqual(quota.usage, 2)
 
+    def test_current_usage_is_calculated_for_all_target_models(self):
+        self.parent.second_children.create()
+        field = test_models.ParentModel.Quotas.two_targets_counter_quota
+
+        with self.assertNumQueries(1):
+            usage = field.get_current_usage(field.target_models, self.parent)
+
+        self.assertEqual(usage, 2)
+
     def test_delta_quota_usage_is_increased_on_child_creation(self):
         quota = self.parent.quotas.get(name=test_models.ParentModel.Quotas.delta_quota)
         self.assertEqual(quota.usage, 10)
@@ -184,6 +211,18 @@ class TestUsageAggregatorField(TransactionTestCase):
         quota = self.grandparent.quotas.get(name=self.grandparent_quota_field)
         self.assertEqual(quota.usage, usage_value * len(self.children))
 
+    def test_aggregator_usage_increases_on_child_quota_usage_delta(self):
+        usage_value = 10
+        for child in self.children:
+            child.add_quota_usage(self.child_quota_field, usage_value)
+
+        for parent in self.parents:
+            quota = parent.quotas.get(name=self.parent_quota_field)
+            self.assertEqual(quota.usage, usage_value)
+
+        quota = self.grandparent.quotas.get(name=self.grandparent_quota_field)
+        self.assertEqual(quota.usage, usage_value * len(self.children))
+
     def test_usage_aggregator_quota_works_with_specified_child_quota_name(self):
         usage_value = 10
         for child in self.children:
@@ -270,3 +309,155 @@ class TestLimitAggregatorField(TransactionTestCase):
 
         quota = self.grandparent.quotas.get(name=self.grandparent_quota_field)
         self.assertEqual(quota.usage, limit_value * len(self.children))
+
+
+class TestAggregatorFieldsIndex(TransactionTestCase):
+
+    def test_index_contains_aggregators_of_child_quota(self):
+        from waldur_core.quotas import utils
+
+        aggregator_fields = utils.get_aggregator_fields(test_models.ChildModel.Quotas.usage_aggregator_quota.name)
+
+        self.assertIn(test_models.ParentModel.Quotas.usage_aggregator_quota,
+                      aggregator_fields[test_models.ParentModel])
+        self.assertIn(test_models.ParentModel.Quotas.second_usage_aggregator_quota,
+                      aggregator_fields[test_models.ParentModel])
+
+    def test_aggregator_quotas_are_fetched_for_all_ancestors(self):
+        grandparent = test_models.GrandparentModel.objects.create()
+        parent = test_models.ParentModel.objects.create(parent=grandparent)
+        child = test_models.ChildModel.objects.create(parent=parent)
+        quota = child.quotas.get(name=test_models.ChildModel.Quotas.usage_aggregator_quota)
+
+        aggregator_quotas = test_models.ChildModel.Quotas.usage_aggregator_quota.get_aggregator_quotas(quota)
+
+        self.assertEqual({(q.scope, q.name) for q in aggregator_quotas}, {
+            (parent, 'usage_aggregator_quota'),
+            (parent, 'second_usage_aggregator_quota'),
+            (grandparent, 'usage_aggregator_quota'),
+        })
+
+    def test_aggregator_quotas_are_fetched_from_hierarchy_closure_without_ancestors_traversal(self):
+        grandparent = test_models.GrandparentModel.objects.create()
+        parent = test_models.ParentModel.objects.create(parent=grandparent)
+        child = test_models.ChildModel.objects.create(parent=parent)
+        quota = child.quotas.get(name=test_models.ChildModel.Quotas.usage_aggregator_quota)
+        quota.scope = child
+        registry = [test_models.GrandparentModel, test_models.ParentModel, test_models.ChildModel]
+
+        with mock.patch.object(HierarchyClosure, '_registry', registry):
+            HierarchyClosure.rebuild()
+            with mock.patch.object(test_models.ChildModel, 'get_quota_ancestors') as get_quota_ancestors:
+                # closure rows, aggregator quotas and their scopes: one query per model
+                with self.assertNumQueries(4):
+                    aggregator_quotas = test_models.ChildModel.Quotas.usage_aggregator_quota.get_aggregator_quotas(
+                        quota)
+                    scopes = {(q.scope, q.name) for q in aggregator_quotas}
+
+        self.assertFalse(get_quota_ancestors.called)
+        self.assertEqual(scopes, {
+            (parent, 'usage_aggregator_quota'),
+            (parent, 'second_usage_aggregator_quota'),
+            (grandparent, 'usage_aggregator_quota'),
+        })
+
+
+class TestRecalculateQuotasCommand(TransactionTestCase):
+
+    def setUp(self):
+        self.grandparent = test_models.GrandparentModel.objects.create()
+        self.parent = test_models.ParentModel.objects.create(parent=self.grandparent)
+        self.children = [test_models.ChildModel.objects.create(parent=self.parent) for _ in range(3)]
+        self.quota_field = test_models.ParentModel.Quotas.counter_quota
+
+    def test_counter_quota_usages_are_calculated_for_chunk_of_scopes(self):
+        other_parent = test_models.ParentModel.objects.create(parent=self.grandparent)
+
+        usages = self.quota_field.get_current_usages([self.parent.pk, other_parent.pk])
+
+        self.assertEqual(usages, {self.parent.pk: 3, other_parent.pk: 0})
+
+    def test_quota_usage_is_not_changed_on_dry_run(self):
+        self.parent.set_quota_usage(self.quota_field, 10)
+
+        silent_call('recalculatequotas', dry_run=True)
+
+        self.assertEqual(self.parent.quotas.get(name=self.quota_field).usage, 10)
+
+    def test_only_quotas_of_given_model_are_recalculated(self):
+        self.parent.set_quota_usage(self.quota_field, 10)
+
+        with mock.patch.object(test_models.GrandparentModel.Quotas.usage_aggregator_quota,
+                               'get_current_usage') as get_current_usage:
+            silent_call('recalculatequotas', models=[test_models.ParentModel._meta.label], chunk_size=1)
+
+        self.assertEqual(self.parent.quotas.get(name=self.quota_field).usage, 3)
+        # grandparent aggregates quotas of children, so it is not affected by parent quotas.
+        self.assertFalse(get_current_usage.called)
+
+    def test_ancestors_aggregator_quotas_are_recalculated_for_given_model(self):
+        quota_name = test_models.ChildModel.Quotas.usage_aggregator_quota.name
+        # change usage without signals, so aggregators become stale.
+        self.children[0].quotas.filter(name=quota_name).update(usage=5)
+
+        silent_call('recalculatequotas', models=[test_models.ChildModel._meta.label])
+
+        self.assertEqual(self.parent.quotas.get(name=quota_name).usage, 5)
+        self.assertEqual(self.parent.quotas.get(name='second_usage_aggregator_quota').usage, 5)
+        self.assertEqual(self.grandparent.quotas.get(name=quota_name).usage, 5)
+
+    def test_aggregators_of_models_without_objects_are_recalculated_for_given_model(self):
+        test_models.GrandparentModel.objects.all().delete()
+        command = recalculatequotas.Command()
+        command.models = [test_models.ParentModel]
+
+        nodes = [node for level in command.get_aggregator_levels() for node in level]
+
+        self.assertIn((test_models.GrandparentModel, test_models.GrandparentModel.Quotas.counter_aggregator_quota),
+                      nodes)
+
+    def test_aggregated_quotas_are_taken_from_child_model_of_field(self):
+        field = fields.UsageAggregatorQuotaField(
+            get_children=lambda scope: list(scope.children.all()),
+            child_model=lambda: test_models.ParentModel,
+            child_quota_name='usage_aggregator_quota',
+        )
+
+        aggregated_quotas = recalculatequotas.Command().get_aggregated_quotas(test_models.GrandparentModel, field)
+
+        self.assertEqual(aggregated_quotas, {(test_models.ParentModel, 'usage_aggregator_quota')})
+
+    def test_quotas_of_all_models_are_aggregated_if_child_model_is_not_resolved(self):
+        field = fields.UsageAggregatorQuotaField(
+            get_children=lambda scope: list(scope.children.all()),
+            child_quota_name='usage_aggregator_quota',
+        )
+
+        aggregated_quotas = recalculatequotas.Command().get_aggregated_quotas(test_models.GrandparentModel, field)
+
+        self.assertEqual(aggregated_quotas, {
+            (test_models.ParentModel, 'usage_aggregator_quota'),
+            (test_models.ChildModel, 'usage_aggregator_quota'),
+        })
+
+    def test_threshold_alert_is_updated_if_recalculated_usage_crosses_threshold(self):
+        self.parent.quotas.filter(name=self.quota_field).update(usage=0, threshold=2)
+
+        with mock.patch('waldur_core.quotas.management.commands.recalculatequotas.logging_utils') as logging_utils:
+            silent_call('recalculatequotas')
+
+        quota = self.parent.quotas.get(name=self.quota_field)
+        logging_utils.update_threshold_alert.assert_called_once_with(quota, True)
+
+    def test_aggregator_changes_are_calculated_from_recalculated_usages_on_dry_run(self):
+        aggregator_field = test_models.GrandparentModel.Quotas.counter_aggregator_quota
+        # both quotas are stale, but aggregator is consistent with stored child usage.
+        self.parent.quotas.filter(name=self.quota_field).update(usage=10)
+        self.grandparent.quotas.filter(name=aggregator_field).update(usage=10)
+        stdout = six.StringIO()
+
+        call_command('recalculatequotas', dry_run=True, stdout=stdout)
+
+        self.assertIn('GrandparentModel #%s %s: 10.0 -> 3.0' % (self.grandparent.pk, aggregator_field),
+                      stdout.getvalue())
+        self.assertEqual(self.grandparent.quotas.get(name=aggregator_field).usage, 10)
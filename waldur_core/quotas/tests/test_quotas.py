@@ -1,10 +1,12 @@
 from datetime import timedelta
+import json
+
 from ddt import ddt, data
 from django.utils import timezone
 from rest_framework import test, status
-from reversion.models import Version
 
 from waldur_core.core import utils as core_utils
+from waldur_core.quotas.models import Quota
 from waldur_core.quotas.tests import factories
 from waldur_core.structure import models as structure_models
 from waldur_core.structure.tests import (factories as structure_factories,
@@ -49,10 +51,8 @@ class QuotaHistoryTest(test.APITransactionTestCase):
 
         self.quota = factories.QuotaFactory(scope=self.customer)
         self.url = factories.QuotaFactory.get_url(self.quota, 'history')
-        # Hook for test: lets say that revision was created one hour ago
-        version = Version.objects.get_for_object(self.quota).filter(revision__date_created__lte=timezone.now()).first()
-        version.revision.date_created = timezone.now() - timedelta(hours=1)
-        version.revision.save()
+        # Hook for test: lets say that sample was created one hour ago
+        self.quota.usage_samples.update(date=timezone.now() - timedelta(hours=1))
 
     def test_old_version_of_quota_is_available(self):
         old_usage = self.quota.usage
@@ -89,4 +89,46 @@ class QuotaHistoryTest(test.APITransactionTestCase):
         self.assertEqual(response.data[2]['point'], end_timestamp)
 
 
+class QuotaListTest(test.APITransactionTestCase):
+    def setUp(self):
+        self.staff = structure_factories.UserFactory(is_staff=True)
+        structure_factories.CustomerFactory.create_batch(2)
+        self.quotas_count = Quota.objects.count()
+
+    def test_quotas_are_paginated_by_keyset_if_cursor_is_defined(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(factories.QuotaFactory.get_list_url(), {'cursor': '', 'page_size': 5})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+
+        next_url = response['Link'].split(';')[0].strip('<>')
+        next_response = self.client.get(next_url)
+
+        self.assertEqual(next_response.status_code, status.HTTP_200_OK)
+        first_page_uuids = {quota['uuid'] for quota in response.data}
+        self.assertFalse(first_page_uuids & {quota['uuid'] for quota in next_response.data})
+
+    def test_quotas_are_ordered_by_name(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(factories.QuotaFactory.get_list_url(),
+                                   {'cursor': '', 'cursor_ordering': 'name', 'page_size': 5})
+
+        names = [quota['name'] for quota in response.data]
+        self.assertEqual(names, sorted(names))
+
+    def test_invalid_cursor_is_rejected(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(factories.QuotaFactory.get_list_url(), {'cursor': 'invalid'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_all_quotas_are_exported(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(factories.QuotaFactory.get_list_url() + 'export/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content).decode('utf-8'))), self.quotas_count)
+
+
 # TODO: add CRUD tests for quota endpoint.
@@ -1,7 +1,10 @@
 from django.contrib.contenttypes.models import ContentType
 from rest_framework import test, status
+from six.moves import mock
 
+from waldur_core.logging import handlers as logging_handlers
 from waldur_core.logging.models import Alert
+from waldur_core.logging.tests.factories import AlertFactory
 from waldur_core.logging.tasks import check_threshold
 from waldur_core.quotas.tests.factories import QuotaFactory
 from waldur_core.structure.tests.factories import ProjectFactory, UserFactory
@@ -44,3 +47,54 @@ class QuotaThresholdAlertTest(test.APITestCase):
         })
         self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
         self.assertEqual(1000, response.data['threshold'], response.data)
+
+    def test_alert_is_created_when_quota_usage_crosses_threshold(self):
+        self.quota.threshold = 100
+        self.quota.save()
+
+        self.project.add_quota_usage('nc_resource_count', 200)
+
+        self.assertTrue(self.get_opened_alerts().exists())
+
+    def test_alert_is_closed_when_quota_usage_drops_below_threshold(self):
+        self.quota.threshold = 100
+        self.quota.usage = 200
+        self.quota.save()
+
+        self.quota.usage = 50
+        self.quota.save()
+
+        self.assertFalse(self.get_opened_alerts().exists())
+
+    def test_stale_alert_is_closed_by_reconciliation(self):
+        self.quota.threshold = 100
+        self.quota.usage = 200
+        self.quota.save()
+        self.project.quotas.filter(name='nc_resource_count').update(usage=50)
+
+        check_threshold()
+
+        self.assertFalse(self.get_opened_alerts().exists())
+
+    def test_alert_of_scope_without_checked_objects_is_not_closed_by_reconciliation(self):
+        alert = AlertFactory(alert_type='threshold_exceeded', scope=UserFactory())
+
+        check_threshold()
+
+        alert.refresh_from_db()
+        self.assertIsNone(alert.closed)
+
+    @mock.patch('waldur_core.logging.handlers.utils.update_threshold_alert')
+    def test_alert_is_not_changed_if_previous_state_is_unknown(self, update_threshold_alert):
+        instance = mock.Mock(**{'was_threshold_alert_required.return_value': None})
+
+        logging_handlers.check_threshold(sender=None, instance=instance)
+
+        self.assertFalse(update_threshold_alert.called)
+
+    def get_opened_alerts(self):
+        return Alert.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.project),
+            object_id=self.project.id,
+            alert_type='threshold_exceeded',
+            closed__isnull=True)
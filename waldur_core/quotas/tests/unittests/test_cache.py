@@ -0,0 +1,40 @@
+from django.core.cache import cache as django_cache
+from django.test import TestCase
+
+from waldur_core.core.tests.helpers import override_waldur_core_settings
+
+from ..models import GrandparentModel
+from ... import cache
+
+
+@override_waldur_core_settings(QUOTA_CACHE={'ENABLED': True, 'TIMEOUT': 60})
+class QuotaCacheTest(TestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        self.scope = GrandparentModel.objects.create()
+
+    def test_quota_is_fetched_from_cache_on_second_read(self):
+        GrandparentModel.objects.get(pk=self.scope.pk).get_cached_quota('regular_quota')
+        scope = GrandparentModel.objects.get(pk=self.scope.pk)
+
+        with self.assertNumQueries(0):
+            scope.get_cached_quota('regular_quota')
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_cached_quota_is_invalidated_on_quota_change(self):
+        self.scope.get_cached_quota('regular_quota')
+
+        self.scope.set_quota_limit('regular_quota', 10)
+
+        scope = GrandparentModel.objects.get(pk=self.scope.pk)
+        self.assertEqual(scope.get_cached_quota('regular_quota').limit, 10)
+        self.assertEqual(scope.regular_quota, 10)
+
+    def test_cached_quota_is_invalidated_on_usage_delta(self):
+        self.scope.get_cached_quota('regular_quota')
+
+        self.scope.add_quota_usage('regular_quota', 5)
+
+        scope = GrandparentModel.objects.get(pk=self.scope.pk)
+        self.assertEqual(scope.get_cached_quota('regular_quota').usage, 5)
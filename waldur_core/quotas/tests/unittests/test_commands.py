@@ -1,5 +1,13 @@
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.test import TestCase
+from six.moves import mock
+from reversion import revisions as reversion
+from reversion.models import Revision
+
+from waldur_core.quotas.models import Quota, QuotaUsageSample
 
 from waldur_core.structure.tests import factories as structure_factories
 
@@ -23,3 +31,49 @@ class RecalculateCommandTest(TestCase):
 
         call_command('recalculatequotas')
         self.assertEqual(customer.quotas.get(name='nc_resource_count').usage, 0)
+
+
+class InitQuotaSamplesCommandTest(TestCase):
+
+    def setUp(self):
+        customer = structure_factories.CustomerFactory()
+        self.quota = customer.quotas.get(name='nc_project_count')
+        self.earliest_sample_date = self.quota.usage_samples.earliest('date').date
+
+    def create_version(self, usage, date):
+        reversion.register(Quota, fields=['usage', 'limit'])
+        try:
+            self.quota.usage = usage
+            with reversion.create_revision():
+                reversion.add_to_revision(self.quota)
+        finally:
+            reversion.unregister(Quota)
+        Revision.objects.filter(
+            version__content_type=ContentType.objects.get_for_model(Quota),
+            version__object_id=str(self.quota.pk),
+        ).filter(
+            date_created__gt=self.earliest_sample_date).update(date_created=date)
+
+    def test_versions_older_than_earliest_sample_are_converted_to_samples(self):
+        self.create_version(usage=5, date=self.earliest_sample_date - timedelta(days=2))
+        self.create_version(usage=7, date=self.earliest_sample_date + timedelta(days=1))
+
+        call_command('initquotasamples')
+
+        samples = self.quota.usage_samples.order_by('date')
+        self.assertEqual([sample.usage for sample in samples], [5, 0])
+
+
+class ClearQuotasHistoryCommandTest(TestCase):
+
+    @mock.patch('waldur_core.quotas.management.commands.clearquotashistory.input', return_value='y')
+    def test_samples_repeating_previous_sample_are_deleted(self, input_mock):
+        customer = structure_factories.CustomerFactory()
+        quota = customer.quotas.get(name='nc_project_count')
+        quota.usage_samples.all().delete()
+        for usage in [1, 1, 2, 1]:
+            QuotaUsageSample.objects.create(quota=quota, usage=usage, limit=quota.limit)
+
+        call_command('clearquotashistory', stdout=mock.Mock())
+
+        self.assertEqual([sample.usage for sample in quota.usage_samples.order_by('date', 'id')], [1, 2, 1])
@@ -1,5 +1,10 @@
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
 from django.test import TestCase
+from six.moves import mock
 
+from waldur_core.core.tests.helpers import override_waldur_core_settings
 from waldur_core.quotas import models
 from waldur_core.structure import models as structure_models
 from waldur_core.structure.tests import factories as structure_factories
@@ -23,3 +28,50 @@ class GlobalQuotasHandlersTestCase(TestCase):
 
         reread_quota = models.Quota.objects.get(pk=quota.pk)
         self.assertEqual(reread_quota.usage, quota.usage - 1)
+
+
+@override_waldur_core_settings(
+    GLOBAL_QUOTA_SHARDS={'ENABLED': True, 'COUNT': 4, 'SELECTION': 'random', 'CACHE_TIMEOUT': 60})
+# transaction of TestCase is never committed, so shards usage cache is invalidated immediately.
+@mock.patch('django.db.transaction.on_commit', lambda func: func())
+class ShardedGlobalQuotasHandlersTestCase(TestCase):
+
+    def setUp(self):
+        # shards usage is cached, make sure that cache does not contain values from other tests.
+        cache.clear()
+        self.quota = models.Quota.objects.get(name=structure_models.Project.GLOBAL_COUNT_QUOTA_NAME)
+
+    def test_project_creation_increases_shard_usage_instead_of_quota_row(self):
+        structure_factories.ProjectFactory()
+
+        self.assertEqual(models.Quota.objects.filter(pk=self.quota.pk).values_list('usage', flat=True)[0],
+                         self.quota.usage)
+        self.assertEqual(self.quota.usage_shards.aggregate(Sum('usage'))['usage__sum'], 1)
+
+    def test_quota_usage_includes_shards_usage(self):
+        structure_factories.ProjectFactory()
+        project = structure_factories.ProjectFactory()
+        project.delete()
+
+        reread_quota = models.Quota.objects.get(pk=self.quota.pk)
+        self.assertEqual(reread_quota.usage, self.quota.usage + 1)
+
+    def test_recalculation_rebuilds_shards(self):
+        structure_factories.ProjectFactory()
+
+        call_command('recalculatequotas')
+
+        reread_quota = models.Quota.objects.get(pk=self.quota.pk)
+        self.assertEqual(reread_quota.usage, structure_models.Project.objects.count())
+        self.assertEqual(reread_quota.usage_shards.count(), 4)
+        self.assertFalse(reread_quota.usage_shards.exclude(usage=0).exists())
+
+    def test_shards_usage_cache_is_invalidated_after_commit(self):
+        self.quota.get_shards_usage()
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            structure_factories.ProjectFactory()
+
+        self.assertEqual(models.Quota.objects.get(pk=self.quota.pk).usage, self.quota.usage)
+        for call in on_commit.call_args_list:
+            call[0][0]()
+        self.assertEqual(models.Quota.objects.get(pk=self.quota.pk).usage, self.quota.usage + 1)
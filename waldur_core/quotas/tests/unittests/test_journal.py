@@ -0,0 +1,49 @@
+from django.test import TestCase
+
+from ..models import GrandparentModel, ParentModel, ChildModel
+from ... import exceptions
+from ...journal import quota_usage_journal
+
+
+class QuotaUsageJournalTest(TestCase):
+
+    def setUp(self):
+        self.grandparent = GrandparentModel.objects.create()
+        self.parent = ParentModel.objects.create(parent=self.grandparent)
+
+    def test_usage_is_applied_on_journal_flush(self):
+        with quota_usage_journal():
+            for _ in range(3):
+                ChildModel.objects.create(parent=self.parent)
+            self.assertEqual(self.parent.quotas.get(name='counter_quota').usage, 0)
+
+        self.assertEqual(self.parent.quotas.get(name='counter_quota').usage, 3)
+        self.assertEqual(self.parent.quotas.get(name='delta_quota').usage, 30)
+
+    def test_coalesced_delta_creates_one_quota_usage_sample(self):
+        quota = self.parent.quotas.get(name='counter_quota')
+        samples_count = quota.usage_samples.count()
+
+        with quota_usage_journal():
+            for _ in range(3):
+                ChildModel.objects.create(parent=self.parent)
+
+        self.assertEqual(quota.usage_samples.count(), samples_count + 1)
+
+    def test_aggregator_quotas_are_updated_on_journal_flush(self):
+        children = [ChildModel.objects.create(parent=self.parent) for _ in range(2)]
+
+        with quota_usage_journal():
+            for child in children:
+                child.add_quota_usage('usage_aggregator_quota', 10)
+
+        self.assertEqual(self.parent.quotas.get(name='usage_aggregator_quota').usage, 20)
+        self.assertEqual(self.grandparent.quotas.get(name='usage_aggregator_quota').usage, 20)
+
+    def test_validation_considers_pending_deltas(self):
+        with self.assertRaises(exceptions.QuotaValidationError):
+            with quota_usage_journal():
+                for _ in range(2):
+                    self.grandparent.add_quota_usage('quota_with_default_limit', 60, validate=True)
+
+        self.assertEqual(self.grandparent.quotas.get(name='quota_with_default_limit').usage, 0)
@@ -1,9 +1,12 @@
 import random
 
+from django.db.models import signals
 from django.test import TestCase
+from six.moves import mock
 
-from ..models import GrandparentModel
+from ..models import ChildModel, GrandparentModel, ParentModel
 from ... import exceptions
+from ...models import Quota
 
 
 class QuotaModelMixinTest(TestCase):
@@ -79,3 +82,171 @@ class QuotaModelMixinTest(TestCase):
         sum_of_quotas = GrandparentModel.get_sum_of_quotas_as_dict(
             instances, quota_names=['regular_quota'], fields=['limit'])
         self.assertEqual({'regular_quota': -1}, sum_of_quotas)
+
+    def test_quotas_sum_calculation_for_querysets_of_different_models(self):
+        grandparent = GrandparentModel.objects.create()
+        parent = ParentModel.objects.create(parent=grandparent)
+        grandparent.set_quota_limit('usage_aggregator_quota', 10)
+        parent.set_quota_limit('usage_aggregator_quota', 20)
+        querysets = [GrandparentModel.objects.all(), ParentModel.objects.all()]
+
+        with self.assertNumQueries(1):
+            sum_of_quotas = GrandparentModel.get_sum_of_quotas_for_querysets(
+                querysets, quota_names=['usage_aggregator_quota'])
+
+        self.assertEqual(sum_of_quotas['usage_aggregator_quota'], 30)
+
+    def test_unlimited_quotas_of_model_are_ignored_if_quotas_of_other_model_are_limited(self):
+        grandparent = GrandparentModel.objects.create()
+        parent = ParentModel.objects.create(parent=grandparent)
+        other_parent = ParentModel.objects.create(parent=grandparent)
+        grandparent.set_quota_limit('usage_aggregator_quota', -1)
+        parent.set_quota_limit('usage_aggregator_quota', 20)
+        other_parent.set_quota_limit('usage_aggregator_quota', 5)
+        querysets = [GrandparentModel.objects.all(), ParentModel.objects.all()]
+
+        with self.assertNumQueries(1):
+            sum_of_quotas = GrandparentModel.get_sum_of_quotas_for_querysets(
+                querysets, quota_names=['usage_aggregator_quota'])
+
+        self.assertEqual(sum_of_quotas['usage_aggregator_quota'], 25)
+
+    def test_sum_of_limits_is_unlimited_if_quotas_of_all_models_are_unlimited(self):
+        grandparent = GrandparentModel.objects.create()
+        parent = ParentModel.objects.create(parent=grandparent)
+        ParentModel.objects.create(parent=grandparent)
+        grandparent.set_quota_limit('usage_aggregator_quota', -1)
+        parent.set_quota_limit('usage_aggregator_quota', -1)
+        querysets = [GrandparentModel.objects.all(), ParentModel.objects.all()]
+
+        sum_of_quotas = GrandparentModel.get_sum_of_quotas_for_querysets(
+            querysets, quota_names=['usage_aggregator_quota'])
+
+        self.assertEqual(sum_of_quotas['usage_aggregator_quota'], -1)
+
+
+class QuotasPrefetchTest(TestCase):
+
+    def setUp(self):
+        for _ in range(3):
+            GrandparentModel.objects.create()
+
+    def test_quotas_of_all_scopes_are_fetched_with_one_query(self):
+        with self.assertNumQueries(2):
+            scopes = list(GrandparentModel.objects.all().prefetch_quotas())
+            for scope in scopes:
+                scope.get_quota('regular_quota')
+                scope.get_quota('quota_with_default_limit')
+                self.assertEqual(scope.regular_quota, -1)
+
+    def test_prefetched_quota_is_updated_on_write(self):
+        scope = GrandparentModel.objects.all().prefetch_quotas().first()
+        scope.add_quota_usage('regular_quota', 5)
+        scope.set_quota_limit('regular_quota', 10)
+
+        with self.assertNumQueries(0):
+            quota = scope.get_quota('regular_quota')
+        self.assertEqual(quota.usage, 5)
+        self.assertEqual(quota.limit, 10)
+        self.assertEqual(scope.quotas.get(name='regular_quota').usage, 5)
+
+    def test_quota_is_fetched_from_db_if_quotas_were_not_prefetched(self):
+        scope = GrandparentModel.objects.first()
+        with self.assertNumQueries(1):
+            scope.get_quota('regular_quota')
+
+
+class QuotaAddUsageTest(TestCase):
+
+    def setUp(self):
+        self.scope = GrandparentModel.objects.create()
+        self.quota = self.scope.quotas.get(name='quota_with_default_limit')
+
+    def test_usage_is_increased_on_database_side(self):
+        # simulate concurrent change that is not visible for current quota instance
+        Quota.objects.filter(pk=self.quota.pk).update(usage=5)
+
+        self.assertTrue(self.quota.add_usage(10))
+        self.assertEqual(self.quota.usage, 15)
+        self.assertEqual(Quota.objects.get(pk=self.quota.pk).usage, 15)
+
+    def test_usage_is_not_changed_if_limit_is_exceeded(self):
+        Quota.objects.filter(pk=self.quota.pk).update(usage=95)
+
+        self.assertFalse(self.quota.add_usage(10, validate=True))
+        self.assertEqual(Quota.objects.get(pk=self.quota.pk).usage, 95)
+
+    def test_usage_does_not_become_negative(self):
+        self.quota.add_usage(-10)
+        self.assertEqual(Quota.objects.get(pk=self.quota.pk).usage, 0)
+
+    def test_quota_usage_sample_is_created(self):
+        self.quota.add_usage(10)
+        self.assertEqual(self.quota.usage_samples.latest('date').usage, 10)
+
+    def test_clamped_delta_is_propagated_to_aggregators(self):
+        parent = ParentModel.objects.create(parent=self.scope)
+        children = [ChildModel.objects.create(parent=parent) for _ in range(2)]
+        children[0].add_quota_usage('usage_aggregator_quota', 5)
+        children[1].add_quota_usage('usage_aggregator_quota', 3)
+
+        children[1].add_quota_usage('usage_aggregator_quota', -10)
+
+        self.assertEqual(children[1].quotas.get(name='usage_aggregator_quota').usage, 0)
+        self.assertEqual(parent.quotas.get(name='usage_aggregator_quota').usage, 5)
+        self.assertEqual(self.scope.quotas.get(name='usage_aggregator_quota').usage, 5)
+
+    def test_post_save_signal_is_sent(self):
+        handler = mock.Mock()
+        signals.post_save.connect(handler, sender=Quota, dispatch_uid='test_add_usage_post_save')
+        try:
+            self.quota.add_usage(10)
+        finally:
+            signals.post_save.disconnect(sender=Quota, dispatch_uid='test_add_usage_post_save')
+
+        self.assertEqual(handler.call_count, 1)
+        self.assertEqual(handler.call_args[1]['instance'].usage, 10)
+
+
+class QuotaViolationsTest(TestCase):
+
+    def setUp(self):
+        self.grandparent = GrandparentModel.objects.create()
+        self.parent = ParentModel.objects.create(parent=self.grandparent)
+        self.quota_name = 'usage_aggregator_quota'
+
+    def test_ancestors_quotas_are_validated(self):
+        self.grandparent.set_quota_limit(self.quota_name, 3)
+
+        violations = self.parent.get_quota_violations({self.quota_name: 5}, include_ancestors=True)
+
+        self.assertEqual(len(violations), 1)
+        violation = violations[0]
+        self.assertEqual(violation.scope, self.grandparent)
+        self.assertEqual((violation.name, violation.limit, violation.required), (self.quota_name, 3, 5))
+
+    def test_ancestors_quotas_are_not_validated_by_default(self):
+        self.grandparent.set_quota_limit(self.quota_name, 3)
+
+        self.assertEqual(self.parent.validate_quota_change({self.quota_name: 5}), [])
+
+    def test_prefetched_quotas_are_used_for_validation(self):
+        grandparent = GrandparentModel.objects.filter(pk=self.grandparent.pk).prefetch_quotas().get()
+        grandparent.get_quota(self.quota_name).limit = 3
+
+        with self.assertNumQueries(0):
+            errors = grandparent.validate_quota_change({self.quota_name: 5})
+
+        self.assertEqual(len(errors), 1)
+
+    def test_prefetched_quotas_are_not_used_if_lock_is_requested(self):
+        grandparent = GrandparentModel.objects.filter(pk=self.grandparent.pk).prefetch_quotas().get()
+
+        with self.assertNumQueries(1):
+            grandparent.get_quota_violations({self.quota_name: 5}, lock=True)
+
+    def test_exception_is_raised_if_ancestor_quota_is_exceeded(self):
+        self.grandparent.set_quota_limit(self.quota_name, 3)
+
+        self.assertRaises(exceptions.QuotaExceededException, self.parent.validate_quota_change,
+                          {self.quota_name: 5}, raise_exception=True, include_ancestors=True)
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import models as test_models
+from ... import tasks
+from ...models import QuotaUsageSample
+
+
+class RollupUsageSamplesTest(TestCase):
+
+    def setUp(self):
+        self.scope = test_models.GrandparentModel.objects.create()
+        self.quota = self.scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
+        self.quota.usage_samples.all().delete()
+        self.date = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=30)
+
+    def create_sample(self, usage, minutes):
+        return QuotaUsageSample.objects.create(
+            quota=self.quota, usage=usage, limit=-1, date=self.date + timedelta(minutes=minutes))
+
+    def test_latest_sample_of_hour_is_kept(self):
+        self.create_sample(usage=1, minutes=10)
+        self.create_sample(usage=2, minutes=20)
+        self.create_sample(usage=3, minutes=70)
+
+        tasks.rollup_usage_samples()
+
+        samples = self.quota.usage_samples.order_by('date')
+        self.assertEqual([sample.usage for sample in samples], [2, 3])
+        self.assertTrue(all(sample.granularity == QuotaUsageSample.Granularity.HOUR for sample in samples))
+
+    def test_latest_sample_is_selected_by_date(self):
+        # sample created from old history has greater id than newer samples
+        self.create_sample(usage=2, minutes=20)
+        self.create_sample(usage=1, minutes=10)
+
+        tasks.rollup_usage_samples()
+
+        self.assertEqual([sample.usage for sample in self.quota.usage_samples.all()], [2])
+
+    def test_recent_samples_are_not_changed(self):
+        QuotaUsageSample.objects.create(quota=self.quota, usage=1, limit=-1)
+        QuotaUsageSample.objects.create(quota=self.quota, usage=2, limit=-1)
+
+        tasks.rollup_usage_samples()
+
+        self.assertEqual(self.quota.usage_samples.filter(granularity=QuotaUsageSample.Granularity.RAW).count(), 2)
+
+
+class QuotaUsageSamplesTest(TestCase):
+
+    def test_sample_is_created_on_usage_change(self):
+        scope = test_models.GrandparentModel.objects.create()
+        quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
+
+        quota.add_usage(5)
+
+        self.assertEqual(quota.usage_samples.latest('id').usage, 5)
+
+    def test_latest_sample_before_point_is_returned(self):
+        scope = test_models.GrandparentModel.objects.create()
+        quota = scope.quotas.get(name=test_models.GrandparentModel.Quotas.regular_quota)
+        now = timezone.now()
+        quota.usage_samples.update(date=now - timedelta(hours=2))
+        QuotaUsageSample.objects.create(quota=quota, usage=7, limit=-1, date=now - timedelta(hours=1))
+
+        samples = quota.get_usage_samples([now - timedelta(hours=3), now - timedelta(minutes=90), now])
+
+        self.assertIsNone(samples[0])
+        self.assertEqual(samples[1].usage, 0)
+        self.assertEqual(samples[2].usage, 7)
+
+    def test_samples_of_several_quotas_are_returned_for_points(self):
+        scope = test_models.GrandparentModel.objects.create()
+        quotas = list(scope.quotas.all())
+        now = timezone.now()
+        QuotaUsageSample.objects.filter(quota__in=quotas).update(date=now - timedelta(hours=2))
+        QuotaUsageSample.objects.create(quota=quotas[0], usage=7, limit=-1, date=now - timedelta(hours=1))
+
+        samples = QuotaUsageSample.get_for_points([quota.id for quota in quotas], [now - timedelta(hours=3), now])
+
+        self.assertEqual(samples[quotas[0].id][1].usage, 7)
+        for quota in quotas:
+            self.assertIsNone(samples[quota.id][0])
+            self.assertIsNotNone(samples[quota.id][1])
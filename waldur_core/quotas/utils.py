@@ -1,7 +1,37 @@
+from collections import defaultdict
+
 from django.apps import apps
+from django.utils.lru_cache import lru_cache
 
-from waldur_core.quotas import models
+from waldur_core.quotas import models, fields
 
 
 def get_models_with_quotas():
     return [m for m in apps.get_models() if issubclass(m, models.QuotaModelMixin)]
+
+
+@lru_cache(maxsize=1)
+def get_aggregator_fields_index():
+    """ Return index of aggregator fields by name of aggregated child quota.
+
+        Index format:
+        {
+            'child_quota_name': {
+                AncestorModel: [aggregator_field1, aggregator_field2, ...],
+                ...
+            },
+            ...
+        }
+        Index is built on application initialization and is rebuilt
+        if quota field is added to model in runtime.
+    """
+    index = defaultdict(lambda: defaultdict(list))
+    for model in get_models_with_quotas():
+        for field in model.get_quotas_fields(field_class=fields.AggregatorQuotaField):
+            index[field.get_child_quota_name()][model].append(field)
+    return {name: dict(fields_by_model) for name, fields_by_model in index.items()}
+
+
+def get_aggregator_fields(quota_name):
+    """ Return aggregator fields of all models that aggregate quota with given name. """
+    return get_aggregator_fields_index().get(quota_name, {})
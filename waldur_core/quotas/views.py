@@ -1,17 +1,28 @@
 from __future__ import unicode_literals
 
+import json
+
+from django.http import StreamingHttpResponse
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions as rf_exceptions, decorators, response, status
 from rest_framework import mixins
 from rest_framework import viewsets
-from reversion.models import Version
+from rest_framework.utils.encoders import JSONEncoder
 
-from waldur_core.core.pagination import UnlimitedLinkHeaderPagination
+from waldur_core.core.pagination import (
+    KeysetLinkHeaderPagination, UnlimitedLinkHeaderPagination, iterate_by_keyset)
 from waldur_core.core.serializers import HistorySerializer
 from waldur_core.core.utils import datetime_to_timestamp
 from waldur_core.quotas import models, serializers, filters, exceptions
 
 
+class KeysetQuotaPagination(KeysetLinkHeaderPagination):
+    orderings = {
+        'id': ('id',),
+        'name': ('name', 'id'),
+    }
+
+
 class QuotaViewSet(mixins.UpdateModelMixin,
                    viewsets.ReadOnlyModelViewSet):
     queryset = models.Quota.objects.all()
@@ -20,18 +31,51 @@ class QuotaViewSet(mixins.UpdateModelMixin,
     # XXX: Remove a custom pagination class once the quota calculation has been made more efficient
     pagination_class = UnlimitedLinkHeaderPagination
     filter_class = filters.QuotaFilterSet
+    export_chunk_size = 1000
 
     def get_queryset(self):
-        return models.Quota.objects.filtered_for_user(self.request.user)
+        # scopes are fetched with one query per scope model
+        return models.Quota.objects.filtered_for_user(self.request.user).prefetch_related('scope')
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if KeysetQuotaPagination.cursor_query_param in self.request.query_params:
+                self._paginator = KeysetQuotaPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def list(self, request, *args, **kwargs):
         """
         To get an actual value for object quotas limit and usage issue a **GET** request against */api/<objects>/*.
 
         To get all quotas visible to the user issue a **GET** request against */api/quotas/*
+
+        To get quotas page by page add *?cursor* parameter to the request. It should be empty for the first page,
+        link to the next page is rendered in **Link** header. Quotas are ordered by id by default,
+        add *?cursor_ordering=name* parameter to order them by name. Page size is defined by *?page_size* parameter.
         """
         return super(QuotaViewSet, self).list(request, *args, **kwargs)
 
+    @decorators.list_route()
+    def export(self, request):
+        """
+        To export all quotas visible to the user issue a **GET** request against */api/quotas/export/*.
+        Quotas are rendered as JSON list, response is streamed, so quotas are not loaded into memory at once.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self._render_quotas(queryset), content_type='application/json')
+
+    def _render_quotas(self, queryset):
+        separator = ''
+        yield '['
+        for chunk in iterate_by_keyset(queryset, chunk_size=self.export_chunk_size):
+            for item in self.get_serializer(chunk, many=True).data:
+                yield separator + json.dumps(item, cls=JSONEncoder)
+                separator = ','
+        yield ']'
+
     def retrieve(self, request, *args, **kwargs):
         """
         To set quota limit issue a **PUT** request against */api/quotas/<quota uuid>** with limit values.
@@ -137,15 +181,14 @@ class QuotaViewSet(mixins.UpdateModelMixin,
         quota = self.get_object()
         serializer = self.get_serializer(quota)
         serialized_versions = []
-        for point_date in history_serializer.get_filter_data():
+        points = history_serializer.get_filter_data()
+        for point_date, sample in zip(points, quota.get_usage_samples(points)):
             serialized = {'point': datetime_to_timestamp(point_date)}
-            version = Version.objects.get_for_object(quota).filter(revision__date_created__lte=point_date)
-            if version.exists():
-                # make copy of serialized data and update field that are stored in version
-                version_object = version.first()._object_version.object
+            if sample is not None:
+                # make copy of serialized data and update field that are stored in sample
                 serialized['object'] = serializer.data.copy()
                 serialized['object'].update({
-                    f: getattr(version_object, f) for f in quota.get_version_fields()
+                    f: getattr(sample, f) for f in ('usage', 'limit')
                 })
             serialized_versions.append(serialized)
         return response.Response(serialized_versions, status=status.HTTP_200_OK)
@@ -63,6 +63,7 @@ MIDDLEWARE = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'waldur_core.logging.middleware.CaptureEventContextMiddleware',
+    'waldur_core.structure.middleware.RoleCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'defender.middleware.FailedLoginMiddleware',
@@ -236,6 +237,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(minutes=30),
         'args': (),
     },
+    'rollup-quota-usage-samples': {
+        'task': 'waldur_core.quotas.rollup_usage_samples',
+        'schedule': timedelta(hours=1),
+        'args': (),
+    },
     'cancel-expired-invitations': {
         'task': 'waldur_core.users.cancel_expired_invitations',
         'schedule': timedelta(hours=24),
@@ -284,6 +290,27 @@ WALDUR_CORE = {
     'NOTIFICATIONS_PROFILE_CHANGES': {'ENABLED': True, 'FIELDS': ('email', 'phone_number', 'job_title')},
     # 'COUNTRIES': ['EE', 'LV', 'LT'],
     'ENABLE_ACCOUNTING_START_DATE': False,
+    # Store usage of global count quotas in several rows to reduce lock contention on the single quota row.
+    # SELECTION defines how shard is chosen on usage change: 'random' or 'pid' (current process ID).
+    # Sum of shards is cached for CACHE_TIMEOUT seconds and is invalidated on each usage change.
+    'GLOBAL_QUOTA_SHARDS': {'ENABLED': False, 'COUNT': 16, 'SELECTION': 'random', 'CACHE_TIMEOUT': 60},
+    # Cache scope quotas for reading, for example by QuotaLimitField. Quotas validation always uses database.
+    'QUOTA_CACHE': {'ENABLED': False, 'TIMEOUT': 300},
+    # Quota usage and limit are stored as samples on each quota change and are used as quota history.
+    # Raw samples older than RAW_RETENTION are rolled up to hourly samples, hourly samples older than
+    # HOURLY_RETENTION - to daily ones. Daily samples older than DAILY_RETENTION are deleted, None means forever.
+    'QUOTA_USAGE_SAMPLES': {
+        'ENABLED': True,
+        'RAW_RETENTION': timedelta(days=7),
+        'HOURLY_RETENTION': timedelta(days=90),
+        'DAILY_RETENTION': None,
+    },
+    # Cache customer and project counters. Cache is invalidated when related objects or permissions are changed.
+    'COUNTERS_CACHE': {'ENABLED': True, 'TIMEOUT': 600},
+    # Objects of background list pull tasks are pulled by chunks of CHUNK_SIZE objects of the same service settings,
+    # not more than MAX_CONCURRENCY chunks of one service settings are pulled simultaneously.
+    # Set CHUNK_SIZE to None to pull each object by separate task. Tasks could override these values.
+    'BACKGROUND_PULL': {'CHUNK_SIZE': 50, 'MAX_CONCURRENCY': 2},
 }
 
 WALDUR_CORE_PUBLIC_SETTINGS = [
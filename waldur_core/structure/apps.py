@@ -10,9 +10,10 @@ class StructureConfig(AppConfig):
     verbose_name = 'Structure'
 
     def ready(self):
-        from waldur_core.core.models import CoordinatesMixin, User
+        from waldur_core.core.models import CoordinatesMixin, HierarchyClosure, User
         from waldur_core.structure.executors import check_cleanup_executors
-        from waldur_core.structure.models import ResourceMixin, Service, TagMixin, VirtualMachine
+        from waldur_core.structure.models import (ResourceIndex, ResourceMixin, Service, ServiceProjectLink,
+                                                  SubResource, TagMixin, VirtualMachine)
         from waldur_core.structure import handlers
         from waldur_core.structure import signals as structure_signals
 
@@ -68,6 +69,45 @@ class StructureConfig(AppConfig):
                 dispatch_uid='waldur_core.structure.handlers.%s' % name,
             )
 
+        for model in structure_models_with_roles:
+            for signal in (structure_signals.structure_role_granted, structure_signals.structure_role_revoked):
+                signal.connect(
+                    handlers.sync_permission_index_on_role_change,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.sync_permission_index_on_role_change_%s' %
+                                 model.__name__,
+                )
+
+        for model in structure_models_with_roles:
+            for signal in (structure_signals.structure_role_granted, structure_signals.structure_role_revoked):
+                signal.connect(
+                    handlers.invalidate_role_cache_on_role_change,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.invalidate_role_cache_on_role_change_%s' %
+                                 model.__name__,
+                )
+
+        for model in (CustomerPermission, ProjectPermission):
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                    handlers.invalidate_role_cache,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.invalidate_role_cache_%s' % model.__name__,
+                )
+
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(
+                handlers.sync_customer_permission_index,
+                sender=CustomerPermission,
+                dispatch_uid='waldur_core.structure.handlers.sync_customer_permission_index',
+            )
+
+            signal.connect(
+                handlers.sync_project_permission_index,
+                sender=ProjectPermission,
+                dispatch_uid='waldur_core.structure.handlers.sync_project_permission_index',
+            )
+
         structure_signals.structure_role_granted.connect(
             handlers.log_customer_role_granted,
             sender=Customer,
@@ -202,6 +242,87 @@ class StructureConfig(AppConfig):
             dispatch_uid='waldur_core.structure.handlers.clean_tags_cache_after_tagged_item_created'
         )
 
+        for index, model in enumerate(ResourceMixin.get_all_models()):
+            signals.post_save.connect(
+                handlers.update_resource_index,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.update_resource_index_{}_{}'.format(
+                    model.__name__, index),
+            )
+
+            signals.post_delete.connect(
+                handlers.delete_resource_index,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.delete_resource_index_{}_{}'.format(
+                    model.__name__, index),
+            )
+
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(
+                handlers.update_resource_index_on_tags_change,
+                sender=TagMixin.tags.through,
+                dispatch_uid='waldur_core.structure.handlers.update_resource_index_on_tags_change',
+            )
+
+        signals.post_migrate.connect(
+            handlers.init_resource_index,
+            sender=self,
+            dispatch_uid='waldur_core.structure.handlers.init_resource_index',
+        )
+
+        for model in [Project, CustomerPermission, ResourceIndex] + Service.get_all_models():
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                    handlers.invalidate_counters,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.invalidate_counters_{}'.format(model.__name__),
+                )
+
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(
+                handlers.invalidate_customer_counters,
+                sender=Customer,
+                dispatch_uid='waldur_core.structure.handlers.invalidate_customer_counters',
+            )
+
+            signal.connect(
+                handlers.invalidate_counters_on_project_permission_change,
+                sender=ProjectPermission,
+                dispatch_uid='waldur_core.structure.handlers.invalidate_counters_on_project_permission_change',
+            )
+
+        for model in structure_models_with_roles:
+            for signal in (structure_signals.structure_role_granted, structure_signals.structure_role_revoked):
+                signal.connect(
+                    handlers.invalidate_counters_on_role_change,
+                    sender=model,
+                    dispatch_uid='waldur_core.structure.handlers.invalidate_counters_on_role_change_%s' %
+                                 model.__name__,
+                )
+
+        hierarchy_models = ([Customer, Project] + Service.get_all_models() + ServiceProjectLink.get_all_models() +
+                            ResourceMixin.get_all_models() + SubResource.get_all_models())
+        for model in hierarchy_models:
+            HierarchyClosure.register(model)
+
+            signals.post_save.connect(
+                handlers.add_object_to_hierarchy_closure,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.add_object_to_hierarchy_closure_%s' % model.__name__,
+            )
+
+            signals.post_delete.connect(
+                handlers.remove_object_from_hierarchy_closure,
+                sender=model,
+                dispatch_uid='waldur_core.structure.handlers.remove_object_from_hierarchy_closure_%s' % model.__name__,
+            )
+
+        signals.post_migrate.connect(
+            handlers.init_hierarchy_closure,
+            sender=self,
+            dispatch_uid='waldur_core.structure.handlers.init_hierarchy_closure',
+        )
+
         signals.post_save.connect(
             handlers.notify_about_user_profile_changes,
             sender=User,
@@ -0,0 +1,63 @@
+""" Cache of customer and project counters.
+
+Counters are cached per object and class of user role: users that can see all objects of customer or project
+share cached values, other users have their own ones. Each customer has version stored in cache, it is
+increased on any change of customer, its projects, services, resources and permissions. Counters of customer
+and its projects are stored under versioned key, so such change makes them unreachable.
+"""
+from __future__ import unicode_literals
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def is_enabled():
+    return settings.WALDUR_CORE['COUNTERS_CACHE']['ENABLED']
+
+
+def get_key(customer_id, scope, role_key):
+    """ Return cache key of scope counters. Key should be obtained before counters are calculated,
+        so that concurrent change makes calculated values unreachable.
+    """
+    return 'structure:counters:%s:%s:%s:%s:%s' % (
+        customer_id, _get_version(customer_id), scope._meta.label_lower, scope.pk, role_key)
+
+
+def get_counters(key):
+    """ Return dictionary of cached counters or empty dictionary. """
+    if not is_enabled():
+        return {}
+    return cache.get(key) or {}
+
+
+def set_counters(key, counters):
+    if not is_enabled() or not counters:
+        return
+    values = cache.get(key) or {}
+    values.update(counters)
+    cache.set(key, values, settings.WALDUR_CORE['COUNTERS_CACHE']['TIMEOUT'])
+
+
+def invalidate(customer_id):
+    if not is_enabled() or customer_id is None:
+        return
+    version_key = _get_version_key(customer_id)
+    cache.add(version_key, int(time.time() * 1000), None)
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        # version key was evicted between add and incr calls
+        pass
+
+
+def _get_version_key(customer_id):
+    return 'structure:counters:%s:version' % customer_id
+
+
+def _get_version(customer_id):
+    # version starts from current time, so versions are not reused if version key is evicted from cache
+    version_key = _get_version_key(customer_id)
+    cache.add(version_key, int(time.time() * 1000), None)
+    return cache.get(version_key)
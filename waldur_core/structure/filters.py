@@ -737,7 +737,7 @@ def filter_alerts_by_aggregate(queryset, aggregate, user, uuid=None):
     aggregates_ids = aggregate_query.values_list('id', flat=True)
     query = {'%s__in' % aggregate: aggregates_ids}
 
-    all_models = models.ResourceMixin.get_all_models() + models.ServiceProjectLink.get_all_models()
+    all_models = models.ServiceProjectLink.get_all_models()
     if aggregate == 'customer':
         all_models += models.Service.get_all_models()
         all_models.append(models.Project)
@@ -753,6 +753,12 @@ def filter_alerts_by_aggregate(queryset, aggregate, user, uuid=None):
         ids = qs.values_list('id', flat=True)
         aggregate_query |= Q(content_type=content_type, object_id__in=ids)
 
+    # resources of all types are looked up in resource index
+    resources = filter_queryset_for_user(models.ResourceIndex.objects.filter(**query), user)
+    for content_type_id in resources.order_by().values_list('content_type_id', flat=True).distinct():
+        ids = resources.filter(content_type_id=content_type_id).values_list('object_id', flat=True)
+        aggregate_query |= Q(content_type_id=content_type_id, object_id__in=ids)
+
     return queryset.filter(aggregate_query)
 
 
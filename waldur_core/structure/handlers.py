@@ -8,12 +8,14 @@ from django.template.loader import render_to_string
 from django.utils import timezone
 
 from waldur_core.core import utils
-from waldur_core.core.models import StateMixin
+from waldur_core.core.models import HierarchyClosure, StateMixin
 from waldur_core.core.tasks import send_task
-from waldur_core.structure import SupportedServices, signals
+from waldur_core.structure import SupportedServices, counters, linking, signals
 from waldur_core.structure.log import event_logger
+from waldur_core.structure.middleware import get_role_cache
 from waldur_core.structure.models import (Customer, CustomerPermission, Project, ProjectPermission,
-                                          Service, ServiceSettings, CustomerRole)
+                                          Service, ServiceSettings, CustomerRole, UserPermissionIndex,
+                                          ResourceIndex, ResourceMixin)
 
 logger = logging.getLogger(__name__)
 
@@ -209,6 +211,38 @@ def change_customer_nc_users_quota(sender, structure, user, role, signal, **kwar
     customer.set_quota_usage(Customer.Quotas.nc_user_count, customer_users.count())
 
 
+def sync_permission_index_on_role_change(sender, structure, user, **kwargs):
+    """ Update permission index on structure role grant or revoke """
+    if sender == Project:
+        UserPermissionIndex.sync(user.pk, project_id=structure.pk)
+    else:
+        UserPermissionIndex.sync(user.pk, customer_id=structure.pk)
+
+
+def sync_customer_permission_index(sender, instance, **kwargs):
+    """ Update permission index on customer permission save or delete """
+    UserPermissionIndex.sync(instance.user_id, customer_id=instance.customer_id)
+
+
+def sync_project_permission_index(sender, instance, **kwargs):
+    """ Update permission index on project permission save or delete """
+    UserPermissionIndex.sync(instance.user_id, project_id=instance.project_id)
+
+
+def invalidate_role_cache_on_role_change(sender, structure, user, **kwargs):
+    """ Drop roles of user cached for current request on structure role grant or revoke """
+    role_cache = get_role_cache()
+    if role_cache is not None:
+        role_cache.invalidate(user.pk)
+
+
+def invalidate_role_cache(sender, instance, **kwargs):
+    """ Drop roles of user cached for current request on permission save or delete """
+    role_cache = get_role_cache()
+    if role_cache is not None:
+        role_cache.invalidate(instance.user_id)
+
+
 def log_resource_deleted(sender, instance, **kwargs):
     event_logger.resource.info(
         '{resource_full_name} has been deleted.',
@@ -296,17 +330,15 @@ def connect_project_to_all_available_services(sender, instance, created=False, *
     project = instance
 
     for service_model in Service.get_all_models():
-        for service in service_model.objects.filter(available_for_all=True, customer=project.customer):
-            service_project_link_model = service.projects.through
-            service_project_link_model.objects.create(project=project, service=service)
+        services = service_model.objects.filter(available_for_all=True, customer=project.customer)
+        linking.connect_services_to_projects(services, projects=[project])
 
 
 def connect_service_to_all_projects_if_it_is_available_for_all(sender, instance, created=False, **kwargs):
     service = instance
-    if service.available_for_all:
-        service_project_link_model = service.projects.through
-        for project in service.customer.projects.all():
-            service_project_link_model.objects.get_or_create(project=project, service=service)
+    # services created by bulk linking are already connected to projects.
+    if service.available_for_all and not linking.is_bulk_linking():
+        linking.connect_services_to_projects(service.__class__.objects.filter(pk=service.pk))
 
 
 def delete_service_settings_on_service_delete(sender, instance, **kwargs):
@@ -357,6 +389,64 @@ def clean_tags_cache_before_tagged_item_deleted(sender, instance, **kwargs):
     instance.content_object.clean_tag_cache()
 
 
+def update_resource_index(sender, instance, created=False, update_fields=None, **kwargs):
+    if created:
+        ResourceIndex.update_resource(instance)
+    else:
+        ResourceIndex.update_resource_fields(instance, update_fields)
+
+
+def init_resource_index(sender, **kwargs):
+    """ Index resources that were created before index was introduced or are missing in index """
+    ResourceIndex.add_missing()
+
+
+def delete_resource_index(sender, instance, **kwargs):
+    ResourceIndex.delete_resource(instance)
+
+
+def update_resource_index_on_tags_change(sender, instance, **kwargs):
+    resource = instance.content_object
+    if resource is None or resource.__class__ not in ResourceMixin.get_all_models():
+        return
+    ResourceIndex.update_resource(resource, list(resource.tags.values_list('name', flat=True)))
+
+
+def invalidate_counters(sender, instance, **kwargs):
+    """ Invalidate cached counters of customer on change of its project, service, resource or permission """
+    counters.invalidate(instance.customer_id)
+
+
+def invalidate_customer_counters(sender, instance, **kwargs):
+    counters.invalidate(instance.pk)
+
+
+def invalidate_counters_on_project_permission_change(sender, instance, **kwargs):
+    try:
+        counters.invalidate(instance.project.customer_id)
+    except Project.DoesNotExist:
+        # permission is deleted together with project, counters are invalidated on project deletion.
+        pass
+
+
+def invalidate_counters_on_role_change(sender, structure, **kwargs):
+    counters.invalidate(structure.pk if sender == Customer else structure.customer_id)
+
+
+def add_object_to_hierarchy_closure(sender, instance, created=False, **kwargs):
+    if created:
+        HierarchyClosure.add_object(instance)
+
+
+def remove_object_from_hierarchy_closure(sender, instance, **kwargs):
+    HierarchyClosure.remove_object(instance)
+
+
+def init_hierarchy_closure(sender, **kwargs):
+    """ Store objects that were created before closure table was introduced """
+    HierarchyClosure.add_missing()
+
+
 def notify_about_user_profile_changes(sender, instance, created=False, **kwargs):
     if created or not settings.WALDUR_CORE['NOTIFICATIONS_PROFILE_CHANGES']['ENABLED']:
         return
@@ -0,0 +1,118 @@
+""" Bulk creation of services and service project links.
+
+Missing (customer, settings) and (service, project) pairs are computed per chunk
+and created with one INSERT query per chunk. Each chunk is committed separately,
+so connecting shared settings to all customers does not hold locks for the whole run.
+
+bulk_create does not send post_save signals, so they are sent explicitly for created
+objects right after insert: services first, then links, so handlers of links could rely
+on handlers of services. Handlers that link a single service to projects are suppressed
+while post_save of bulk created services is sent, because these services are linked in bulk.
+Quota usage changes of the chunk are applied with one query per quota.
+"""
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+import threading
+
+from django.db.models import signals
+
+from waldur_core.core.pagination import iterate_by_keyset
+from waldur_core.quotas import journal as quotas_journal
+from waldur_core.structure import SupportedServices, models
+
+CHUNK_SIZE = 500
+
+_locals = threading.local()
+
+
+@contextmanager
+def bulk_linking():
+    """ Mark that services created inside context are linked to projects in bulk """
+    previous = getattr(_locals, 'bulk_linking', False)
+    _locals.bulk_linking = True
+    try:
+        yield
+    finally:
+        _locals.bulk_linking = previous
+
+
+def is_bulk_linking():
+    return getattr(_locals, 'bulk_linking', False)
+
+
+def connect_shared_settings(service_settings, chunk_size=CHUNK_SIZE):
+    """ Create services of shared settings for all customers and link them to customers projects """
+    if not service_settings.shared:
+        raise ValueError('It is impossible to connect non-shared settings')
+    service_model = SupportedServices.get_service_models()[service_settings.type]['service']
+    services = service_model.objects.filter(settings=service_settings)
+
+    # services that existed before may be not linked to some projects.
+    connect_services_to_projects(services, chunk_size=chunk_size)
+
+    customers = models.Customer.objects.exclude(pk__in=services.values('customer_id')).only('pk')
+    for customers_chunk in iterate_by_keyset(customers, chunk_size=chunk_size):
+        with quotas_journal.quota_usage_journal():
+            new_services = _bulk_create(
+                [service_model(customer=customer, settings=service_settings, available_for_all=True)
+                 for customer in customers_chunk],
+                services.filter(customer__in=customers_chunk),
+                get_key=lambda service: service.customer_id,
+            )
+            links = _create_links(service_model, new_services)
+            with bulk_linking():
+                _send_post_save(service_model, new_services)
+            _send_post_save(service_model.projects.through, links)
+
+
+def connect_services_to_projects(services, projects=None, chunk_size=CHUNK_SIZE):
+    """ Link services to all projects of their customers.
+
+        If projects are given - only links to these projects are created.
+    """
+    service_model = services.model
+    for services_chunk in iterate_by_keyset(services, chunk_size=chunk_size):
+        with quotas_journal.quota_usage_journal():
+            links = _create_links(service_model, services_chunk, projects)
+            _send_post_save(service_model.projects.through, links)
+
+
+def _create_links(service_model, services, projects=None):
+    """ Create missing links between services and projects of their customers without sending signals """
+    link_model = service_model.projects.through
+    services_ids = [service.pk for service in services]
+    if not services_ids:
+        return []
+
+    pairs = service_model.objects.filter(pk__in=services_ids).values_list('pk', 'customer__projects')
+    pairs = set((service_id, project_id) for service_id, project_id in pairs if project_id is not None)
+    if projects is not None:
+        projects_ids = set(project.pk for project in projects)
+        pairs = set(pair for pair in pairs if pair[1] in projects_ids)
+    pairs -= set(link_model.objects.filter(service_id__in=services_ids).values_list('service_id', 'project_id'))
+    if not pairs:
+        return []
+
+    return _bulk_create(
+        [link_model(service_id=service_id, project_id=project_id) for service_id, project_id in sorted(pairs)],
+        link_model.objects.filter(service_id__in=set(service_id for service_id, _ in pairs)),
+        get_key=lambda link: (link.service_id, link.project_id),
+    )
+
+
+def _bulk_create(objects, queryset, get_key):
+    """ Insert objects with one query and return them fetched back from <queryset>.
+
+        Primary keys are not set by bulk_create on all database backends,
+        so created objects are selected by keys returned by <get_key> function.
+    """
+    queryset.model.objects.bulk_create(objects)
+    keys = set(get_key(obj) for obj in objects)
+    return [obj for obj in queryset if get_key(obj) in keys]
+
+
+def _send_post_save(model, objects):
+    for obj in objects:
+        signals.post_save.send(
+            sender=model, instance=obj, created=True, update_fields=None, raw=False, using=obj._state.db)
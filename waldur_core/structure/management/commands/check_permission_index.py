@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from waldur_core.structure.models import UserPermissionIndex
+
+
+class Command(BaseCommand):
+    help = """ Check that materialized index of user permissions is consistent with permissions """
+
+    def handle(self, *args, **options):
+        missing_rows, stale_rows = UserPermissionIndex.check_consistency()
+        for title, rows in (('Missing', missing_rows), ('Stale', stale_rows)):
+            for user_id, customer_id, project_id, role in sorted(rows):
+                self.stdout.write('%s row: user #%s, customer #%s, project #%s, role %s' % (
+                    title, user_id, customer_id, project_id, role))
+
+        if missing_rows or stale_rows:
+            raise CommandError('Permission index is inconsistent: %s rows are missing, %s rows are stale. '
+                               'Run rebuild_permission_index command to fix it.' % (
+                                   len(missing_rows), len(stale_rows)))
+        self.stdout.write('Permission index is consistent')
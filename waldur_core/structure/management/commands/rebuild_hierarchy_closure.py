@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.core.models import HierarchyClosure
+
+
+class Command(BaseCommand):
+    help = """ Rebuild closure table of customers, projects, services, links and resources hierarchy """
+
+    def handle(self, *args, **options):
+        count = HierarchyClosure.rebuild()
+        self.stdout.write('Hierarchy closure is rebuilt, %s links are stored' % count)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.structure.models import UserPermissionIndex
+
+
+class Command(BaseCommand):
+    help = """ Rebuild materialized index of user permissions from customer and project permissions """
+
+    def handle(self, *args, **options):
+        count = UserPermissionIndex.rebuild()
+        self.stdout.write('Permission index is rebuilt, %s rows are stored' % count)
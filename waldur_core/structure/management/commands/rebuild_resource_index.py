@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from waldur_core.structure.models import ResourceIndex
+
+
+class Command(BaseCommand):
+    help = """ Rebuild denormalized index of resources of all types """
+
+    def handle(self, *args, **options):
+        count = ResourceIndex.rebuild()
+        self.stdout.write('Resource index is rebuilt, %s resources are indexed' % count)
@@ -1,15 +1,28 @@
+from django.apps import apps
 from django.db import models
+from django.utils.lru_cache import lru_cache
 
 from waldur_core.core.managers import GenericKeyMixin, SummaryQuerySet
+from waldur_core.quotas.managers import QuotaScopeQuerySetMixin
 
 
-def get_permission_subquery(permissions, user):
+def get_permission_subquery(permissions, user, model=None):
+    """ Build filter by user permissions.
+
+        If model is specified, permissions are looked up in materialized UserPermissionIndex
+        with semi-join subqueries, so resulting queryset does not contain duplicates.
+        Otherwise permissions are joined directly, which requires DISTINCT.
+    """
     subquery = models.Q()
     for entity in ('customer', 'project'):
         path = getattr(permissions, '%s_path' % entity, None)
         if not path:
             continue
 
+        if model is not None:
+            subquery |= _get_permission_index_subquery(model, entity, path, user)
+            continue
+
         if path == 'self':
             prefix = 'permissions__'
         else:
@@ -31,6 +44,54 @@ def get_permission_subquery(permissions, user):
     return subquery
 
 
+def _get_permission_index_subquery(model, entity, path, user):
+    UserPermissionIndex = apps.get_model('structure', 'UserPermissionIndex')
+    index = UserPermissionIndex.objects.filter(user=user)
+    if entity == 'customer':
+        ids = index.filter(project__isnull=True).values('customer_id')
+    else:
+        ids = index.filter(project__isnull=False).values('project_id')
+
+    if path == 'self':
+        return models.Q(pk__in=ids)
+
+    query = models.Q(**{path + '__in': ids})
+    if _is_multivalued_path(model, path):
+        # Join through reverse or many-to-many relation duplicates rows,
+        # so it is wrapped into one more semi-join.
+        return models.Q(pk__in=model._default_manager.filter(query).values('pk'))
+    return query
+
+
+def _is_multivalued_path(model, path):
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
+_field_names = {}
+
+
+def get_field_names(model):
+    """ Return names of model fields. Result is computed once per model after models are loaded. """
+    try:
+        return _field_names[model]
+    except KeyError:
+        field_names = frozenset(field.name for field in model._meta.get_fields())
+        if apps.models_ready:
+            _field_names[model] = field_names
+        return field_names
+
+
+@lru_cache(maxsize=None)
+def get_permission_path(model, name):
+    """ Return path to customer or project defined in model Permissions class or None. """
+    return getattr(getattr(model, 'Permissions', None), '%s_path' % name, None)
+
+
 def filter_queryset_for_user(queryset, user):
     if user is None or user.is_staff or user.is_support:
         return queryset
@@ -40,14 +101,14 @@ def filter_queryset_for_user(queryset, user):
     except AttributeError:
         return queryset
 
-    subquery = get_permission_subquery(permissions, user)
+    subquery = get_permission_subquery(permissions, user, queryset.model)
     if not subquery:
         return queryset
 
-    return queryset.filter(subquery).distinct()
+    return queryset.filter(subquery)
 
 
-class StructureQueryset(models.QuerySet):
+class StructureQueryset(QuotaScopeQuerySetMixin, models.QuerySet):
     """ Provides additional filtering by customer or project (based on permission definition).
 
         Example:
@@ -75,7 +136,7 @@ class StructureQueryset(models.QuerySet):
 
     def _patch_query_argument(self, arg):
         # patch Q() objects if passed and add support of custom fields
-        if isinstance(arg, models.Q):
+        if isinstance(arg, models.Q) and self._has_custom_fields(arg):
             children = []
             for opt in arg.children:
                 if isinstance(opt, models.Q):
@@ -86,10 +147,18 @@ class StructureQueryset(models.QuerySet):
             arg.children = children
         return arg
 
+    def _has_custom_fields(self, arg):
+        if isinstance(arg, models.Q):
+            return any(self._has_custom_fields(opt) for opt in arg.children)
+        return arg[0].split('__', 1)[0] not in get_field_names(self.model)
+
     def _filter_by_custom_fields(self, **kwargs):
         # traverse over filter arguments in search of custom fields
+        fields = get_field_names(self.model)
+        if all(field.split('__', 1)[0] in fields for field in kwargs):
+            return kwargs
+
         args = {}
-        fields = [f.name for f in self.model._meta.get_fields()]
         for field, val in kwargs.items():
             base_field = field.split('__')[0]
             if base_field in fields:
@@ -104,10 +173,9 @@ class StructureQueryset(models.QuerySet):
     def _filter_by_permission_fields(self, name, field, value):
         # handle fields connected via permissions relations
         extra = '__'.join(field.split('__')[1:]) if '__' in field else None
-        try:
-            # look for the target field path in Permissions class,
-            path = getattr(self.model.Permissions, '%s_path' % name)
-        except AttributeError:
+        # look for the target field path in Permissions class,
+        path = get_permission_path(self.model, name)
+        if path is None:
             # fallback to FieldError if it's missed
             return {field: value}
         else:
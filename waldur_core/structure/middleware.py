@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict
+import threading
+
+from django.utils.deprecation import MiddlewareMixin
+
+_locals = threading.local()
+
+
+def get_role_cache():
+    return getattr(_locals, 'role_cache', None)
+
+
+def set_role_cache(role_cache):
+    _locals.role_cache = role_cache
+
+
+def reset_role_cache():
+    if hasattr(_locals, 'role_cache'):
+        del _locals.role_cache
+
+
+class RoleCache(object):
+    """ Active roles of users loaded once per request.
+
+        Roles of user are loaded with one query per permission model on the first check,
+        all subsequent checks within the same request are answered from memory.
+        Cached roles of user are dropped when his permission is granted, revoked or changed.
+    """
+
+    def __init__(self):
+        self.roles = {}
+
+    def get_roles(self, permission_field, user):
+        """ Return dictionary {structure_id: [(role, expiration_time), ...]} of active user roles. """
+        key = (permission_field.model, user.pk)
+        if key not in self.roles:
+            roles = defaultdict(list)
+            permissions = permission_field.model.objects.filter(user=user, is_active=True)
+            for structure_id, role, expiration_time in permissions.values_list(
+                    permission_field.attname, 'role', 'expiration_time'):
+                roles[structure_id].append((role, expiration_time))
+            self.roles[key] = roles
+        return self.roles[key]
+
+    def invalidate(self, user_id):
+        for key in list(self.roles):
+            if key[1] == user_id:
+                del self.roles[key]
+
+
+class RoleCacheMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        set_role_cache(RoleCache())
+
+    def process_response(self, request, response):
+        reset_role_cache()
+        return response
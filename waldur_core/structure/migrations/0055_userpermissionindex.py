@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def init_permission_index(apps, schema_editor):
+    CustomerPermission = apps.get_model('structure', 'CustomerPermission')
+    ProjectPermission = apps.get_model('structure', 'ProjectPermission')
+    UserPermissionIndex = apps.get_model('structure', 'UserPermissionIndex')
+
+    rows = {(user_id, customer_id, None, role) for user_id, customer_id, role in
+            CustomerPermission.objects.filter(is_active=True).values_list('user_id', 'customer_id', 'role')}
+    rows.update(ProjectPermission.objects.filter(is_active=True).values_list(
+        'user_id', 'project__customer_id', 'project_id', 'role'))
+
+    UserPermissionIndex.objects.bulk_create([
+        UserPermissionIndex(user_id=user_id, customer_id=customer_id, project_id=project_id, role=role)
+        for user_id, customer_id, project_id, role in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('structure', '0054_payment_details'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPermissionIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(max_length=30)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Customer')),
+                ('project', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='userpermissionindex',
+            index_together=set([('user', 'project')]),
+        ),
+        migrations.RunPython(init_permission_index, reverse_code=migrations.RunPython.noop),
+    ]
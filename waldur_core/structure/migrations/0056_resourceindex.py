@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('structure', '0055_userpermissionindex'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('uuid', models.UUIDField(db_index=True)),
+                ('name', models.CharField(db_index=True, max_length=150)),
+                ('state', models.IntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(db_index=True)),
+                ('tags', models.TextField(blank=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Customer')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.Project')),
+                ('service_settings', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='structure.ServiceSettings')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='resourceindex',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+    ]
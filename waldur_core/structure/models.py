@@ -29,6 +29,7 @@ from waldur_core.core import models as core_models
 from waldur_core.core import utils as core_utils
 from waldur_core.core.fields import JSONField
 from waldur_core.core.models import CoordinatesMixin, AbstractFieldTracker
+from waldur_core.core.pagination import iterate_by_keyset
 from waldur_core.core.validators import validate_name, validate_cidr_list, FileTypeValidator
 from waldur_core.logging.loggers import LoggableMixin
 from waldur_core.monitoring.models import MonitoringModelMixin
@@ -37,8 +38,9 @@ from waldur_core.structure import SupportedServices
 from waldur_core.structure.images import ImageModelMixin
 from waldur_core.structure.managers import StructureManager, filter_queryset_for_user, \
     ServiceSettingsManager, PrivateServiceSettingsManager, SharedServiceSettingsManager
+from waldur_core.structure.middleware import get_role_cache
 from waldur_core.structure.signals import structure_role_granted, structure_role_revoked
-from waldur_core.structure.utils import get_coordinates_by_ip, sort_dependencies
+from waldur_core.structure.utils import get_coordinates_by_ip, get_service_backend, sort_dependencies
 
 
 def validate_service_type(service_type):
@@ -50,6 +52,9 @@ def validate_service_type(service_type):
 class StructureModel(models.Model):
     """ Generic structure model.
         Provides transparent interaction with base entities and relations like customer.
+
+        Customer and project attributes are added to concrete models as descriptors
+        when model class is prepared, according to paths defined in Permissions class.
     """
 
     objects = StructureManager()
@@ -57,20 +62,34 @@ class StructureModel(models.Model):
     class Meta(object):
         abstract = True
 
-    def __getattr__(self, name):
-        # add additional properties to the object according to defined Permissions class
-        fields = ('customer', 'project')
-        if name in fields:
-            try:
-                path = getattr(self.Permissions, name + '_path')
-            except AttributeError:
-                pass
-            else:
-                if not path == 'self' and '__' in path:
-                    return reduce(getattr, path.split('__'), self)
 
-        raise AttributeError(
-            "'%s' object has no attribute '%s'" % (self._meta.object_name, name))
+class PermissionPathDescriptor(object):
+    """ Provides access to customer or project of object through path defined in Permissions class. """
+
+    def __init__(self, path):
+        self.attributes = path.split('__')
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return reduce(getattr, self.attributes, instance)
+
+
+def add_permission_path_descriptors(sender, **kwargs):
+    """ Add customer and project attributes to structure model according to its Permissions class """
+    if not issubclass(sender, StructureModel):
+        return
+    permissions = getattr(sender, 'Permissions', None)
+    for name in ('customer', 'project'):
+        path = getattr(permissions, name + '_path', None)
+        if not path or path == 'self' or '__' not in path:
+            continue
+        attribute = getattr(sender, name, None)
+        if attribute is None or isinstance(attribute, PermissionPathDescriptor):
+            setattr(sender, name, PermissionPathDescriptor(path))
+
+
+models.signals.class_prepared.connect(add_permission_path_descriptors)
 
 
 class StructureLoggableMixin(LoggableMixin):
@@ -196,6 +215,16 @@ class PermissionMixin(object):
             - None - check whether user has permanent role in entity.
             - Datetime object - check whether user will have role in entity at specific timestamp.
         """
+        role_cache = get_role_cache()
+        if role_cache is not None and user.pk is not None:
+            roles = role_cache.get_roles(self.permissions.field, user).get(self.pk, [])
+            return any(
+                (role is None or role == user_role) and
+                (timestamp is False or expiration_time is None or
+                 (timestamp is not None and expiration_time >= timestamp))
+                for user_role, expiration_time in roles
+            )
+
         permissions = self.permissions.filter(user=user, is_active=True)
 
         if role is not None:
@@ -636,575 +665,83 @@ class Project(core_models.DescribableMixin,
             m.objects.filter(project=self) for m in ServiceProjectLink.get_all_models())
 
 
-@python_2_unicode_compatible
-class ServiceCertification(core_models.UuidMixin, core_models.DescribableMixin):
-    link = models.URLField(max_length=255, blank=True)
-    # NameMixin is not used here as name has to be unique.
-    name = models.CharField(_('name'), max_length=150, validators=[validate_name], unique=True)
-
-    class Meta(object):
-        verbose_name = 'Service Certification'
-        verbose_name_plural = 'Service Certifications'
-        ordering = ['-name']
-
-    def __str__(self):
-        return self.name
-
-    @classmethod
-    def get_url_name(cls):
-        return 'service-certification'
-
-
-@python_2_unicode_compatible
-class ServiceSettings(quotas_models.ExtendableQuotaModelMixin,
-                      core_models.UuidMixin,
-                      core_models.NameMixin,
-                      core_models.StateMixin,
-                      TagMixin,
-                      LoggableMixin):
-
-    class Meta:
-        verbose_name = "Service settings"
-        verbose_name_plural = "Service settings"
-
-    class Permissions(object):
-        customer_path = 'customer'
-        extra_query = dict(shared=True)
-
-    customer = models.ForeignKey(Customer,
-                                 verbose_name=_('organization'),
-                                 related_name='service_settings',
-                                 blank=True,
-                                 null=True)
-    backend_url = core_fields.BackendURLField(max_length=200, blank=True, null=True)
-    username = models.CharField(max_length=100, blank=True, null=True)
-    password = models.CharField(max_length=100, blank=True, null=True)
-    domain = models.CharField(max_length=200, blank=True, null=True)
-    token = models.CharField(max_length=255, blank=True, null=True)
-    certificate = models.FileField(upload_to='certs', blank=True, null=True,
-                                   validators=[FileTypeValidator(
-                                       allowed_types=[
-                                           'application/x-pem-file',
-                                           'application/x-x509-ca-cert',
-                                           'text/plain'],
-                                       allowed_extensions=['pem'])])
-    type = models.CharField(max_length=255, db_index=True, validators=[validate_service_type])
-    options = JSONField(default={}, help_text=_('Extra options'), blank=True)
-    geolocations = JSONField(default=[], blank=True,
-                             help_text=_('List of latitudes and longitudes. For example: '
-                                         '[{"latitude": 123, "longitude": 345}, {"latitude": 456, "longitude": 678}]'))
-    shared = models.BooleanField(default=False, help_text=_('Anybody can use it'))
-    homepage = models.URLField(max_length=255, blank=True)
-    terms_of_services = models.URLField(max_length=255, blank=True)
-    certifications = models.ManyToManyField(to='ServiceCertification', related_name='service_settings', blank=True)
-
-    tracker = FieldTracker()
-
-    # service settings scope - VM that contains service
-    content_type = models.ForeignKey(ContentType, null=True)
-    object_id = models.PositiveIntegerField(null=True)
-    scope = GenericForeignKey('content_type', 'object_id')
-
-    objects = ServiceSettingsManager('scope')
-
-    def get_backend(self, **kwargs):
-        return SupportedServices.get_service_backend(self.type)(self, **kwargs)
-
-    def get_option(self, name):
-        options = self.options or {}
-        if name in options:
-            return options.get(name)
-        else:
-            defaults = self.get_backend().DEFAULTS
-            return defaults.get(name)
-
-    def __str__(self):
-        return '%s (%s)' % (self.name, self.get_type_display())
-
-    def get_log_fields(self):
-        return ('uuid', 'name', 'customer')
-
-    def _get_log_context(self, entity_name):
-        context = super(ServiceSettings, self)._get_log_context(entity_name)
-        context['service_settings_type'] = self.get_type_display()
-        return context
-
-    def get_type_display(self):
-        return SupportedServices.get_name_for_type(self.type)
-
-    def get_services(self):
-        service_model = SupportedServices.get_service_models()[self.type]['service']
-        return service_model.objects.filter(settings=self)
-
-    def unlink_descendants(self):
-        for service in self.get_services():
-            service.unlink_descendants()
-            service.delete()
-
-
-class SharedServiceSettings(ServiceSettings):
-    """Required for a clear separation of shared/unshared service settings on admin."""
-
-    objects = SharedServiceSettingsManager()
-
-    class Meta(object):
-        proxy = True
-        verbose_name_plural = _('Shared provider settings')
-
-
-class PrivateServiceSettings(ServiceSettings):
-    """Required for a clear separation of shared/unshared service settings on admin."""
-
-    objects = PrivateServiceSettingsManager()
-
-    class Meta(object):
-        proxy = True
-        verbose_name_plural = _('Private provider settings')
-
-
-@python_2_unicode_compatible
-class Service(core_models.UuidMixin,
-              core_models.DescendantMixin,
-              quotas_models.QuotaModelMixin,
-              LoggableMixin,
-              StructureModel):
-    """ Base service class. """
-
-    class Meta(object):
-        abstract = True
-        unique_together = ('customer', 'settings')
-
-    class Permissions(object):
-        customer_path = 'customer'
-        project_path = 'projects'
-
-    settings = models.ForeignKey(ServiceSettings)
-    customer = models.ForeignKey(Customer, verbose_name=_('organization'))
-    available_for_all = models.BooleanField(
-        default=False,
-        help_text=_('Service will be automatically added to all customers projects if it is available for all')
-    )
-    projects = NotImplemented
-
-    def __init__(self, *args, **kwargs):
-        AbstractFieldTracker().finalize_class(self.__class__, 'tracker')
-        super(Service, self).__init__(*args, **kwargs)
-
-    def __str__(self):
-        return self.settings.name
-
-    def get_backend(self, **kwargs):
-        return self.settings.get_backend(**kwargs)
-
-    @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls)]
+class UserPermissionIndex(models.Model):
+    """ Materialized index of active customer and project permissions.
 
-    @classmethod
-    def get_url_name(cls):
-        """ This name will be used by generic relationships to membership model for URL creation """
-        return cls._meta.app_label
-
-    def get_log_fields(self):
-        return ('uuid', 'customer', 'settings')
-
-    def _get_log_context(self, entity_name):
-        context = super(Service, self)._get_log_context(entity_name)
-        context['service_type'] = SupportedServices.get_name_for_model(self)
-        return context
-
-    def get_service_project_links(self):
-        """
-        Generic method for getting queryset of service project links related to current service
-        """
-        return self.projects.through.objects.filter(service=self)
-
-    def get_parents(self):
-        return [self.settings, self.customer]
-
-    def get_children(self):
-        return self.get_service_project_links()
-
-    def unlink_descendants(self):
-        descendants = sort_dependencies(self._meta.model, self.get_descendants())
-        for descendant in descendants:
-            if isinstance(descendant, ResourceMixin):
-                descendant.unlink()
-            descendant.delete()
-
-
-class BaseServiceProperty(core_models.BackendModelMixin, core_models.UuidMixin, core_models.NameMixin, models.Model):
-    """ Base service properties like image, flavor, region,
-        which are usually used for Resource provisioning.
+        It allows to filter querysets by user permissions with semi-join subquery
+        instead of joins through permissions tables which require DISTINCT.
+        Customer permissions are stored with empty project.
+        Index is updated on permission save and delete and on role grant and revoke.
     """
-
     class Meta(object):
-        abstract = True
+        index_together = (('user', 'project'),)
 
-    @classmethod
-    def get_url_name(cls):
-        """ This name will be used by generic relationships to membership model for URL creation """
-        return '{}-{}'.format(cls._meta.app_label, cls.__name__.lower())
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+')
+    customer = models.ForeignKey(Customer, related_name='+')
+    project = models.ForeignKey(Project, related_name='+', null=True, blank=True)
+    role = models.CharField(max_length=30)
 
     @classmethod
-    def get_backend_fields(cls):
-        return super(BaseServiceProperty, cls).get_backend_fields() + ('backend_id', 'name')
-
-
-@python_2_unicode_compatible
-class ServiceProperty(BaseServiceProperty):
-
-    class Meta(object):
-        abstract = True
-        unique_together = ('settings', 'backend_id')
-
-    settings = models.ForeignKey(ServiceSettings, related_name='+')
-    backend_id = models.CharField(max_length=255, db_index=True)
-
-    def __str__(self):
-        return '{0} | {1}'.format(self.name, self.settings)
-
-
-@python_2_unicode_compatible
-class GeneralServiceProperty(BaseServiceProperty):
-    """
-    Service property which is not connected to settings
-    """
-
-    class Meta(object):
-        abstract = True
-
-    backend_id = models.CharField(max_length=255, unique=True)
-
-    def __str__(self):
-        return self.name
-
-
-@python_2_unicode_compatible
-class ServiceProjectLink(quotas_models.QuotaModelMixin,
-                         core_models.DescendantMixin,
-                         LoggableMixin,
-                         StructureModel):
-    """ Base service-project link class. See Service class for usage example. """
-
-    class States(object):
-        OK = 'OK'
-        ERRED = 'ERRED'
-        WARNING = 'WARNING'
-
-        CHOICES = [OK, ERRED, WARNING]
-
-    class Meta(object):
-        abstract = True
-        unique_together = ('service', 'project')
-
-    class Permissions(object):
-        customer_path = 'service__customer'
-        project_path = 'project'
-
-    service = NotImplemented
-    project = models.ForeignKey(Project)
-
-    def get_backend(self, **kwargs):
-        return self.service.get_backend(**kwargs)
+    def get_permission_rows(cls, customer_permissions, project_permissions):
+        """ Return set of (user_id, customer_id, project_id, role) tuples for active permissions. """
+        rows = {(user_id, customer_id, None, role) for user_id, customer_id, role in
+                customer_permissions.filter(is_active=True).values_list('user_id', 'customer_id', 'role')}
+        rows.update(project_permissions.filter(is_active=True).values_list(
+            'user_id', 'project__customer_id', 'project_id', 'role'))
+        return rows
 
     @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls)]
+    def get_index_rows(cls, index):
+        return set(index.values_list('user_id', 'customer_id', 'project_id', 'role'))
 
     @classmethod
-    def get_url_name(cls):
-        """ This name will be used by generic relationships to membership model for URL creation """
-        return cls._meta.app_label + '-spl'
-
-    def get_log_fields(self):
-        return ('project', 'service',)
-
-    def get_parents(self):
-        return [self.project, self.service]
-
-    def get_children(self):
-        resource_models = [m for m in ResourceMixin.get_all_models() + SubResource.get_all_models()
-                           if m.service_project_link.field.related_model == self.__class__]
-        return itertools.chain.from_iterable(
-            m.objects.filter(service_project_link=self) for m in resource_models)
-
-    @property
-    def validation_state(self):
-        """
-        Defines whether a  service compliant with required project certifications.
-        """
-        if set(self.project.certifications.all()).issubset(set(self.service.settings.certifications.all())):
-            return self.States.OK
+    def sync(cls, user_id, customer_id=None, project_id=None):
+        """ Synchronize index rows of user in customer or project with its permissions. """
+        if project_id is not None:
+            index = cls.objects.filter(user_id=user_id, project_id=project_id)
+            rows = cls.get_permission_rows(
+                CustomerPermission.objects.none(),
+                ProjectPermission.objects.filter(user_id=user_id, project_id=project_id))
         else:
-            return self.States.ERRED
-
-    @property
-    def is_valid(self):
-        return self.validation_state == self.States.OK
-
-    @property
-    def validation_message(self):
-        """
-        Validation result clarification.
-        """
-        if not self.is_valid:
-            service_certifications = self.service.settings.certifications.all()
-            project_certifications = self.project.certifications.all()
-            missing_certifications = set(project_certifications) - set(service_certifications)
-            return _('Provider does not match with project\'s security policy. Certifications are missing: "%s"') % ', '.join([c.name for c in missing_certifications])
-        else:
-            return ''
-
-    def __str__(self):
-        return '{0} | {1}'.format(self.service.settings.name, self.project.name)
-
-
-class CloudServiceProjectLink(ServiceProjectLink):
-    """
-    Represents a link between a project and a cloud service that provides VPS or VPC (e.g. Amazon, DO, OpenStack).
-    """
-
-    class Meta(ServiceProjectLink.Meta):
-        abstract = True
-
-    class Quotas(quotas_models.QuotaModelMixin.Quotas):
-        vcpu = quotas_fields.QuotaField()
-        ram = quotas_fields.QuotaField()
-        storage = quotas_fields.QuotaField()
-
-    def can_user_update_quotas(self, user):
-        return user.is_staff or self.service.customer.has_user(user, CustomerRole.OWNER)
-
-
-class ApplicationMixin(models.Model):
-
-    class Meta(object):
-        abstract = True
-
-    @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls)]
+            index = cls.objects.filter(user_id=user_id, customer_id=customer_id, project__isnull=True)
+            rows = cls.get_permission_rows(
+                CustomerPermission.objects.filter(user_id=user_id, customer_id=customer_id),
+                ProjectPermission.objects.none())
 
-
-@python_2_unicode_compatible
-class ResourceMixin(MonitoringModelMixin,
-                    core_models.UuidMixin,
-                    core_models.DescribableMixin,
-                    core_models.NameMixin,
-                    core_models.DescendantMixin,
-                    core_models.BackendModelMixin,
-                    LoggableMixin,
-                    TagMixin,
-                    TimeStampedModel,
-                    StructureModel):
-
-    """ Base resource class. Resource is a provisioned entity of a service,
-        for example: a VM in OpenStack or AWS, or a repository in Github.
-    """
-
-    class Meta(object):
-        abstract = True
-
-    class Permissions(object):
-        customer_path = 'service_project_link__project__customer'
-        project_path = 'service_project_link__project'
-        service_path = 'service_project_link__service'
-
-    service_project_link = NotImplemented
-    backend_id = models.CharField(max_length=255, blank=True)
+        with transaction.atomic():
+            if cls.get_index_rows(index) == rows:
+                return
+            index.delete()
+            cls.objects.bulk_create(cls._from_rows(rows))
 
     @classmethod
-    def get_backend_fields(cls):
-        return super(ResourceMixin, cls).get_backend_fields() + ('backend_id',)
-
-    def get_backend(self, **kwargs):
-        return self.service_project_link.get_backend(**kwargs)
-
-    def get_cost(self, start_date, end_date):
-        raise NotImplementedError(
-            "Please refer to waldur_core.billing.tasks.debit_customers while implementing it")
-
-    def get_access_url(self):
-        # default behaviour. Override in subclasses if applicable
-        return None
-
-    def get_access_url_name(self):
-        return None
-
-    @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls) and not issubclass(model, SubResource)]
-
-    @classmethod
-    def get_url_name(cls):
-        """ This name will be used by generic relationships to membership model for URL creation """
-        return '{}-{}'.format(cls._meta.app_label, cls.__name__.lower())
-
-    def get_log_fields(self):
-        return ('uuid', 'name', 'service_project_link', 'full_name')
-
-    @property
-    def full_name(self):
-        return '%s %s' % (SupportedServices.get_name_for_model(self).replace('.', ' '), self.name)
-
-    def _get_log_context(self, entity_name):
-        context = super(ResourceMixin, self)._get_log_context(entity_name)
-        # XXX: Add resource_full_name here, because event context does not support properties as fields
-        context['resource_full_name'] = self.full_name
-        # required for lookups in ElasticSearch by the client
-        context['resource_type'] = SupportedServices.get_name_for_model(self)
-
-        # XXX: a hack for IaaS / PaaS / SaaS tags
-        # XXX: should be moved to itacloud assembly
-        if self.tags.filter(name='IaaS').exists():
-            context['resource_delivery_model'] = 'IaaS'
-        elif self.tags.filter(name='PaaS').exists():
-            context['resource_delivery_model'] = 'PaaS'
-        elif self.tags.filter(name='SaaS').exists():
-            context['resource_delivery_model'] = 'SaaS'
-
-        return context
-
-    def filter_by_logged_object(self):
-        return {
-            'resource_uuid': self.uuid.hex,
-            'resource_type': SupportedServices.get_name_for_model(self)
-        }
-
-    def get_parents(self):
-        return [self.service_project_link]
-
-    def __str__(self):
-        return self.name
-
-    def increase_backend_quotas_usage(self, validate=True):
-        """ Increase usage of quotas that were consumed by resource on creation.
-
-            If validate is True - method should raise QuotaValidationError if
-            at least one of increased quotas if over limit.
-        """
-        pass
-
-    def decrease_backend_quotas_usage(self):
-        """ Decrease usage of quotas that were released on resource deletion """
-        pass
-
-    def unlink(self):
-        # XXX: add special attribute to an instance in order to be tracked by signal handler
-        setattr(self, 'PERFORM_UNLINK', True)
-
-    @property
-    def service_settings(self):
-        return self.service_project_link.service.settings
-
-
-# TODO: rename to Resource
-class NewResource(ResourceMixin, core_models.StateMixin):
-
-    class Meta(object):
-        abstract = True
-
-
-class VirtualMachine(CoordinatesMixin, core_models.RuntimeStateMixin, NewResource):
-
-    def __init__(self, *args, **kwargs):
-        AbstractFieldTracker().finalize_class(self.__class__, 'tracker')
-        super(VirtualMachine, self).__init__(*args, **kwargs)
-
-    cores = models.PositiveSmallIntegerField(default=0, help_text=_('Number of cores in a VM'))
-    ram = models.PositiveIntegerField(default=0, help_text=_('Memory size in MiB'))
-    disk = models.PositiveIntegerField(default=0, help_text=_('Disk size in MiB'))
-    min_ram = models.PositiveIntegerField(default=0, help_text=_('Minimum memory size in MiB'))
-    min_disk = models.PositiveIntegerField(default=0, help_text=_('Minimum disk size in MiB'))
-
-    image_name = models.CharField(max_length=150, blank=True)
-
-    key_name = models.CharField(max_length=50, blank=True)
-    key_fingerprint = models.CharField(max_length=47, blank=True)
-
-    user_data = models.TextField(
-        blank=True,
-        help_text=_('Additional data that will be added to instance on provisioning'))
-    start_time = models.DateTimeField(blank=True, null=True)
-
-    class Meta(object):
-        abstract = True
-
-    def detect_coordinates(self):
-        if self.external_ips:
-            return get_coordinates_by_ip(self.external_ips)
-
-    def get_access_url(self):
-        if self.external_ips:
-            return self.external_ips
-        if self.internal_ips:
-            return self.internal_ips
-        return None
+    def rebuild(cls):
+        """ Rebuild index for all resources. Return number of indexed resources. """
+        with transaction.atomic():
+            cls.objects.all().delete()
+            return sum(cls._create_entries(model.objects.all()) for model in ResourceMixin.get_all_models())
 
     @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls)]
-
-    @property
-    def external_ips(self):
-        """
-        Returns a list of external IPs.
-        Implementation of this method in all derived classes guarantees all virtual machine have the same interface.
-        For instance:
-         - SaltStack (aws) handles IPs as private and public IP addresses;
-         - DigitalOcean has only 1 external ip called ip_address.
-        """
-        return []
-
-    @property
-    def internal_ips(self):
-        """
-        Returns a list of internal IPs.
-        Implementation of this method in all derived classes guarantees all virtual machine have the same interface.
-        For instance:
-         - SaltStack (aws) handles IPs as private and public IP addresses;
-         - DigitalOcean does not support internal IP at the moment.
-        """
-        return []
-
-
-class PrivateCloud(quotas_models.QuotaModelMixin, core_models.RuntimeStateMixin, NewResource):
-    extra_configuration = JSONField(default={},
-                                    help_text=_('Configuration details that are not represented on backend.'))
-
-    class Meta(object):
-        abstract = True
-
-
-class Storage(core_models.RuntimeStateMixin, NewResource):
-    size = models.PositiveIntegerField(help_text=_('Size in MiB'))
-
-    class Meta(object):
-        abstract = True
-
-
-class Volume(Storage):
-    class Meta(object):
-        abstract = True
-
-
-class Snapshot(Storage):
-    class Meta(object):
-        abstract = True
-
-
-class SubResource(NewResource):
-    """ Resource dependent object that cannot exist without resource. """
-    class Meta(object):
-        abstract = True
+    def add_missing(cls):
+        """ Index resources that are missing in index. Return number of indexed resources. """
+        count = 0
+        for model in ResourceMixin.get_all_models():
+            content_type = ContentType.objects.get_for_model(model)
+            indexed = cls.objects.filter(content_type=content_type).values('object_id')
+            count += cls._create_entries(model.objects.exclude(pk__in=indexed))
+        return count
 
     @classmethod
-    @lru_cache(maxsize=1)
-    def get_all_models(cls):
-        return [model for model in apps.get_models() if issubclass(model, cls)]
+    def _create_entries(cls, resources):
+        content_type = ContentType.objects.get_for_model(resources.model)
+        resources = resources.select_related(
+            'service_project_link__project', 'service_project_link__service').prefetch_related('tags')
+        count = 0
+        for chunk in iterate_by_keyset(resources):
+            cls.objects.bulk_create([
+                cls(content_type=content_type, object_id=resource.pk,
+                    **cls.get_index_values(resource, [tag.name for tag in resource.tags.all()]))
+                for resource in chunk
+            ])
+            count += len(chunk)
+        return count
@@ -1231,6 +1231,10 @@ class BaseServiceProjectLinkSerializer(PermissionFieldFilteringMixin,
             'service': {'lookup_field': 'uuid', 'view_name': NotImplemented},
         }
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.prefetch_quotas()
+
     def get_filtered_field_names(self):
         return 'project', 'service'
 
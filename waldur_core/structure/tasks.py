@@ -1,15 +1,17 @@
 from __future__ import unicode_literals
 
+import collections
 import logging
 
-from celery import shared_task
+from celery import chain, shared_task, states
+from django.conf import settings
 from django.core import exceptions
-from django.db import transaction
+from django.core.cache import cache
 from django.db.utils import DatabaseError
 import six
 
 from waldur_core.core import utils as core_utils, tasks as core_tasks, models as core_models
-from waldur_core.structure import SupportedServices, models, utils, ServiceBackendError
+from waldur_core.structure import linking, models, utils, ServiceBackendError
 
 logger = logging.getLogger(__name__)
 
@@ -52,19 +54,7 @@ class ConnectSharedSettingsTask(core_tasks.Task):
 
     def execute(self, service_settings):
         logger.debug('About to connect service settings "%s" to all available customers' % service_settings.name)
-        if not service_settings.shared:
-            raise ValueError('It is impossible to connect non-shared settings')
-        service_model = SupportedServices.get_service_models()[service_settings.type]['service']
-
-        with transaction.atomic():
-            for customer in models.Customer.objects.all():
-                defaults = {'available_for_all': True}
-                service, _ = service_model.objects.get_or_create(
-                    customer=customer, settings=service_settings, defaults=defaults)
-
-                service_project_link_model = service.projects.through
-                for project in service.customer.projects.all():
-                    service_project_link_model.objects.get_or_create(project=project, service=service)
+        linking.connect_shared_settings(service_settings)
         logger.info('Successfully connected service settings "%s" to all available customers' % service_settings.name)
 
 
@@ -83,9 +73,6 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
         else:
             self.on_pull_success(instance)
 
-    def is_equal(self, other_task, serialized_instance):
-        return self.name == other_task.get('name') and serialized_instance in other_task.get('args', [])
-
     def pull(self, instance):
         """ Pull instance from backend.
 
@@ -93,9 +80,10 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
         """
         raise NotImplementedError('Pull task should implement pull method.')
 
-    def on_pull_fail(self, instance, error):
+    def on_pull_fail(self, instance, error, errors=None):
+        """ Mark instance as erred. If errors list is given, error is collected to it instead of logging. """
         error_message = six.text_type(error)
-        self.log_error_message(instance, error_message)
+        self.log_error_message(instance, error_message, errors)
         try:
             self.set_instance_erred(instance, error_message)
         except DatabaseError as e:
@@ -107,10 +95,13 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
             instance.error_message = ''
             instance.save(update_fields=['state', 'error_message'])
 
-    def log_error_message(self, instance, error_message):
+    def log_error_message(self, instance, error_message, errors=None):
         logger_message = 'Failed to pull %s %s (PK: %s). Error: %s' % (
             instance.__class__.__name__, instance.name, instance.pk, error_message)
-        if instance.state == instance.States.ERRED:  # report error on debug level if instance already was erred.
+        if errors is not None:
+            if instance.state != instance.States.ERRED:
+                errors.append('%s (PK: %s): %s' % (instance.name, instance.pk, error_message))
+        elif instance.state == instance.States.ERRED:  # report error on debug level if instance already was erred.
             logger.debug(logger_message)
         else:
             logger.error(logger_message, exc_info=True)
@@ -121,24 +112,151 @@ class BackgroundPullTask(core_tasks.BackgroundTask):
         instance.error_message = error_message
         instance.save(update_fields=['state', 'error_message'])
 
+    def pull_chunk(self, instances):
+        """ Pull instances through backends shared within chunk.
+
+            Failure of one instance does not stop pulling of others, failures
+            are reported with one log message for the whole chunk.
+        """
+        errors = []
+        failed_count = 0
+        with utils.shared_backends():
+            for instance in instances:
+                try:
+                    self.pull(instance)
+                    self.on_pull_success(instance)
+                except Exception as e:
+                    failed_count += 1
+                    self.on_pull_fail(instance, e, errors)
+
+        if errors:
+            logger.error('Failed to pull %s of %s objects by task %s. Errors: %s' % (
+                len(errors), len(instances), self.name, '; '.join(errors)))
+        return failed_count
+
 
 class BackgroundListPullTask(core_tasks.BackgroundTask):
-    """ Schedules pull task for each stable object of the model. """
+    """ Schedules pull task for each stable object of the model.
+
+        If chunk size is defined, objects are grouped by service settings and split into chunks.
+        Each chunk is pulled by one task through shared backend instance. Not more than max concurrency
+        chunks of the same service settings are pulled simultaneously: chunks of the settings are
+        distributed between chains that are executed in parallel.
+        Chunk size and max concurrency are taken from WALDUR_CORE['BACKGROUND_PULL'] settings
+        unless they are defined by task.
+    """
     model = NotImplemented
     pull_task = NotImplemented
-
-    def is_equal(self, other_task):
-        return self.name == other_task.get('name')
+    chunk_size = None
+    max_concurrency = None
+    # path from pulled object to its service settings
+    settings_path = 'service_project_link__service__settings'
 
     def get_pulled_objects(self):
         States = self.model.States
         return self.model.objects.filter(state__in=[States.ERRED, States.OK]).exclude(backend_id='')
 
+    def get_chunk_size(self):
+        if self.chunk_size is not None:
+            return self.chunk_size
+        return settings.WALDUR_CORE['BACKGROUND_PULL']['CHUNK_SIZE']
+
+    def get_max_concurrency(self):
+        if self.max_concurrency is not None:
+            return self.max_concurrency
+        return settings.WALDUR_CORE['BACKGROUND_PULL']['MAX_CONCURRENCY']
+
     def run(self):
+        if self.get_chunk_size():
+            return self.run_by_chunks()
+
         for instance in self.get_pulled_objects():
             serialized = core_utils.serialize_instance(instance)
             self.pull_task().apply_async(args=(serialized,), kwargs={})
 
+    def run_by_chunks(self):
+        serialized_pull_task = core_utils.serialize_class(self.pull_task)
+        serialized_model = core_utils.serialize_class(self.model)
+        chunk_size = self.get_chunk_size()
+        max_concurrency = self.get_max_concurrency()
+        for settings_id, pks in self.get_pulled_pks_by_settings().items():
+            chains = [[] for _ in range(max_concurrency)]
+            for index, start in enumerate(range(0, len(pks), chunk_size)):
+                chains[index % max_concurrency].append(pks[start:start + chunk_size])
+            chains = [chunks for chunks in chains if chunks]
+
+            # Chains of previous run could be still in progress if pull takes longer than
+            # beat interval. Lease is released by the last chunk of each chain or by chain errback.
+            lease_key = self.get_chains_lease_key(settings_id)
+            if not cache.add(lease_key, len(chains), self.LEASE_LIFETIME):
+                logger.info('Pull of objects of service settings %s by task %s was not scheduled, '
+                            'because previous pull is not completed yet.', settings_id, self.name)
+                continue
+
+            for chunks in chains:
+                tasks = [PullChunkTask().si(serialized_pull_task, serialized_model, chunk) for chunk in chunks[:-1]]
+                tasks.append(PullChunkTask().si(serialized_pull_task, serialized_model, chunks[-1],
+                                                lease_key=lease_key))
+                # chain is stopped if one of its tasks fails, so its lease share is released by errback
+                chain(*tasks).apply_async(link_error=ReleasePullChainsLeaseTask().si(lease_key))
+
+    def get_chains_lease_key(self, settings_id):
+        return 'background_task:pull_chains:%s:%s' % (self.name, settings_id)
+
+    def get_pulled_pks_by_settings(self):
+        """ Return dictionary {service_settings_id: [pulled object pk]} """
+        pks = collections.defaultdict(list)
+        for pk, settings_id in self.get_pulled_objects().order_by('pk').values_list('pk', self.settings_path):
+            pks[settings_id].append(pk)
+        return pks
+
+
+class PullChunkTask(core_tasks.Task):
+    """ Pull chunk of objects with pull task of background list pull task.
+
+        The last task of the chain releases its share of pull chains lease of service settings.
+    """
+    is_background = True
+
+    @classmethod
+    def get_description(cls, serialized_pull_task, serialized_model, pks, *args, **kwargs):
+        return 'Pull %s objects of model %s with task %s.' % (len(pks), serialized_model, serialized_pull_task)
+
+    def run(self, serialized_pull_task, serialized_model, pks, lease_key=None):
+        pull_task = core_utils.deserialize_class(serialized_pull_task)
+        model = core_utils.deserialize_class(serialized_model)
+        instances = list(model.objects.filter(pk__in=pks).order_by('pk'))
+        return pull_task().pull_chunk(instances)
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        lease_key = (kwargs or {}).get('lease_key')
+        # failed task lease share is released by chain errback
+        if lease_key and status == states.SUCCESS:
+            release_pull_chains_lease(lease_key)
+        return super(PullChunkTask, self).after_return(status, retval, task_id, args, kwargs, einfo)
+
+
+def release_pull_chains_lease(lease_key):
+    """ Lease is deleted when all chains of service settings are completed """
+    try:
+        remaining = cache.decr(lease_key)
+    except ValueError:  # lease has already expired
+        return
+    if remaining <= 0:
+        cache.delete(lease_key)
+
+
+class ReleasePullChainsLeaseTask(core_tasks.Task):
+    """ Release share of pull chains lease if chain was stopped by failed task """
+    is_background = True
+
+    @classmethod
+    def get_description(cls, lease_key, *args, **kwargs):
+        return 'Release pull chains lease %s.' % lease_key
+
+    def run(self, lease_key):
+        release_pull_chains_lease(lease_key)
+
 
 class ServiceSettingsBackgroundPullTask(BackgroundPullTask):
 
@@ -151,6 +269,7 @@ class ServiceSettingsListPullTask(BackgroundListPullTask):
     name = 'waldur_core.structure.ServiceSettingsListPullTask'
     model = models.ServiceSettings
     pull_task = ServiceSettingsBackgroundPullTask
+    settings_path = 'pk'
 
     def get_pulled_objects(self):
         States = self.model.States
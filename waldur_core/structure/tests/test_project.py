@@ -7,6 +7,7 @@ from mock_django import mock_signal_receiver
 from rest_framework import status, test
 from six.moves import mock
 
+from waldur_core.core.tests.helpers import override_waldur_core_settings
 from waldur_core.quotas.tests import factories as quota_factories
 from waldur_core.structure import executors, models, signals, views
 from waldur_core.structure.models import CustomerRole, Project, ProjectRole
@@ -457,6 +458,34 @@ class ProjectCountersListTest(test.APITransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, {'test': 100})
 
+    def test_resource_counters_could_be_registered(self):
+        views.ProjectCountersView.register_counter(
+            'test_resources', resource_models=lambda: [test_models.TestNewInstance])
+        self.client.force_authenticate(self.fixture.owner)
+        response = self.client.get(self.url, {'fields': ['test_resources']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'test_resources': 1})
+
+    def test_resource_counters_are_calculated_with_one_query(self):
+        self.client.force_authenticate(self.fixture.staff)
+        fields = {'fields': ['apps', 'vms', 'private_clouds', 'storages']}
+        with override_waldur_core_settings(COUNTERS_CACHE={'ENABLED': False, 'TIMEOUT': 0}):
+            # warm up content types cache
+            self.client.get(self.url, fields)
+            with self.assertNumQueries(2):
+                # project lookup and grouped resources count
+                response = self.client.get(self.url, fields)
+        self.assertEqual(response.data, {'apps': 0, 'vms': 1, 'private_clouds': 0, 'storages': 0})
+
+    def test_cached_counters_are_invalidated_on_resource_creation(self):
+        self.client.force_authenticate(self.fixture.owner)
+        response = self.client.get(self.url, {'fields': ['vms']})
+        self.assertEqual(response.data, {'vms': 1})
+
+        factories.TestNewInstanceFactory(service_project_link=self.fixture.service_project_link)
+        response = self.client.get(self.url, {'fields': ['vms']})
+        self.assertEqual(response.data, {'vms': 2})
+
 
 @ddt
 class ProjectCertificationUpdateTest(test.APITransactionTestCase):
@@ -560,3 +560,18 @@ class NotificationsProfileChangesTest(test.APITransactionTestCase):
         self.user.email = new_email
         self.user.save()
         self.assertEqual(mock_event_logger.user.info.call_count, 0)
+
+
+class UserCountersTest(test.APITransactionTestCase):
+
+    def setUp(self):
+        self.user = factories.UserFactory()
+        self.url = 'http://testserver/api/user-counters/'
+
+    def test_user_can_get_own_counters(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'keys', 'hooks'})
@@ -2,11 +2,14 @@
 from __future__ import unicode_literals
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 import six
 from six import StringIO
 
-from .. import factories
+from waldur_core.structure import models
+
+from .. import factories, fixtures
 
 
 class DumpUsersCommandTest(TestCase):
@@ -22,3 +25,25 @@ class DumpUsersCommandTest(TestCase):
         if not isinstance(value, six.text_type):
             value = value.decode('utf-8')
         self.assertIn(user.full_name, value)
+
+
+class PermissionIndexCommandsTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.admin = self.fixture.admin
+        self.owner = self.fixture.owner
+
+    def test_check_command_passes_if_index_is_consistent(self):
+        output = StringIO()
+        call_command('check_permission_index', stdout=output)
+        self.assertIn('consistent', output.getvalue())
+
+    def test_check_command_fails_if_index_is_inconsistent(self):
+        models.UserPermissionIndex.objects.filter(user=self.admin).delete()
+        self.assertRaises(CommandError, call_command, 'check_permission_index', stdout=StringIO())
+
+    def test_rebuild_command_restores_index(self):
+        models.UserPermissionIndex.objects.all().delete()
+        call_command('rebuild_permission_index', stdout=StringIO())
+        self.assertEqual(models.UserPermissionIndex.check_consistency(), (set(), set()))
@@ -0,0 +1,49 @@
+from django.test import TestCase
+from six.moves import mock
+
+from waldur_core.structure import managers
+
+from .. import factories, fixtures, models as test_models
+
+
+class ResourceSummaryQuerySetTest(TestCase):
+
+    def setUp(self):
+        fixture = fixtures.ServiceFixture()
+        spl = fixture.service_project_link
+        self.resources = [
+            factories.TestNewInstanceFactory(service_project_link=spl, name='b'),
+            factories.TestVolumeFactory(service_project_link=spl, name='A', size=2),
+            factories.TestNewInstanceFactory(service_project_link=spl, name='d'),
+            factories.TestVolumeFactory(service_project_link=spl, name='C', size=1),
+        ]
+        self.queryset = managers.ResourceSummaryQuerySet([test_models.TestNewInstance, test_models.TestVolume])
+
+    def test_count_is_calculated_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.queryset.count(), 4)
+
+    def test_objects_are_ordered_case_insensitively(self):
+        names = [resource.name for resource in self.queryset.order_by('name')]
+        self.assertEqual(names, ['A', 'b', 'C', 'd'])
+
+    def test_only_objects_of_selected_page_are_fetched(self):
+        queryset = self.queryset.order_by('-name')
+        # one query for page rows and one query per model
+        with self.assertNumQueries(3):
+            page = queryset[1:3]
+        self.assertEqual([resource.name for resource in page], ['C', 'b'])
+
+    def test_index_out_of_range_raises_error(self):
+        self.assertRaises(IndexError, lambda: self.queryset[4])
+
+    def test_meta_ordering_is_used_if_ordering_is_not_defined(self):
+        with mock.patch.object(test_models.TestNewInstance._meta, 'ordering', ['-name']), \
+                mock.patch.object(test_models.TestVolume._meta, 'ordering', ['-name']):
+            names = [resource.name for resource in self.queryset]
+        self.assertEqual(names, ['d', 'C', 'b', 'A'])
+
+    def test_objects_without_ordering_field_are_ordered_as_null(self):
+        # only volumes have size, so ordering key of instances is NULL of the same type
+        names = [resource.name for resource in self.queryset.order_by('size')]
+        self.assertEqual(names, ['b', 'd', 'C', 'A'])
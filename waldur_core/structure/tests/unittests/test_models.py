@@ -1,6 +1,11 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
 from django.test import TestCase
 
-from waldur_core.structure.tests import factories
+from waldur_core.core.models import HierarchyClosure
+from waldur_core.structure import handlers, middleware, models
+from waldur_core.structure.managers import filter_queryset_for_user
+from waldur_core.structure.tests import factories, fixtures
 
 
 class ServiceProjectLinkTest(TestCase):
@@ -24,3 +29,217 @@ class ServiceProjectLinkTest(TestCase):
         self.link.service.settings.certifications.add(*certifications)
 
         self.assertEqual(self.link.States.OK, self.link.validation_state)
+
+
+class UserPermissionIndexTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.project = self.fixture.project
+        self.customer = self.fixture.customer
+        self.user = factories.UserFactory()
+
+    def test_index_is_updated_on_role_grant_and_revoke(self):
+        self.project.add_user(self.user, models.ProjectRole.ADMINISTRATOR)
+        index = models.UserPermissionIndex.objects.filter(user=self.user)
+        self.assertEqual(list(index.values_list('customer', 'project', 'role')),
+                         [(self.customer.pk, self.project.pk, models.ProjectRole.ADMINISTRATOR)])
+
+        self.project.remove_user(self.user)
+        self.assertFalse(index.exists())
+
+    def test_index_is_updated_on_permission_save(self):
+        factories.CustomerPermissionFactory(customer=self.customer, user=self.user)
+        self.assertTrue(models.UserPermissionIndex.objects.filter(
+            user=self.user, customer=self.customer, project__isnull=True).exists())
+
+    def test_queryset_is_filtered_without_duplicates(self):
+        second_project = factories.ProjectFactory(customer=self.customer)
+        self.project.add_user(self.user, models.ProjectRole.ADMINISTRATOR)
+        second_project.add_user(self.user, models.ProjectRole.MANAGER)
+
+        customers = filter_queryset_for_user(models.Customer.objects.all(), self.user)
+        self.assertEqual(list(customers), [self.customer])
+        projects = filter_queryset_for_user(models.Project.objects.all(), self.user)
+        self.assertEqual(set(projects), {self.project, second_project})
+
+
+class RoleCacheTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ProjectFixture()
+        self.project = self.fixture.project
+        self.user = self.fixture.admin
+        middleware.set_role_cache(middleware.RoleCache())
+
+    def tearDown(self):
+        middleware.reset_role_cache()
+
+    def test_roles_are_loaded_once(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.project.has_user(self.user, models.ProjectRole.ADMINISTRATOR))
+            self.assertFalse(self.project.has_user(self.user, models.ProjectRole.MANAGER))
+            self.assertTrue(self.project.has_user(self.user, timestamp=None))
+
+    def test_cache_is_invalidated_on_role_grant(self):
+        self.assertFalse(self.project.has_user(self.user, models.ProjectRole.MANAGER))
+        self.project.add_user(self.user, models.ProjectRole.MANAGER)
+        self.assertTrue(self.project.has_user(self.user, models.ProjectRole.MANAGER))
+
+    def test_cache_is_invalidated_on_role_revoke(self):
+        self.assertTrue(self.project.has_user(self.user, models.ProjectRole.ADMINISTRATOR))
+        self.project.remove_user(self.user)
+        self.assertFalse(self.project.has_user(self.user, models.ProjectRole.ADMINISTRATOR))
+
+
+class PermissionPathTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+
+    def test_customer_and_project_are_resolved_via_permission_path(self):
+        self.assertEqual(self.resource.customer, self.fixture.customer)
+        self.assertEqual(self.resource.project, self.fixture.project)
+
+    def test_queryset_is_filtered_by_customer_via_permission_path(self):
+        model = self.resource.__class__
+        self.assertEqual(list(model.objects.filter(customer=self.fixture.customer)), [self.resource])
+        self.assertEqual(list(model.objects.filter(Q(customer=self.fixture.customer))), [self.resource])
+
+
+class ResourceIndexTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+        self.index = models.ResourceIndex.objects.filter(object_id=self.resource.pk, uuid=self.resource.uuid)
+
+    def test_index_is_created_on_resource_creation(self):
+        row = self.index.get()
+        self.assertEqual(row.name, self.resource.name)
+        self.assertEqual(row.project, self.fixture.project)
+        self.assertEqual(row.customer, self.fixture.customer)
+        self.assertEqual(row.service_settings, self.fixture.service_settings)
+
+    def test_index_is_updated_on_resource_save(self):
+        self.resource.name = 'new name'
+        self.resource.save()
+        self.assertEqual(self.index.get().name, 'new name')
+
+    def test_index_is_updated_on_tags_change(self):
+        self.resource.tags.add('b', 'a')
+        self.assertEqual(self.index.get().tags, ',a,b,')
+        self.resource.tags.remove('a')
+        self.assertEqual(self.index.get().tags, ',b,')
+
+    def test_index_is_deleted_on_resource_deletion(self):
+        self.resource.delete()
+        self.assertFalse(self.index.exists())
+
+    def test_index_is_updated_on_state_change(self):
+        self.resource.set_erred()
+        self.resource.save(update_fields=['state'])
+        self.assertEqual(self.index.get().state, self.resource.state)
+
+    def test_index_is_not_written_if_indexed_fields_are_not_changed(self):
+        self.resource.description = 'new description'
+        with self.assertNumQueries(0):
+            models.ResourceIndex.update_resource_fields(self.resource, update_fields=['description'])
+
+    def test_index_is_filled_after_migration_if_it_is_empty(self):
+        models.ResourceIndex.objects.all().delete()
+        handlers.init_resource_index(sender=None)
+        self.assertTrue(self.index.exists())
+
+    def test_missing_resources_are_indexed_after_migration_if_index_is_partially_filled(self):
+        other_resource = factories.TestNewInstanceFactory(service_project_link=self.fixture.service_project_link)
+        self.index.delete()
+
+        handlers.init_resource_index(sender=None)
+
+        self.assertTrue(self.index.exists())
+        self.assertEqual(models.ResourceIndex.objects.filter(uuid=other_resource.uuid).count(), 1)
+
+    def test_missing_index_row_is_created_on_resource_save(self):
+        self.index.delete()
+        self.resource.name = 'new name'
+        self.resource.save()
+        self.assertEqual(self.index.get().name, 'new name')
+
+    def test_index_is_rebuilt(self):
+        models.ResourceIndex.objects.all().delete()
+        self.assertEqual(models.ResourceIndex.rebuild(), 1)
+        self.assertTrue(self.index.exists())
+
+
+class HierarchyClosureTest(TestCase):
+
+    def setUp(self):
+        self.fixture = fixtures.ServiceFixture()
+        self.resource = self.fixture.resource
+
+    def test_resource_ancestors_are_looked_up_in_closure_table(self):
+        ancestors = self.resource.get_ancestors()
+        for ancestor in (self.fixture.service_project_link, self.fixture.project,
+                         self.fixture.service, self.fixture.customer, self.fixture.service_settings):
+            self.assertIn(ancestor, ancestors)
+        self.assertEqual(ancestors[0], self.fixture.service_project_link)
+
+    def test_customer_descendants_are_looked_up_in_closure_table(self):
+        descendants = self.fixture.customer.get_descendants()
+        for descendant in (self.fixture.project, self.fixture.service,
+                           self.fixture.service_project_link, self.resource):
+            self.assertIn(descendant, descendants)
+
+    def test_links_are_removed_on_object_deletion(self):
+        self.resource.delete()
+        self.assertNotIn(self.resource, self.fixture.customer.get_descendants())
+
+    def test_descendants_of_objects_created_before_closure_table_are_found_by_traversal(self):
+        HierarchyClosure.objects.all().delete()
+
+        self.assertIn(self.resource, self.fixture.customer.get_descendants())
+        self.assertIn(self.resource, self.fixture.service.get_descendants())
+        self.assertIn(self.fixture.customer, self.resource.get_ancestors())
+
+    def test_new_object_of_existing_parent_is_stored_with_all_ancestors(self):
+        HierarchyClosure.objects.all().delete()
+
+        resource = factories.TestNewInstanceFactory(service_project_link=self.fixture.service_project_link)
+
+        self.assertTrue(HierarchyClosure.objects.filter(
+            descendant_content_type=ContentType.objects.get_for_model(resource), descendant_object_id=resource.pk,
+            ancestor_content_type=ContentType.objects.get_for_model(models.Customer),
+            ancestor_object_id=self.fixture.customer.pk, depth=3).exists())
+        self.assertIn(self.fixture.customer, resource.get_ancestors())
+
+    def test_old_and_new_descendants_of_object_created_before_closure_table_are_found(self):
+        HierarchyClosure.objects.all().delete()
+
+        new_resource = factories.TestNewInstanceFactory(service_project_link=self.fixture.service_project_link)
+
+        for obj in (self.fixture.customer, self.fixture.service, self.fixture.service_project_link):
+            descendants = obj.get_descendants()
+            self.assertIn(self.resource, descendants)
+            self.assertIn(new_resource, descendants)
+
+    def test_missing_objects_are_added_after_migration(self):
+        expected = set(HierarchyClosure.objects.values_list(
+            'ancestor_content_type', 'ancestor_object_id', 'descendant_content_type', 'descendant_object_id', 'depth'))
+        HierarchyClosure.objects.all().delete()
+
+        handlers.init_hierarchy_closure(sender=None)
+
+        self.assertEqual(expected, set(HierarchyClosure.objects.values_list(
+            'ancestor_content_type', 'ancestor_object_id', 'descendant_content_type', 'descendant_object_id', 'depth')))
+
+    def test_closure_table_is_rebuilt(self):
+        expected = set(HierarchyClosure.objects.values_list(
+            'ancestor_content_type', 'ancestor_object_id', 'descendant_content_type', 'descendant_object_id', 'depth'))
+        HierarchyClosure.objects.all().delete()
+
+        HierarchyClosure.rebuild()
+
+        self.assertEqual(expected, set(HierarchyClosure.objects.values_list(
+            'ancestor_content_type', 'ancestor_object_id', 'descendant_content_type', 'descendant_object_id', 'depth')))
@@ -1,9 +1,12 @@
 from ddt import ddt, data
+from django.core.cache import cache
+from django.db import DatabaseError
 from django.test import TestCase
 from six.moves import mock
 
 from waldur_core.core import utils
-from waldur_core.structure import tasks
+from waldur_core.core.tests.helpers import override_waldur_core_settings
+from waldur_core.structure import ServiceBackendError, linking, tasks
 from waldur_core.structure.tests import factories, models
 
 
@@ -61,3 +64,198 @@ class ThrottleProvisionTaskTest(TestCase):
             'create',
             state_transition='begin_starting').apply()
         self.assertEqual(mocked_retry.called, params['retried'])
+
+
+class ConnectSharedSettingsTaskTest(TestCase):
+
+    def setUp(self):
+        self.projects = [factories.ProjectFactory() for _ in range(3)]
+        self.shared_settings = factories.ServiceSettingsFactory(shared=True)
+
+    def test_services_and_links_are_created_for_all_customers_and_projects(self):
+        tasks.ConnectSharedSettingsTask().execute(self.shared_settings)
+
+        for project in self.projects:
+            self.assertTrue(models.TestServiceProjectLink.objects.filter(
+                project=project, service__settings=self.shared_settings, service__available_for_all=True).exists())
+
+    def test_quotas_are_updated_for_created_services_and_links(self):
+        tasks.ConnectSharedSettingsTask().execute(self.shared_settings)
+
+        for project in self.projects:
+            project.customer.refresh_from_db()
+            self.assertEqual(project.customer.quotas.get(name='nc_service_count').usage, 1)
+            self.assertEqual(project.quotas.get(name='nc_service_project_link_count').usage, 1)
+
+    def test_task_is_idempotent(self):
+        tasks.ConnectSharedSettingsTask().execute(self.shared_settings)
+        tasks.ConnectSharedSettingsTask().execute(self.shared_settings)
+
+        self.assertEqual(models.TestService.objects.filter(settings=self.shared_settings).count(), 3)
+        self.assertEqual(models.TestServiceProjectLink.objects.filter(
+            service__settings=self.shared_settings).count(), 3)
+
+    def test_existing_service_is_linked_to_new_projects(self):
+        customer = self.projects[0].customer
+        service = models.TestService.objects.create(
+            customer=customer, settings=self.shared_settings, available_for_all=False)
+
+        tasks.ConnectSharedSettingsTask().execute(self.shared_settings)
+
+        self.assertTrue(models.TestServiceProjectLink.objects.filter(
+            project=self.projects[0], service=service).exists())
+
+    def test_created_services_are_not_linked_again_by_service_handler(self):
+        with mock.patch.object(linking, '_create_links', wraps=linking._create_links) as create_links_mock:
+            linking.connect_shared_settings(self.shared_settings)
+
+        # links of all services of the chunk are created with one call.
+        self.assertEqual(create_links_mock.call_count, 1)
+        self.assertEqual(models.TestServiceProjectLink.objects.filter(
+            service__settings=self.shared_settings).count(), 3)
+
+    def test_customers_are_processed_by_chunks(self):
+        linking.connect_shared_settings(self.shared_settings, chunk_size=2)
+
+        self.assertEqual(models.TestServiceProjectLink.objects.filter(
+            service__settings=self.shared_settings).count(), 3)
+
+
+class TestInstancePullTask(tasks.BackgroundPullTask):
+
+    def pull(self, instance):
+        instance.used_backend = instance.get_backend()
+        if instance.name == 'broken':
+            raise ServiceBackendError('Backend is not available.')
+        if instance.name == 'invalid':
+            raise ValueError('Unexpected backend response.')
+
+
+class TestInstanceListPullTask(tasks.BackgroundListPullTask):
+    model = models.TestNewInstance
+    pull_task = TestInstancePullTask
+    chunk_size = 2
+
+
+class BackgroundListPullTaskTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        link = factories.TestServiceProjectLinkFactory()
+        self.instances = [
+            factories.TestNewInstanceFactory(service_project_link=link, state=models.TestNewInstance.States.OK,
+                                             backend_id='backend_%s' % i)
+            for i in range(5)
+        ]
+        self.other_instance = factories.TestNewInstanceFactory(
+            state=models.TestNewInstance.States.OK, backend_id='other_backend')
+
+    @mock.patch('waldur_core.structure.tasks.chain')
+    def test_chunks_of_one_settings_are_distributed_between_limited_number_of_chains(self, chain_mock):
+        TestInstanceListPullTask().run()
+
+        chunks = sorted(len(call[0]) for call in chain_mock.call_args_list)
+        # 3 chunks of first settings are pulled by 2 chains, chunk of other settings is pulled by own chain
+        self.assertEqual(chunks, [1, 1, 2])
+
+    def test_chunk_is_pulled_through_shared_backend(self):
+        instances = list(models.TestNewInstance.objects.filter(pk__in=[i.pk for i in self.instances]))
+
+        TestInstancePullTask().pull_chunk(instances)
+
+        self.assertEqual(len(set(id(instance.used_backend) for instance in instances)), 1)
+
+    def test_failed_instances_are_marked_as_erred_and_others_are_pulled(self):
+        broken = self.instances[0]
+        broken.name = 'broken'
+        broken.save()
+        instances = list(models.TestNewInstance.objects.filter(pk__in=[i.pk for i in self.instances]))
+
+        failed_count = TestInstancePullTask().pull_chunk(instances)
+
+        self.assertEqual(failed_count, 1)
+        broken.refresh_from_db()
+        self.assertEqual(broken.state, models.TestNewInstance.States.ERRED)
+        self.assertEqual(models.TestNewInstance.objects.filter(state=models.TestNewInstance.States.OK).count(), 5)
+
+    def test_unexpected_error_does_not_stop_pulling_of_chunk(self):
+        invalid = self.instances[0]
+        invalid.name = 'invalid'
+        invalid.save()
+        instances = list(models.TestNewInstance.objects.filter(pk__in=[i.pk for i in self.instances]))
+
+        failed_count = TestInstancePullTask().pull_chunk(instances)
+
+        self.assertEqual(failed_count, 1)
+        invalid.refresh_from_db()
+        self.assertEqual(invalid.state, models.TestNewInstance.States.ERRED)
+        self.assertTrue(all(hasattr(instance, 'used_backend') for instance in instances[1:]))
+
+    @mock.patch('waldur_core.structure.tasks.chain')
+    def test_chains_are_not_scheduled_while_previous_chains_are_in_progress(self, chain_mock):
+        TestInstanceListPullTask().run()
+        TestInstanceListPullTask().run()
+
+        self.assertEqual(chain_mock.call_count, 3)
+
+    @mock.patch('waldur_core.structure.tasks.chain')
+    def test_chains_are_scheduled_again_when_last_chunks_are_pulled(self, chain_mock):
+        TestInstanceListPullTask().run()
+        for call in chain_mock.call_args_list:
+            last_chunk = call[0][-1]
+            last_chunk.apply()
+
+        TestInstanceListPullTask().run()
+
+        self.assertEqual(chain_mock.call_count, 6)
+
+
+class EagerChain(object):
+    """ Execute chain tasks one by one in current process, call errback if task fails """
+
+    def __init__(self, *tasks):
+        self.tasks = tasks
+
+    def apply_async(self, link_error=None):
+        for task in self.tasks:
+            if task.apply().failed():
+                if link_error is not None:
+                    link_error.apply()
+                return
+
+
+class SettingsListPullTask(tasks.BackgroundListPullTask):
+    model = models.TestNewInstance
+    pull_task = TestInstancePullTask
+
+
+@override_waldur_core_settings(BACKGROUND_PULL={'CHUNK_SIZE': 2, 'MAX_CONCURRENCY': 2})
+@mock.patch('waldur_core.structure.tasks.chain', EagerChain)
+class ChunkedPullTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.link = factories.TestServiceProjectLinkFactory()
+        self.instances = [
+            factories.TestNewInstanceFactory(service_project_link=self.link, state=models.TestNewInstance.States.OK,
+                                             backend_id='backend_%s' % i, name='broken' if i == 2 else 'instance')
+            for i in range(5)
+        ]
+        self.task = SettingsListPullTask()
+        self.lease_key = self.task.get_chains_lease_key(self.link.service.settings_id)
+
+    def test_objects_are_pulled_by_chunks_if_chunk_size_is_defined_in_settings(self):
+        self.task.run()
+
+        states = dict(models.TestNewInstance.objects.values_list('name', 'state'))
+        self.assertEqual(states['broken'], models.TestNewInstance.States.ERRED)
+        self.assertEqual(states['instance'], models.TestNewInstance.States.OK)
+        self.assertIsNone(cache.get(self.lease_key))
+
+    @mock.patch.object(TestInstancePullTask, 'pull_chunk', side_effect=DatabaseError('Database is not available.'))
+    def test_lease_is_released_if_chain_is_stopped_by_failed_chunk(self, pull_chunk_mock):
+        self.task.run()
+
+        # each of two chains is stopped after its first chunk
+        self.assertEqual(pull_chunk_mock.call_count, 2)
+        self.assertIsNone(cache.get(self.lease_key))
@@ -1,5 +1,7 @@
 import collections
+from contextlib import contextmanager
 import logging
+import threading
 
 from django.db import models
 from django.db.migrations.topological_sort import stable_topological_sort
@@ -11,6 +13,7 @@ from . import SupportedServices
 logger = logging.getLogger(__name__)
 Coordinates = collections.namedtuple('Coordinates', ('latitude', 'longitude'))
 FieldInfo = collections.namedtuple('FieldInfo', 'fields fields_required extra_fields_required')
+_locals = threading.local()
 
 
 class GeoIpException(Exception):
@@ -148,3 +151,31 @@ def handle_resource_update_success(resource):
         resource.save(update_fields=update_fields)
     logger.warning('%s %s (PK: %s) was successfully updated.' % (
         resource.__class__.__name__, resource, resource.pk))
+
+
+@contextmanager
+def shared_backends():
+    """ Reuse one backend instance per service settings inside context.
+
+        Backends created with extra arguments are not shared.
+    """
+    if getattr(_locals, 'backends', None) is not None:
+        yield
+        return
+
+    _locals.backends = {}
+    try:
+        yield
+    finally:
+        del _locals.backends
+
+
+def get_service_backend(service_settings, **kwargs):
+    backend_class = SupportedServices.get_service_backend(service_settings.type)
+    backends = getattr(_locals, 'backends', None)
+    if backends is None or kwargs or service_settings.pk is None:
+        return backend_class(service_settings, **kwargs)
+
+    if service_settings.pk not in backends:
+        backends[service_settings.pk] = backend_class(service_settings)
+    return backends[service_settings.pk]
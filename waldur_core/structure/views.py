@@ -1,14 +1,17 @@
 from __future__ import unicode_literals
 
 import logging
+import operator
 import time
+import uuid
 from collections import defaultdict
-from functools import partial
+from functools import partial, reduce
 
 from django.conf import settings as django_settings
 from django.contrib import auth
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction, IntegrityError
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.http import Http404
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
@@ -21,7 +24,6 @@ from rest_framework import serializers as rf_serializers
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.exceptions import PermissionDenied, MethodNotAllowed, NotFound, APIException, ValidationError
 from rest_framework.response import Response
-from reversion.models import Version
 import six
 
 from waldur_core.core import managers as core_managers
@@ -34,7 +36,8 @@ from waldur_core.core import views as core_views
 from waldur_core.core.utils import datetime_to_timestamp, sort_dict
 from waldur_core.logging import models as logging_models
 from waldur_core.logging.loggers import expand_alert_groups
-from waldur_core.quotas.models import QuotaModelMixin, Quota
+from waldur_core.quotas.models import QuotaModelMixin, Quota, QuotaUsageSample
+from waldur_core.structure import counters as structure_counters
 from waldur_core.structure import (
     SupportedServices, ServiceBackendError, ServiceBackendNotImplemented,
     filters, managers, models, permissions, serializers)
@@ -988,14 +991,24 @@ class ResourceSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = serializers.SummaryResourceSerializer
     filter_backends = (filters.GenericRoleFilter, filters.ResourceSummaryFilterBackend, filters.TagsFilter)
 
+    # query parameters that could be handled by resource index: {parameter: index field}
+    index_filters = {
+        'customer': 'customer__uuid',
+        'customer_uuid': 'customer__uuid',
+        'project': 'project__uuid',
+        'project_uuid': 'project__uuid',
+    }
+
     def get_queryset(self):
+        resource_models = self.get_resource_models()
+        queryset = managers.ResourceSummaryQuerySet(resource_models.values())
+        return serializers.SummaryResourceSerializer.eager_load(queryset)
+
+    def get_resource_models(self):
         resource_models = {k: v for k, v in SupportedServices.get_resource_models().items()}
         resource_models = self._filter_by_category(resource_models)
         resource_models = self._filter_by_types(resource_models)
-        resource_models = self._filter_resources(resource_models)
-
-        queryset = managers.ResourceSummaryQuerySet(resource_models.values())
-        return serializers.SummaryResourceSerializer.eager_load(queryset)
+        return self._filter_resources(resource_models)
 
     def _filter_by_types(self, resource_models):
         types = self.request.query_params.getlist('resource_type', None)
@@ -1143,10 +1156,37 @@ class ResourceSummaryViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
                 "GitLab.Group": 8
             }
         """
+        index_counts = self._count_by_index()
+        if index_counts is not None:
+            return Response(index_counts)
+
         queryset = self.filter_queryset(self.get_queryset())
         return Response({SupportedServices.get_name_for_model(qs.model): qs.count()
                          for qs in queryset.querysets})
 
+    def _count_by_index(self):
+        """ Count resources with one query to resource index if all query parameters are supported by index """
+        filters = {}
+        for param, value in self.request.query_params.items():
+            if param in ('resource_type', 'resource_category'):
+                continue
+            if param not in self.index_filters:
+                return None
+            try:
+                uuid.UUID(value)
+            except ValueError:
+                return None
+            filters[self.index_filters[param]] = value
+
+        content_types = {ContentType.objects.get_for_model(model).id: model
+                         for model in self.get_resource_models().values()}
+        index = models.ResourceIndex.objects.filter(content_type_id__in=content_types, **filters)
+        index = filter_queryset_for_user(index, self.request.user)
+        counts = dict(index.order_by().values('content_type_id').annotate(
+            count=Count('id')).values_list('content_type_id', 'count'))
+        return {SupportedServices.get_name_for_model(model): counts.get(content_type_id, 0)
+                for content_type_id, model in content_types.items()}
+
 
 class ServicesViewSet(mixins.ListModelMixin,
                       viewsets.GenericViewSet):
@@ -1185,10 +1225,22 @@ class BaseCounterView(viewsets.GenericViewSet):
     # Fix for schema generation
     queryset = []
     extra_counters = {}
+    # counters of resources, calculated together with one grouped query: {name: function that returns models}
+    resource_counters = {}
+    extra_resource_counters = {}
+    # counters that depend on request parameters and are not cached
+    uncached_counters = ()
 
     @classmethod
-    def register_counter(cls, name, func):
-        cls.extra_counters[name] = func
+    def register_counter(cls, name, func=None, resource_models=None):
+        """ Register extra counter. It is calculated either by function that accepts counted object
+            or by resource index, if function that returns list of resource models is specified.
+            Resource counters are calculated together and cached.
+        """
+        if resource_models is not None:
+            cls.extra_resource_counters[name] = resource_models
+        else:
+            cls.extra_counters[name] = func
 
     def get_counters(self):
         counters = self.get_fields()
@@ -1196,19 +1248,75 @@ class BaseCounterView(viewsets.GenericViewSet):
             counters[name] = partial(func, self.object)
         return counters
 
+    def get_resource_counters(self):
+        resource_counters = dict(self.resource_counters)
+        resource_counters.update(self.extra_resource_counters)
+        return resource_counters
+
     def list(self, request, uuid=None):
-        result = {}
         counters = self.get_counters()
-        fields = request.query_params.getlist('fields') or counters.keys()
-        for field, func in counters.items():
-            if field in fields:
-                result[field] = func()
-
+        resource_counters = self.get_resource_counters()
+        fields = request.query_params.getlist('fields') or list(counters) + list(resource_counters)
+        fields = set(fields) & (set(counters) | set(resource_counters))
+
+        cache_key = self.get_cache_key()
+        cached = structure_counters.get_counters(cache_key) if cache_key else {}
+        result = {field: cached[field] for field in fields
+                  if field in cached and field not in self.uncached_counters}
+
+        missing_resource_counters = {name: resource_counters[name] for name in fields
+                                     if name in resource_counters and name not in result}
+        if missing_resource_counters:
+            result.update(self._count_resources(missing_resource_counters))
+
+        for field in fields:
+            if field not in result:
+                result[field] = counters[field]()
+
+        if cache_key:
+            structure_counters.set_counters(cache_key, {
+                field: value for field, value in result.items()
+                if field not in self.uncached_counters and field not in self.extra_counters})
         return Response(result)
 
     def get_fields(self):
         raise NotImplementedError()
 
+    def get_cache_key(self):
+        """ Return cache key of counters or None if counters are not cached. """
+        customer_id = self.get_customer_id()
+        if customer_id is None:
+            return None
+        return structure_counters.get_key(customer_id, self.object, self.get_role_key())
+
+    def get_customer_id(self):
+        """ Return ID of customer whose changes invalidate counters. Counters are not cached if it is None. """
+        return None
+
+    def get_role_key(self):
+        """ Return class of user role: users that see all objects of counted object share counters. """
+        raise NotImplementedError()
+
+    def get_resource_index_filter(self):
+        raise NotImplementedError()
+
+    def _count_resources(self, resource_counters):
+        """ Calculate resource counters with one query grouped by resource type """
+        index = models.ResourceIndex.objects.filter(**self.get_resource_index_filter())
+        index = filter_queryset_for_user(index, self.request.user)
+        counts = dict(index.order_by().values('content_type_id').annotate(
+            count=Count('id')).values_list('content_type_id', 'count'))
+
+        result = {}
+        for name, get_models in resource_counters.items():
+            content_types = ContentType.objects.get_for_models(*get_models()).values()
+            result[name] = sum(counts.get(content_type.id, 0) for content_type in content_types)
+        return result
+
+    def _is_global_user(self):
+        user = self.request.user
+        return user.is_staff or user.is_support
+
     def _get_alerts(self, aggregate_by):
         alert_types_to_exclude = expand_alert_groups(self.request.query_params.getlist('exclude_features'))
         return filters.filter_alerts_by_aggregate(
@@ -1238,6 +1346,8 @@ class CustomerCountersView(BaseCounterView):
     """
     lookup_field = 'uuid'
     extra_counters = {}
+    extra_resource_counters = {}
+    uncached_counters = ('alerts',)
 
     def get_queryset(self):
         return filter_queryset_for_user(models.Customer.objects.all().only('pk', 'uuid'), self.request.user)
@@ -1250,6 +1360,17 @@ class CustomerCountersView(BaseCounterView):
             'users': self.get_users
         }
 
+    def get_customer_id(self):
+        return self.object.pk
+
+    def get_role_key(self):
+        if self._is_global_user() or self.object.has_user(self.request.user):
+            return 'all'
+        return 'user:%s' % self.request.user.pk
+
+    def get_resource_index_filter(self):
+        return {'customer': self.object}
+
     def get_alerts(self):
         return self._get_alerts('customer')
 
@@ -1257,19 +1378,14 @@ class CustomerCountersView(BaseCounterView):
         return self.object.get_users().count()
 
     def get_projects(self):
-        return self._count_model(models.Project)
+        qs = filter_queryset_for_user(models.Project.objects.filter(customer=self.object), self.request.user)
+        return qs.count()
 
     def get_services(self):
-        models = [item['service'] for item in SupportedServices.get_service_models().values()]
-        return self._total_count(models)
-
-    def _total_count(self, models):
-        return sum(self._count_model(model) for model in models)
-
-    def _count_model(self, model):
-        qs = model.objects.filter(customer=self.object).only('pk')
-        qs = filter_queryset_for_user(qs, self.request.user)
-        return qs.count()
+        service_models = [item['service'] for item in SupportedServices.get_service_models().values()]
+        queryset = core_managers.SummaryQuerySet(service_models).filter(customer=self.object)
+        queryset.querysets = [filter_queryset_for_user(qs, self.request.user) for qs in queryset.querysets]
+        return queryset.count()
 
 
 class ProjectCountersView(BaseCounterView):
@@ -1289,47 +1405,44 @@ class ProjectCountersView(BaseCounterView):
     """
     lookup_field = 'uuid'
     extra_counters = {}
+    extra_resource_counters = {}
+    resource_counters = {
+        'vms': lambda: models.VirtualMachine.get_all_models(),
+        'apps': lambda: models.ApplicationMixin.get_all_models(),
+        'private_clouds': lambda: models.PrivateCloud.get_all_models(),
+        'storages': lambda: models.Storage.get_all_models(),
+    }
+    uncached_counters = ('alerts',)
 
     def get_queryset(self):
-        return filter_queryset_for_user(models.Project.objects.all().only('pk', 'uuid'), self.request.user)
+        return filter_queryset_for_user(
+            models.Project.objects.all().only('pk', 'uuid', 'customer'), self.request.user)
 
     def get_fields(self):
         fields = {
             'alerts': self.get_alerts,
-            'vms': self.get_vms,
-            'apps': self.get_apps,
-            'private_clouds': self.get_private_clouds,
-            'storages': self.get_storages,
             'users': self.get_users
         }
         return fields
 
-    def get_alerts(self):
-        return self._get_alerts('project')
-
-    def get_vms(self):
-        return self._total_count(models.VirtualMachine.get_all_models())
+    def get_customer_id(self):
+        return self.object.customer_id
 
-    def get_apps(self):
-        return self._total_count(models.ApplicationMixin.get_all_models())
+    def get_role_key(self):
+        user = self.request.user
+        if self._is_global_user() or self.object.has_user(user) or self.object.customer.has_user(user):
+            return 'all'
+        return 'user:%s' % user.pk
 
-    def get_private_clouds(self):
-        return self._total_count(models.PrivateCloud.get_all_models())
+    def get_resource_index_filter(self):
+        return {'project': self.object}
 
-    def get_storages(self):
-        return self._total_count(models.Storage.get_all_models())
+    def get_alerts(self):
+        return self._get_alerts('project')
 
     def get_users(self):
         return self.object.get_users().count()
 
-    def _total_count(self, models):
-        return sum(self._count_model(model) for model in models)
-
-    def _count_model(self, model):
-        qs = model.objects.filter(project=self.object).only('pk')
-        qs = filter_queryset_for_user(qs, self.request.user)
-        return qs.count()
-
 
 class UserCountersView(BaseCounterView):
     """
@@ -1549,7 +1662,7 @@ class BaseServiceViewSet(core_mixins.EagerLoadMixin, core_views.ActionsViewSet):
     unlink.destructive = True
 
 
-class BaseServiceProjectLinkViewSet(core_views.ActionsViewSet):
+class BaseServiceProjectLinkViewSet(core_mixins.EagerLoadMixin, core_views.ActionsViewSet):
     queryset = NotImplemented
     serializer_class = NotImplemented
     filter_backends = (filters.GenericRoleFilter, DjangoFilterBackend)
@@ -1648,11 +1761,10 @@ class QuotaTimelineStatsView(views.APIView):
         items = request.query_params.getlist('item') or self.get_all_spls_quotas()
 
         collector = QuotaTimelineCollector()
-        for item in items:
-            for scope in scopes:
-                values = self.get_stats_for_scope(item, scope, ranges)
-                for (end, start), (limit, usage) in zip(ranges, values):
-                    collector.add_quota(start, end, item, limit, usage)
+        quotas = self.get_quotas(scopes, items)
+        samples = QuotaUsageSample.get_for_points([quota.id for quota in quotas], [end for end, start in ranges])
+        for quota in quotas:
+            collector.add_quota_samples(ranges, quota.name, samples[quota.id])
 
         stats = list(map(sort_dict, collector.to_dict()))[::-1]
         return Response(stats, status=status.HTTP_200_OK)
@@ -1676,25 +1788,16 @@ class QuotaTimelineStatsView(views.APIView):
                       for m in models.ServiceProjectLink.get_all_models()]
         return sum([spl_model.get_quotas_names() for spl_model in spl_models], [])
 
-    def get_stats_for_scope(self, quota_name, scope, dates):
-        stats_data = []
-        try:
-            quota = scope.quotas.get(name=quota_name)
-        except Quota.DoesNotExist:
-            return stats_data
-        versions = Version.objects.get_for_object(quota).select_related('revision').filter(
-            revision__date_created__lte=dates[0][0]).iterator()
-        version = None
-        for end, start in dates:
-            try:
-                while version is None or version.revision.date_created > end:
-                    version = next(versions)
-                stats_data.append((version._object_version.object.limit,
-                                   version._object_version.object.usage))
-            except StopIteration:
-                break
-
-        return stats_data
+    def get_quotas(self, scopes, quota_names):
+        """ Fetch quotas of all scopes with one query. """
+        scopes_ids = defaultdict(set)
+        for scope in scopes:
+            scopes_ids[ContentType.objects.get_for_model(scope)].add(scope.id)
+        if not scopes_ids:
+            return []
+        query = reduce(operator.or_, [Q(content_type=content_type, object_id__in=ids)
+                                      for content_type, ids in scopes_ids.items()])
+        return list(Quota.objects.filter(query, name__in=quota_names))
 
     def get_ranges(self, request):
         mapped = {
@@ -1749,6 +1852,13 @@ class QuotaTimelineCollector(object):
         self.ranges.add((start, end))
         self.items.add(item)
 
+    def add_quota_samples(self, ranges, item, samples):
+        """ Add quota samples for each (end, start) range. Ranges are sorted from the latest one. """
+        for (end, start), sample in zip(ranges, samples):
+            if sample is None:
+                break
+            self.add_quota(start, end, item, sample.limit, sample.usage)
+
     def to_dict(self):
         table = []
         for start, end in sorted(self.ranges):